@@ -18,6 +18,7 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import multiprocessing
 import os
 import sys
 from sys import platform as _platform
@@ -48,6 +49,8 @@ theme_path = os.path.join(style_path, "dark_orange.xml")
 qss_path = os.path.join(style_path, "qt_material.css")
 
 def main():
+    # worker processes of frozen executables (e.g. the batch integration) have to stop here
+    multiprocessing.freeze_support()
     app = QtWidgets.QApplication([])
 
     apply_stylesheet(
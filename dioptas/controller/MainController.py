@@ -285,6 +285,7 @@ class MainController(object):
         """
         Intervention of the Dioptas close event to save settings before closing the Program.
         """
+        self.integration_controller.batch_controller.stop_job()
         if self.use_settings:
             self.save_default_settings()
             self.save_directories()
@@ -29,6 +29,8 @@ from qtpy import QtWidgets, QtCore
 from pyqtgraph import makeQImage
 
 from ...model.util.HelperModule import get_partial_value, get_partial_index
+from ...model.util.ImagePyramid import ImagePyramid
+from ...model.util.WorkerThread import WorkerThread
 from ...widgets.UtilityWidgets import (
     get_progress_dialog,
     open_files_dialog,
@@ -65,6 +67,16 @@ class BatchController(object):
         self.min_val = {"lin": 0, "sqrt": 0.1, "log": 0.1, "current": 0}
         self.size_threshold = 500000
 
+        # min/max/mean pyramid of the scaled 2D batch plot, reused as long as the plotted data and scaling are the same
+        self.pyramid = ImagePyramid()
+        self._pyramid_key = None
+        self._pyramid_refs = None
+        # patterns of a running integration, which are shown while it continues
+        self._live_data = None
+        self._live_rows = 0
+        # running integration or background extraction, only one job runs at a time
+        self._worker = None
+
     def create_signals(self):
         """
         Creates all the connections of the GUI elements.
@@ -547,7 +559,7 @@ class BatchController(object):
         """
         Extract background from batch data
         """
-        if self.model.batch_model.n_img is None:
+        if self.model.batch_model.n_img is None or self.job_running:
             return
 
         progress_dialog = get_progress_dialog(
@@ -557,18 +569,15 @@ class BatchController(object):
             self.widget.batch_widget,
         )
 
-        def callback_fn(current_index):
-            if progress_dialog.wasCanceled():
-                return False
-            progress_dialog.setValue(current_index)
-            QtWidgets.QApplication.processEvents()
-            return ~progress_dialog.wasCanceled()
-
         parameters = (
             self.widget.integration_control_widget.background_control_widget.get_bkg_pattern_parameters()
         )
-        self.model.batch_model.extract_background(parameters, callback_fn)
-        progress_dialog.close()
+        worker = WorkerThread(
+            lambda callback_fn, _: self.model.batch_model.extract_background(
+                parameters, callback_fn
+            )
+        )
+        self._run_worker(worker, progress_dialog)
 
     def set_hard_minimum(self, ev, scale):
         if ev.button() == QtCore.Qt.RightButton:
@@ -821,7 +830,8 @@ class BatchController(object):
         self.load_single_image(1, 0)
 
         if self.model.calibration_model.is_calibrated:
-            self.integrate()
+            # the patterns are only kept in memory, the loaded file is not overwritten
+            self.integrate_images()
 
     def load_previous_folder(self):
         filenames = self.model.batch_model.get_previous_folder_filenames()
@@ -924,18 +934,13 @@ class BatchController(object):
         """
         Plot batch of diffraction patters taking into account scale abd background subtraction
         """
-        data = self.model.batch_model.data
-        bkg = self.model.batch_model.bkg
-        if data is None:
+        batch_model = self.model.batch_model
+        if batch_model.data is None:
             return
-        if (
+        subtract_background = (
             self.widget.batch_widget.options_widget.background_btn.isChecked()
-            and bkg is not None
-        ):
-            data = data - bkg
-        if self.min_val.get("current", None) is not None:
-            data[data < self.min_val["current"]] = self.min_val["current"]
-        data = self.scale(data)
+            and batch_model.bkg is not None
+        )
 
         start_x, stop_x = self._get_x_range()
         if stop is None:
@@ -951,9 +956,11 @@ class BatchController(object):
                 )
             )
 
+        # only the visible window of the batch data is read and processed
         if self.widget.batch_widget.mode_widget.view_2d_btn.isChecked():
-            self.widget.batch_widget.stack_plot_widget.img_view.plot_image(
-                data[start : stop + 1, start_x:stop_x], True, [start_x, stop_x]
+            self.update_pyramid(start, stop, start_x, stop_x, subtract_background)
+            self.widget.batch_widget.stack_plot_widget.img_view.plot_pyramid(
+                self.pyramid, True, [start_x, stop_x]
             )
             self.update_axes_range()
             self.update_linear_region()
@@ -964,19 +971,84 @@ class BatchController(object):
                     self.widget.batch_widget.position_widget.step_series_widget.step_txt.text()
                 )
             )
-            step_min = max(1, int(data[start : stop + 1].size / self.size_threshold))
+            num_rows = len(range(batch_model.data.shape[0])[start : stop + 1])
+            step_min = max(
+                1, int(num_rows * batch_model.data.shape[1] / self.size_threshold)
+            )
             if step < step_min:
                 step = step_min
                 self.widget.batch_widget.position_widget.step_series_widget.step_txt.setValue(
                     step
                 )
+            data = self._scale_window(
+                batch_model.get_data_window(
+                    start, stop + 1, step, start_x, stop_x, subtract_background
+                )
+            )
             self.widget.batch_widget.surface_widget.surface_view.plot_surface(
-                data[start : stop + 1 : step, start_x:stop_x], start, step
+                data, start, step
             )
-            self.update_3d_axis(data[start : stop + 1 : step, start_x:stop_x])
+            self.update_3d_axis(data)
 
         self.model.enabled_phases_in_cake.emit()
 
+    def update_pyramid(self, start, stop, start_x, stop_x, subtract_background):
+        """
+        Sets the window of the batch data shown in the 2D plot as source of the image pyramid. The pyramid is only
+        reset if the data, background or scaling changed, rows appended to the window are added incrementally.
+        """
+        batch_model = self.model.batch_model
+        num_rows = len(range(batch_model.data.shape[0])[start : stop + 1])
+        num_cols = len(range(batch_model.data.shape[1])[start_x:stop_x])
+
+        def source(row_start, row_stop):
+            return self._scale_window(
+                batch_model.get_data_window(
+                    start + row_start,
+                    start + row_stop,
+                    1,
+                    start_x,
+                    stop_x,
+                    subtract_background,
+                )
+            )
+
+        # the references keep the ids of the key from being reused by new arrays
+        refs = (batch_model.data, batch_model.bkg)
+        key = (
+            id(refs[0]),
+            id(refs[1]),
+            subtract_background,
+            self.scale,
+            self.min_val.get("current", None),
+            start,
+            start_x,
+            stop_x,
+        )
+        if key == self._pyramid_key and num_rows >= self.pyramid.shape[0]:
+            self.pyramid.source = source
+            self.pyramid.update(self.pyramid.shape[0], shape=(num_rows, num_cols))
+        else:
+            self.pyramid.set_source(source, (num_rows, num_cols))
+        self._pyramid_key = key
+        self._pyramid_refs = refs
+
+    def reset_pyramid(self):
+        """
+        Discards the image pyramid, e.g. after the batch data was changed in place.
+        """
+        self._pyramid_key = None
+        self._pyramid_refs = None
+        self.pyramid.set_source(None, (0, 0))
+
+    def _scale_window(self, data):
+        """
+        Applies the minimum value and the scaling to a window of the batch data
+        """
+        if self.min_val.get("current", None) is not None:
+            data[data < self.min_val["current"]] = self.min_val["current"]
+        return self.scale(data)
+
     def _get_x_range(self):
         """
         Return bin-x range of the batch plot
@@ -1157,19 +1229,16 @@ class BatchController(object):
         """
         Create waterfall plot based on position and size of rectangle
         """
-        data = self.model.batch_model.data
+        batch_model = self.model.batch_model
         start_x, stop_x = self._get_x_range()
         start = int(
             str(
                 self.widget.batch_widget.position_widget.step_series_widget.start_txt.text()
             )
         )
-        binning = self.model.batch_model.binning
-        bkg = self.model.batch_model.bkg
-        if data is None:
+        binning = batch_model.binning
+        if batch_model.data is None:
             return
-        if self.widget.batch_widget.options_widget.background_btn.isChecked():
-            data = data - bkg
 
         rect = self.rect.rect()
         y1, y2 = sorted((int(rect.top()), int(rect.bottom())))
@@ -1180,7 +1249,7 @@ class BatchController(object):
         x2 += start_x
 
         y1 = max(y1, 0)
-        y2 = min(y2, data.shape[0])
+        y2 = min(y2, batch_model.data.shape[0])
         x1 = max(x1, start_x)
         x2 = min(x2, stop_x)
 
@@ -1193,12 +1262,19 @@ class BatchController(object):
         new_binning = self.convert_x_value(
             binning[x1:x2], "2th_deg", self.model.current_configuration.integration_unit
         )
-        for i in range(y1, y2, step):
-            f_name, pos = self.model.batch_model.get_image_info(i)
+        # only the patterns inside of the rectangle are read
+        data = batch_model.get_data_window(
+            y1,
+            y2,
+            step,
+            x1,
+            x2,
+            self.widget.batch_widget.options_widget.background_btn.isChecked(),
+        )
+        for i, y in zip(range(y1, y2, step), data):
+            f_name, pos = batch_model.get_image_info(i)
             f_name = os.path.basename(f_name)
-            self.model.overlay_model.add_overlay(
-                new_binning, data[i, x1:x2], f"{f_name}, {pos}"
-            )
+            self.model.overlay_model.add_overlay(new_binning, y, f"{f_name}, {pos}")
         separation = (
             self.widget.integration_control_widget.overlay_control_widget.waterfall_separation_msb.value()
         )
@@ -1399,15 +1475,16 @@ class BatchController(object):
         data_img_item = (
             self.widget.batch_widget.stack_plot_widget.img_view.data_img_item
         )
-        img_data = self.model.batch_model.data[start : stop + 1]
+        num_rows = len(range(self.model.batch_model.data.shape[0])[start : stop + 1])
 
         height = img_view_box.viewRect().height()
         bottom = img_view_box.viewRect().top()
-        bound = data_img_item.boundingRect().height()
+        # the image item is scaled when a reduced level of the pyramid is shown
+        bound = data_img_item.mapRectToParent(data_img_item.boundingRect()).height()
 
         if bound == 0:
             return
-        v_scale = img_data.shape[0] / bound
+        v_scale = num_rows / bound
         min_y = v_scale * bottom + start
         max_y = v_scale * (bottom + height) + start
 
@@ -1417,21 +1494,43 @@ class BatchController(object):
 
     def integrate(self):
         """
-        Integrate images in the batch
+        Integrate images in the batch. If streaming is enabled, the patterns are streamed into a processed file chosen
+        by the user, otherwise they are only kept in memory.
         """
+        if self.job_running or not self._can_integrate():
+            return
+        if not self.widget.batch_widget.control_widget.stream_cb.isChecked():
+            self.integrate_images()
+            return
+        start, stop, step, use_all = self._get_integration_range()
+        output_file = self.get_integration_output_file()
+        if output_file == "":
+            return
+        resume = self.ask_for_resume(output_file, start, stop + 1, step, use_all)
+        if resume is None:
+            return
+        self.integrate_images(output_file, resume)
+
+    def _can_integrate(self):
         if not self.model.calibration_model.is_calibrated:
             self.widget.show_error_msg(
                 "Can not integrate multiple images without calibration."
             )
-            return
+            return False
         if (
             not self.model.batch_model.raw_available
             or self.model.batch_model.n_img_all < 1
         ):
             self.widget.show_error_msg("No images loaded for integration")
-            return
+            return False
+        return True
 
-        if self.widget.batch_widget.mode_widget.view_f_btn.isChecked():
+    def _get_integration_range(self):
+        """
+        :return: start, stop (inclusive), step and use_all of the images selected for the integration
+        """
+        use_all = self.widget.batch_widget.mode_widget.view_f_btn.isChecked()
+        if use_all:
             start, stop, step = (
                 self.widget.batch_widget.position_widget.step_raw_widget.get_image_range()
             )
@@ -1439,6 +1538,20 @@ class BatchController(object):
             start, stop, step = (
                 self.widget.batch_widget.position_widget.step_series_widget.get_image_range()
             )
+        return start, stop, step, use_all
+
+    def integrate_images(self, output_file=None, resume=False):
+        """
+        Integrates the selected images of the batch.
+        :param output_file: processed file into which the patterns are streamed, if None they are only kept in memory
+        :param resume: resume a previous integration in output_file, see BatchModel.integrate_raw_data
+        """
+        if self.job_running or not self._can_integrate():
+            return
+        start, stop, step, use_all = self._get_integration_range()
+        job = self.model.batch_model.prepare_integration(start, stop + 1, step, use_all, output_file, resume)
+        if job is None:
+            return
 
         n_int = (stop - start) / step
         progress_dialog = get_progress_dialog(
@@ -1448,22 +1561,23 @@ class BatchController(object):
             self.widget.batch_widget,
         )
 
-        def callback_fn(current_index):
-            if progress_dialog.wasCanceled():
-                return False
-            progress_dialog.setValue(current_index)
-            QtWidgets.QApplication.processEvents()
-            return ~progress_dialog.wasCanceled()
-
-        self.model.batch_model.integrate_raw_data(
-            start,
-            stop + 1,
-            step,
-            self.widget.batch_widget.mode_widget.view_f_btn.isChecked(),
-            callback_fn=callback_fn,
+        worker = WorkerThread(
+            lambda callback_fn, result_fn: self.model.batch_model.run_integration(job, callback_fn, result_fn)
         )
+        self._live_data = None
+        worker.partial_result.connect(self.show_partial_integration)
+        self._run_worker(worker, progress_dialog, self._finish_integration)
 
-        progress_dialog.close()
+    def _finish_integration(self, result):
+        """
+        Stores the result of an integration in the batch model and shows it.
+        :param result: result of BatchModel.run_integration, None if the integration failed
+        """
+        self._live_data = None
+        self.model.batch_model.set_integration_result(result)
+        self.reset_pyramid()
+        if self.model.batch_model.data is None:
+            return
         self.show_metadata_info()
 
         n_img = self.model.batch_model.n_img
@@ -1485,6 +1599,135 @@ class BatchController(object):
         self.change_view()
         self.widget.batch_widget.stack_plot_widget.img_view.auto_range()
 
+    def get_integration_output_file(self):
+        """
+        Asks the user for the processed file into which the integrated patterns are streamed. Overwriting an existing
+        file is confirmed in ask_for_resume, depending on its content.
+        :return: filename, empty string if the user canceled the dialog
+        """
+        files = self.model.batch_model.files
+        default_name = os.path.splitext(os.path.basename(files[0]))[0] + "_integrated.nxs"
+        return save_file_dialog(
+            self.widget,
+            "Save integrated patterns.",
+            directory=os.path.join(
+                self.model.working_directories.get("batch", os.path.expanduser("~")),
+                default_name,
+            ),
+            filter="Single file Data (*.nxs)",
+            confirm_overwrite=False,
+        )
+
+    def ask_for_resume(self, output_file, start, stop, step, use_all):
+        """
+        Checks whether output_file contains an interrupted integration of the same images with the same calibration,
+        mask and corrections and asks the user whether it should be resumed. A complete previous integration is
+        always reused. Overwriting an existing file with other content has to be confirmed.
+        :return: True if the integration should be resumed, False if output_file is overwritten, None if the
+                 integration is canceled
+        """
+        done = self.model.batch_model.get_integrated_images(
+            output_file, start, stop, step, use_all
+        )
+        if done is None:
+            if not os.path.exists(output_file):
+                return False
+            if QtWidgets.QMessageBox.Yes == QtWidgets.QMessageBox.question(
+                self.widget,
+                "Overwrite file.",
+                f"{os.path.basename(output_file)} does not contain an integration of the same images with the "
+                "current settings.\nShould it be overwritten?",
+                QtWidgets.QMessageBox.Yes,
+                QtWidgets.QMessageBox.No,
+            ):
+                return False
+            return None
+        if np.all(done):
+            return True
+        return QtWidgets.QMessageBox.Yes == QtWidgets.QMessageBox.question(
+            self.widget,
+            "Resume integration.",
+            f"{np.sum(done)} of {len(done)} images are already integrated in {os.path.basename(output_file)}.\n"
+            "Should the previous integration be resumed?",
+            QtWidgets.QMessageBox.Yes,
+            QtWidgets.QMessageBox.No,
+        )
+
+    def _run_worker(self, worker, progress_dialog, finished_fn=None):
+        """
+        Runs a job in a worker thread, while the GUI stays responsive and shows the progress of the job. Cancelling the
+        progress dialog stops the job after the current block. The controls starting other jobs or changing the batch
+        data are disabled until the job is finished.
+        :param finished_fn: function called with the result of the job when it is finished, with None if the job failed
+        """
+        self._worker = worker
+        self._set_job_controls_enabled(False)
+        worker.progress.connect(progress_dialog.setValue)
+        progress_dialog.canceled.connect(worker.cancel)
+        worker.job_finished.connect(lambda: self._worker_finished(worker, progress_dialog, finished_fn))
+        worker.start()
+
+    def _worker_finished(self, worker, progress_dialog, finished_fn):
+        progress_dialog.close()
+        self._worker = None
+        self._set_job_controls_enabled(True)
+        if worker.exception is not None:
+            self.widget.show_error_msg(f"Batch processing failed: {worker.exception}")
+        if finished_fn is not None:
+            finished_fn(worker.result if worker.exception is None else None)
+
+    def _set_job_controls_enabled(self, enabled):
+        self.widget.batch_widget.file_control_widget.setEnabled(enabled)
+        control_widget = self.widget.batch_widget.control_widget
+        for control in (control_widget.integrate_btn, control_widget.stream_cb, control_widget.load_proc_btn,
+                        control_widget.calc_bkg_btn, control_widget.normalize_btn):
+            control.setEnabled(enabled)
+
+    @property
+    def job_running(self):
+        return self._worker is not None
+
+    def stop_job(self):
+        """
+        Cancels a running integration or background extraction and waits until it is stopped, e.g. before closing
+        the program.
+        """
+        if self._worker is not None:
+            self._worker.cancel()
+            self._worker.wait()
+
+    def show_partial_integration(self, binning, intensities, pos_map):
+        """
+        Shows the patterns of a running integration in the 2D plot, the patterns are appended to the shown image.
+        """
+        if self._live_data is None or intensities.shape[1] != self._live_data.shape[1]:
+            self._live_data = np.zeros((len(intensities), intensities.shape[1]))
+            self._live_rows = 0
+        num_rows = self._live_rows
+        if num_rows + len(intensities) > len(self._live_data):
+            # the buffer grows by doubling, to avoid copying all patterns for every block
+            capacity = max(2 * len(self._live_data), num_rows + len(intensities))
+            live_data = np.zeros((capacity, intensities.shape[1]))
+            live_data[:num_rows] = self._live_data[:num_rows]
+            self._live_data = live_data
+        self._live_data[num_rows : num_rows + len(intensities)] = intensities
+        self._live_rows = num_rows + len(intensities)
+        live_data = self._live_data
+        shape = (self._live_rows, live_data.shape[1])
+
+        def source(row_start, row_stop):
+            return self._scale_window(np.array(live_data[row_start:row_stop]))
+
+        if num_rows == 0 or self._pyramid_key != "live":
+            self.pyramid.set_source(source, shape)
+            self._pyramid_key = "live"
+        else:
+            self.pyramid.source = source
+            self.pyramid.update(num_rows, shape=shape)
+        self.widget.batch_widget.stack_plot_widget.img_view.plot_pyramid(
+            self.pyramid, num_rows == 0, [0, shape[1]]
+        )
+
     def set_navigation_raw(self, raw_range=(0, 0)):
         self.widget.batch_widget.position_widget.step_raw_widget.start_txt.setRange(
             *raw_range
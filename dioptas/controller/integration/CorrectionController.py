@@ -51,6 +51,9 @@ class CorrectionController(object):
         self.widget = widget
         self.model = dioptas_model
 
+        # two theta and azimuth arrays of the current calibration in degree, see get_cbn_angle_arrays
+        self._cbn_angle_arrays = None
+
         self.create_signals()
 
     def create_signals(self):
@@ -186,12 +189,7 @@ class CorrectionController(object):
             seat_absorption_length = self.widget.cbn_param_tw.cellWidget(8, 1).value()
             anvil_absorption_length = self.widget.cbn_param_tw.cellWidget(9, 1).value()
 
-            tth_array = (
-                180.0 / np.pi * self.model.calibration_model.pattern_geometry.ttha
-            )
-            azi_array = (
-                180.0 / np.pi * self.model.calibration_model.pattern_geometry.chia
-            )
+            tth_array, azi_array = self.get_cbn_angle_arrays()
 
             new_cbn_correction = CbnCorrection(
                 tth_array=tth_array,
@@ -223,6 +221,19 @@ class CorrectionController(object):
         else:
             self.model.img_model.delete_img_correction("cbn")
 
+    def get_cbn_angle_arrays(self):
+        """
+        Returns the two theta and azimuth arrays of the current calibration in degree. The arrays are only recalculated
+        when the calibration changes, so that all cBN corrections calculated for a calibration share the same arrays
+        and thereby their precomputed geometry and cached results.
+        """
+        ttha = self.model.calibration_model.get_pixel_geometry("tth")
+        chia = self.model.calibration_model.get_pixel_geometry("chi")
+        if self._cbn_angle_arrays is None or self._cbn_angle_arrays[0] is not ttha or \
+                self._cbn_angle_arrays[1] is not chia:
+            self._cbn_angle_arrays = (ttha, chia, 180.0 / np.pi * ttha, 180.0 / np.pi * chia)
+        return self._cbn_angle_arrays[2:]
+
     def cbn_plot_correction_btn_clicked(self):
         if str(self.widget.cbn_plot_btn.text()) == "Plot":
             self.widget.img_widget.plot_image(
@@ -283,8 +294,8 @@ class CorrectionController(object):
             detector_tilt = fit2d_parameter["tilt"]
             detector_tilt_rotation = fit2d_parameter["tiltPlanRotation"]
 
-            tth_array = self.model.calibration_model.pattern_geometry.ttha
-            azi_array = self.model.calibration_model.pattern_geometry.chia
+            tth_array = self.model.calibration_model.get_pixel_geometry("tth")
+            azi_array = self.model.calibration_model.get_pixel_geometry("chi")
             import time
 
             t1 = time.time()
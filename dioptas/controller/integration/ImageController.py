@@ -174,6 +174,7 @@ class ImageController(object):
         self.widget.img_step_file_widget.browse_by_time_rb.clicked.connect(self.set_iteration_mode_time)
 
         self.widget.image_control_widget.sources_cb.currentTextChanged.connect(self.select_source)
+        self.widget.image_control_widget.sources_cb.popup_about_to_show.connect(self.sources_cb_popup_about_to_show)
 
         ###
         # Image widget image specific controls
@@ -265,25 +266,15 @@ class ImageController(object):
 
         if filenames is not None and len(filenames) != 0:
             self.model.working_directories['image'] = os.path.dirname(str(filenames[0]))
-            if len(filenames) == 1:
+            if self.widget.img_batch_mode_dezinger_rb.isChecked():
+                self.model.img_model.combine_files(filenames, 'mad_clip')
+            elif len(filenames) == 1:
                 self.model.img_model.load(str(filenames[0]))
             else:
                 if self.widget.img_batch_mode_add_rb.isChecked():
-                    self.model.img_model.blockSignals(True)
-                    self.model.img_model.load(str(filenames[0]))
-                    for ind in range(1, len(filenames)):
-                        self.model.img_model.add(filenames[ind])
-                    self.model.img_model.blockSignals(False)
-                    self.model.img_model.img_changed.emit()
-                if self.widget.img_batch_mode_average_rb.isChecked():
-                    self.model.img_model.blockSignals(True)
-                    self.model.img_model.load(str(filenames[0]))
-                    for ind in range(1, len(filenames)):
-                        self.model.img_model.add(filenames[ind])
-                    self.model.img_model._img_data = self.model.img_model._img_data / len(filenames)
-                    self.model.img_model._calculate_img_data()
-                    self.model.img_model.blockSignals(False)
-                    self.model.img_model.img_changed.emit()
+                    self.model.img_model.combine_files(filenames, 'sum')
+                elif self.widget.img_batch_mode_average_rb.isChecked():
+                    self.model.img_model.combine_files(filenames, 'mean')
                 elif self.widget.img_batch_mode_integrate_rb.isChecked():
                     self._load_multiple_files(filenames)
                 elif self.widget.img_batch_mode_image_save_rb.isChecked():
@@ -544,15 +535,7 @@ class ImageController(object):
 
         self.widget.image_control_widget.sources_widget.setVisible(not (self.model.img_model.sources is None))
         if self.model.img_model.sources is not None:
-            sources_cb = self.widget.image_control_widget.sources_cb
-            sources_cb.blockSignals(True)
-            # remove all previous items:
-            for _ in range(sources_cb.count()):
-                sources_cb.removeItem(0)
-
-            sources_cb.addItems(self.model.img_model.sources)
-            sources_cb.setCurrentText(self.model.img_model.selected_source)
-            sources_cb.blockSignals(False)
+            self.update_sources_cb()
 
         self.widget.cbn_plot_btn.setText('Plot')
         self.widget.oiadac_plot_btn.setText('Plot')
@@ -933,6 +916,23 @@ class ImageController(object):
     def select_source(self, source):
         self.model.img_model.select_source(source)
 
+    def update_sources_cb(self):
+        sources_cb = self.widget.image_control_widget.sources_cb
+        sources_cb.blockSignals(True)
+        # remove all previous items:
+        for _ in range(sources_cb.count()):
+            sources_cb.removeItem(0)
+
+        sources_cb.addItems(self.model.img_model.sources)
+        sources_cb.setCurrentText(self.model.img_model.selected_source)
+        sources_cb.blockSignals(False)
+
+    def sources_cb_popup_about_to_show(self):
+        # only the first source is searched when loading a file, the remaining sources are searched when needed
+        if self.model.img_model.sources is not None:
+            self.model.img_model.find_all_sources()
+            self.update_sources_cb()
+
     def convert_x_value(self, value, previous_unit, new_unit):
         wavelength = self.model.calibration_model.wavelength
         if previous_unit == '2th_deg':
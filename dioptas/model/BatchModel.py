@@ -1,24 +1,52 @@
+import copy
 import logging
 import os
 import re
 import pathlib
+import hashlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing.shared_memory import SharedMemory
 
 import h5py
 import numpy as np
 from qtpy import QtCore
 from PIL import Image
-from xypattern.pattern import SmoothBrucknerBackground
-from xypattern import Pattern
+
+from .CalibrationModel import CalibrationModel
+from .ImgModel import ImgModel
+from .util.calc import apply_background_and_corrections
+from .util.HelperModule import read_series_images, compose_transformations
+from .util.BatchWriter import BatchResultWriter, read_batch_manifest
+from .util.IntegratorCache import geometry_key
+from .util.PixelGeometry import copy_geometry
+from .util.FrameCountIndex import FrameCountIndex
+from .util.LazyDataset import LazyDataset
+from .util.BackgroundExtraction import extract_background_stack
 
 logger = logging.getLogger(__name__)
 
+# number of patterns which are written at once by save_proc_data
+SAVE_BLOCK_SIZE = 4096
+# number of pattern points above which the background extraction uses num_processes worker processes
+PARALLEL_BACKGROUND_SIZE = 2 ** 24
+# upper limit of the default number of worker processes, every worker keeps its own integration engine in memory
+MAX_DEFAULT_PROCESSES = 8
+
 
 class BatchModel(QtCore.QObject):
     """
     Class describe a model for batch integration
     """
 
-    def __init__(self, configuration):
+    # index of the number of images per file, which is shared by all batch models without their own index file
+    default_frame_count_file = os.path.join(os.path.expanduser("~"), ".Dioptas", "frame_counts.json")
+
+    def __init__(self, configuration, frame_count_file=None):
+        """
+        :param configuration: Configuration, whose calibration, mask and image models are used for the integration
+        :param frame_count_file: json file of the frame count index, default_frame_count_file if None
+        """
         super(BatchModel, self).__init__()
 
         self.data = None
@@ -37,7 +65,23 @@ class BatchModel(QtCore.QObject):
         self.used_mask_shape = None
         self.used_calibration = None
 
+        # number of images of the same file which are integrated at once
+        self.block_size = 16
+        # manifest of the last integration, stored with the processed data to be able to resume an integration
+        self.manifest = None
+        # number of images per file, stored on disk to avoid counting the images of the same files again
+        self.frame_count_index = FrameCountIndex(
+            frame_count_file if frame_count_file is not None else self.default_frame_count_file
+        )
+        # number of worker processes used for the integration, 1 integrates in the current process
+        self.num_processes = get_default_num_processes()
+        # number of patterns whose background is extracted at once
+        self.bkg_block_size = 1024
+        # processed file, which is kept open while data and bkg are read lazily from it
+        self._proc_file = None
+
     def reset_data(self):
+        self._close_proc_file()
         self.data = None
         self.bkg = None
         self.binning = None
@@ -50,6 +94,7 @@ class BatchModel(QtCore.QObject):
         self.used_mask = None
         self.used_mask_shape = None
         self.used_calibration = None
+        self.manifest = None
         self.raw_available = False
 
     def set_image_files(self, files):
@@ -67,23 +112,20 @@ class BatchModel(QtCore.QObject):
         file_map = [0]
         image_counter = 0
 
-        self.configuration.img_model.blockSignals(True)
+        # Assume tif file contains only one image, the other files are only opened to read the number of images
+        multi_image_files = [file for file in files if file[-4:] != ".tif"]
+        for file in multi_image_files:
+            if not os.path.exists(file):
+                return
+        frame_counts = dict(zip(multi_image_files, self.frame_count_index.get_frame_counts(
+            multi_image_files, self.configuration.img_model.get_frame_count)))
 
         for i, file in enumerate(files):
-            # Assume tif file contains only one image
-            if file[-4:] == ".tif":
-                n_img = 1
-            else:
-                if not os.path.exists(file):
-                    return
-                self.configuration.img_model.load(file)
-                n_img = self.configuration.img_model.series_max
+            n_img = frame_counts.get(file, 1)
             image_counter += n_img
             pos_map += list(zip([i] * n_img, range(n_img)))
             file_map.append(image_counter)
 
-        self.configuration.img_model.blockSignals(False)
-
         self.files = np.array(files)
         self.n_img_all = image_counter
         self.raw_available = True
@@ -117,98 +159,127 @@ class BatchModel(QtCore.QObject):
         if "bkg" in data_file:
             self.data = data_file["bkg"][()]
 
-    def load_proc_data(self, filename):
+    def load_proc_data(self, filename, lazy=True):
         """
         Load diffraction patterns and metadata from h5 file
 
+        :param filename: processed h5 file
+        :param lazy: if True, the file is kept open and the patterns and the background are only read when they are
+                     accessed (see LazyDataset), otherwise they are read completely into memory
         """
-        with h5py.File(filename, "r") as data_file:
-            # ToDo To be removed
-            if "processed/result" not in data_file:
-                self.try_load_old_format(data_file)
-                return
-            self.data = data_file["processed/result/data"][()]
-            self.binning = data_file["processed/result/binning"][()]
-            self.n_img = self.data.shape[0]
-            self.n_img_all = self.data.shape[0]
-
-            if "process" not in data_file["processed"]:
-                logger.info("No matching to raw data")
-                return
-
-            self.file_map = data_file["processed/process/file_map"][()]
-            self.files = data_file["processed/process/files"][()].astype("U")
-            self.pos_map = data_file["processed/process/pos_map"][()]
-
-            if isinstance(data_file["processed/process/cal_file"][()], bytes):
-                self.used_calibration = str(
-                    data_file["processed/process/cal_file"][()].decode("utf-8")
-                )
+        self._close_proc_file()
+        self.manifest = None
+        data_file = h5py.File(filename, "r")
+        try:
+            self._load_proc_data(data_file, lazy)
+        finally:
+            if lazy and isinstance(self.data, LazyDataset):
+                self._proc_file = data_file
             else:
-                self.used_calibration = str(data_file["processed/process/cal_file"][()])
-            if os.path.isfile(self.used_calibration):
-                self.configuration.calibration_model.load(self.used_calibration)
-
-            if "mask" in data_file["processed/process/"]:
-                mask = data_file["processed/process/mask"][()]
-                self.configuration.mask_model.set_dimension(mask.shape)
-                self.configuration.mask_model.set_mask(mask)
-
-            if "mask_file" in data_file["processed/process/"]:
-                try:
-                    self.used_mask = str(data_file["processed/process/mask_file"][()])
-                    mask_data = np.array(Image.open(self.used_mask))
-                    self.configuration.mask_model.set_dimension(mask_data.shape)
-                    self.configuration.mask_model.load_mask(self.used_mask)
-                except FileNotFoundError:
-                    logger.info(f"Mask file {self.used_mask} is not found")
-
-            if "bkg" in data_file["processed/process/"]:
-                self.bkg = data_file["processed/process/bkg"][()]
+                data_file.close()
 
-    def save_proc_data(self, filename):
-        """
-        Save diffraction patterns to h5 file
-        """
-        if os.path.dirname(filename) != "":
-            os.makedirs(os.path.dirname(filename), exist_ok=True)
-        with h5py.File(filename, mode="w") as f:
-            f.attrs["default"] = "processed"
+    def _load_proc_data(self, data_file, lazy):
+        # ToDo To be removed
+        if "processed/result" not in data_file:
+            self.try_load_old_format(data_file)
+            return
+        self.data = self._read_dataset(data_file["processed/result/data"], lazy)
+        self.binning = data_file["processed/result/binning"][()]
+        self.n_img = self.data.shape[0]
+        self.n_img_all = self.data.shape[0]
 
-            nxentry = f.create_group("processed")
-            nxentry.attrs["NX_class"] = "NXentry"
-            nxentry.attrs["default"] = "result"
+        if "process" not in data_file["processed"]:
+            logger.info("No matching to raw data")
+            return
 
-            nxdata = nxentry.create_group("result")
-            nxdata.attrs["NX_class"] = "NXdata"
-            nxdata.attrs["signal"] = "data"
-            nxdata.attrs["axes"] = [".", "binning"]
+        self.file_map = data_file["processed/process/file_map"][()]
+        self.files = data_file["processed/process/files"][()].astype("U")
+        self.pos_map = data_file["processed/process/pos_map"][()]
 
-            nxprocess = nxentry.create_group("process")
-            nxprocess.attrs["NX_class"] = "NXprocess"
+        if isinstance(data_file["processed/process/cal_file"][()], bytes):
+            self.used_calibration = str(
+                data_file["processed/process/cal_file"][()].decode("utf-8")
+            )
+        else:
+            self.used_calibration = str(data_file["processed/process/cal_file"][()])
+        if os.path.isfile(self.used_calibration):
+            self.configuration.calibration_model.load(self.used_calibration)
 
-            if self.used_calibration is not None:
-                nxprocess["cal_file"] = str(self.used_calibration)
+        if "mask" in data_file["processed/process/"]:
+            mask = data_file["processed/process/mask"][()]
+            self.configuration.mask_model.set_dimension(mask.shape)
+            self.configuration.mask_model.set_mask(mask)
 
-            if self.used_mask is not None:
-                nxprocess["mask_file"] = str(self.used_mask)
-                nxprocess["mask_shape"] = self.used_mask_shape
+        if "mask_file" in data_file["processed/process/"]:
+            try:
+                self.used_mask = str(data_file["processed/process/mask_file"][()])
+                mask_data = np.array(Image.open(self.used_mask))
+                self.configuration.mask_model.set_dimension(mask_data.shape)
+                self.configuration.mask_model.load_mask(self.used_mask)
+            except FileNotFoundError:
+                logger.info(f"Mask file {self.used_mask} is not found")
 
-            nxprocess["int_method"] = "csr"
-            nxprocess["int_unit"] = "2th_deg"
-            nxprocess["num_points"] = self.binning.shape[0]
+        if "bkg" in data_file["processed/process/"]:
+            self.bkg = self._read_dataset(data_file["processed/process/bkg"], lazy)
 
-            if self.bkg is not None:
-                nxprocess.create_dataset("bkg", data=self.bkg)
+    @staticmethod
+    def _read_dataset(dataset, lazy):
+        if lazy:
+            return LazyDataset(dataset)
+        return dataset[()]
 
-            nxdata.create_dataset("data", data=self.data)
-            tth = nxdata.create_dataset("binning", data=self.binning)
-            tth.attrs["unit"] = "deg"
-            tth.attrs["long_name"] = "two_theta (degrees)"
+    def _close_proc_file(self, filename=None):
+        """
+        Closes the processed file used for lazy loading. Data and background which are still used are read into
+        memory before.
+        :param filename: if given, the file is only closed if it is the given file (e.g. before overwriting it)
+        """
+        if self._proc_file is None:
+            return
+        if filename is not None and os.path.abspath(filename) != os.path.abspath(self._proc_file.filename):
+            return
+        if isinstance(self.data, LazyDataset):
+            self.data = np.asarray(self.data)
+        if isinstance(self.bkg, LazyDataset):
+            self.bkg = np.asarray(self.bkg)
+        self._proc_file.close()
+        self._proc_file = None
+
+    def get_data_window(self, start=0, stop=None, step=1, start_x=0, stop_x=None, subtract_background=False):
+        """
+        Returns a window of the integrated patterns. For lazily loaded data only the requested rows and columns are
+        read from the file.
+        :param start: first pattern
+        :param stop: stop index of the patterns (exclusive)
+        :param step: step between the patterns
+        :param start_x: first bin
+        :param stop_x: stop index of the bins (exclusive)
+        :param subtract_background: if True and a background is available, it is subtracted
+        :return: 2d numpy array (copy of the data)
+        """
+        if self.data is None:
+            return None
+        rows = slice(start, stop, step)
+        columns = slice(start_x, stop_x)
+        window = np.array(self.data[rows, columns], dtype=np.float64)
+        if subtract_background and self.bkg is not None:
+            window -= np.asarray(self.bkg[rows, columns])
+        return window
 
-            nxprocess.create_dataset("pos_map", data=self.pos_map)
-            nxprocess.create_dataset("file_map", data=self.file_map)
-            nxprocess.create_dataset("files", data=self.files.astype("S"))
+    def save_proc_data(self, filename):
+        """
+        Save diffraction patterns to h5 file
+        """
+        manifest = self.manifest
+        if manifest is not None and not np.array_equal(manifest["pos_map"], self.pos_map):
+            manifest = dict(manifest, pos_map=self.pos_map)
+        self._close_proc_file(filename)
+        with BatchResultWriter(filename, manifest=manifest) as writer:
+            writer.open(self.files, self.file_map, self.used_calibration, self.used_mask, self.used_mask_shape)
+            for start in range(0, self.data.shape[0], SAVE_BLOCK_SIZE):
+                stop = start + SAVE_BLOCK_SIZE
+                writer.append(self.binning, self.data[start:stop], self.pos_map[start:stop])
+            writer.close(bkg=None if self.bkg is None else np.asarray(self.bkg))
 
     def save_as_csv(self, filename):
         """
@@ -216,6 +287,7 @@ class BatchModel(QtCore.QObject):
         """
         if os.path.dirname(filename) != "":
             os.makedirs(os.path.dirname(filename), exist_ok=True)
+        data = np.asarray(self.data)
         x = self.binning.repeat(self.n_img)
         y = (
             np.arange(self.n_img)[None, :]
@@ -224,103 +296,506 @@ class BatchModel(QtCore.QObject):
         )
         np.savetxt(
             filename,
-            np.array(list(zip(x, y, self.data.T.flatten()))),
+            np.array(list(zip(x, y, data.T.flatten()))),
             delimiter=",",
             fmt="%f",
         )
 
-    def integrate_raw_data(self, start, stop, step, use_all=False, callback_fn=None):
+    def integrate_raw_data(self, start, stop, step, use_all=False, callback_fn=None, output_file=None,
+                           resume=False, result_fn=None):
         """
-        Integrate images from given file
+        Integrate images from given file. The integration consists of prepare_integration, run_integration and
+        set_integration_result, only run_integration can be called outside of the thread of the model.
 
-        :param num_points: Numbers of radial bins
         :param start: Start image index from integration
         :param stop: Stop image index from integration
         :param step: Step along images to integrate
         :param use_all: Use all images. If False use only images, that were already integrated.
-        :param callback_fn: callback function which is called each iteration with the current image number as parameter,
-                            if it returns False the integration will be aborted.
+        :param callback_fn: callback function which is called after each integrated block of images with the number of
+                            integrated images as parameter, if it returns False the integration will be aborted.
+        :param output_file: if given, the patterns are streamed block-wise into this processed h5 file while they are
+                            integrated, together with a manifest of the integration
+        :param resume: if True and output_file contains the manifest of a previous integration with the same
+                       calibration, mask and corrections, only the frames which are not yet in the file (or whose raw
+                       file changed) are integrated
+        :param result_fn: function, which is called with the binning, the intensities and the pos_map of the
+                          integrated blocks of images in the order of the images, e.g. to show partial results
         """
-        intensity_data = []
-        binning_data = []
-        pos_map = []
-        image_counter = 0
-        current_file = ""
+        job = self.prepare_integration(start, stop, step, use_all, output_file, resume)
+        if job is None:
+            return
+        self.set_integration_result(self.run_integration(job, callback_fn, result_fn))
 
-        if self.configuration.use_mask:
-            if self.configuration.mask_model.filename != "":
-                self.used_mask = self.configuration.mask_model.filename
-            mask = self.configuration.mask_model.get_mask()
-            self.used_mask_shape = mask.shape
+    def prepare_integration(self, start, stop, step, use_all=False, output_file=None, resume=False):
+        """
+        Collects everything needed to integrate the selected images into an integration job, which does not depend on
+        the models of the configuration anymore. Parameters are the same as for integrate_raw_data.
+        :return: the job for run_integration, None if no image is selected
+        """
+        pos_map_source = self._get_pos_map(start, stop, step, use_all)
+        if len(pos_map_source) == 0:
+            return None
+
+        setup = self._create_integration_setup(pos_map_source)
+        cal_file = self.configuration.calibration_model.filename
+        job = {
+            "pos_map": pos_map_source,
+            "setup": setup,
+            "files": np.array(self.files),
+            "file_map": self.file_map,
+            "cal_file": cal_file if cal_file != "" else None,
+            "mask_file": self.used_mask,
+            "mask_shape": self.used_mask_shape,
+            "trim_trailing_zeros": self.configuration.trim_trailing_zeros,
+            "output_file": output_file,
+            "writer": None,
+            "done": None,
+        }
+        if output_file is not None:
+            manifest = self.manifest = self._create_manifest(pos_map_source, setup)
+            job["writer"] = BatchResultWriter(output_file, manifest=manifest)
+            previous = self._read_previous_results(output_file, manifest) if resume else None
+            if previous is not None:
+                # the stored patterns stay in the file and are not read into memory
+                self.pos_map = self.data = self.bkg = self.binning = None
+                job["done"] = previous["done"]
+            self._close_proc_file(output_file)
+        return job
+
+    def run_integration(self, job, callback_fn=None, result_fn=None):
+        """
+        Integrates the images of a job created by prepare_integration. The state of the model is not changed, so that
+        the integration can run in a worker thread, the result is stored with set_integration_result.
+        :param job: integration job created by prepare_integration
+        :param callback_fn: see integrate_raw_data
+        :param result_fn: see integrate_raw_data
+        :return: the integration result for set_integration_result
+        """
+        writer = job["writer"]
+        done = job["done"]
+        if done is not None:
+            writer.resume(done)
+            pos_map_todo = job["pos_map"][~done]
+            if callback_fn is not None:
+                n_done = int(np.sum(done))
+                progress_fn = callback_fn
+                callback_fn = lambda n: progress_fn(n + n_done)
+            logger.info("Resuming batch integration, {} of {} images are already integrated.".format(
+                len(job["pos_map"]) - len(pos_map_todo), len(job["pos_map"])))
+        else:
+            pos_map_todo = job["pos_map"]
 
-        self.configuration.img_model.blockSignals(True)
-        for index in range(start, stop, step):
-            if use_all:
-                file_index, pos = self.pos_map_all[index]
+        result = None
+        try:
+            if len(pos_map_todo) == 0:
+                pass
+            elif self.num_processes > 1 and len(pos_map_todo) > self.block_size:
+                result = self._integrate_raw_data_parallel(pos_map_todo, job, callback_fn, result_fn)
             else:
-                file_index, pos = self.pos_map[index]
+                result = self._integrate_raw_data_serial(pos_map_todo, job, callback_fn, result_fn)
+        finally:
+            if writer is not None and writer.is_open:
+                writer.close(trim_trailing_zeros=job["trim_trailing_zeros"])
+
+        if done is not None:
+            # the writer sorted the previous and the new patterns into the order of the images
+            return {"output_file": job["output_file"], "cal_file": job["cal_file"]}
+        if result is None:
+            return None
+        binning, intensity_data, pos_map = result
+        binning = np.array(binning)
+        if job["trim_trailing_zeros"] and np.any(intensity_data):
+            # all patterns share the same binning, trailing zeros are trimmed as in the single image integration
+            trimmed_length = np.max(np.nonzero(np.any(intensity_data, axis=0))) + 1
+            binning = binning[:trimmed_length]
+            intensity_data = intensity_data[:, :trimmed_length]
+        return {"binning": binning, "data": intensity_data, "pos_map": np.array(pos_map), "cal_file": job["cal_file"]}
+
+    def set_integration_result(self, result):
+        """
+        Stores the result of run_integration in the model.
+        :param result: dictionary returned by run_integration, None if nothing was integrated
+        """
+        if result is None:
+            return
+        if "output_file" in result:
+            self._load_resumed_result(result["output_file"])
+        else:
+            self.pos_map = result["pos_map"]
+            self.binning = result["binning"]
+            self.data = result["data"]
+            self.bkg = None
+            self.n_img = self.data.shape[0]
+        if result["cal_file"] is not None:
+            self.used_calibration = result["cal_file"]
+
+    def get_integrated_images(self, output_file, start, stop, step, use_all=False):
+        """
+        Checks which of the images of an integration are already integrated with the same inputs in output_file, e.g.
+        to decide whether an interrupted integration should be resumed. Parameters are the same as for
+        integrate_raw_data.
+        :return: boolean array with True for each image, which is already integrated, None if nothing can be reused
+        """
+        if output_file is None or not os.path.isfile(output_file):
+            return None
+        pos_map = self._get_pos_map(start, stop, step, use_all)
+        if len(pos_map) == 0:
+            return None
+        manifest = self._create_manifest(pos_map, self._create_integration_setup(pos_map))
+        previous = self._read_previous_results(output_file, manifest)
+        if previous is None:
+            return None
+        return previous["done"]
+
+    def _get_pos_map(self, start, stop, step, use_all):
+        pos_map = self.pos_map_all if use_all else self.pos_map
+        return np.array(pos_map[start:stop:step])
+
+    def _create_manifest(self, pos_map, setup):
+        """
+        Creates the manifest of an integration.
+        :param pos_map: array of (file index, position in file) pairs of the images to be integrated
+        :param setup: integration setup created by _create_integration_setup
+        :return: dictionary with digest, pos_map and file_stats, as used by BatchResultWriter
+        """
+        file_stats = []
+        for file in self.files:
+            try:
+                stat = os.stat(file)
+                file_stats.append((stat.st_mtime, stat.st_size))
+            except OSError:
+                file_stats.append((0, 0))
+
+        return {
+            "digest": self.get_integration_digest(setup),
+            "pos_map": np.array(pos_map),
+            "file_stats": np.array(file_stats, dtype=np.float64),
+        }
+
+    def get_integration_digest(self, setup):
+        """
+        Creates a digest of all inputs determining the integrated patterns: calibration, integration settings, mask,
+        image transformations, background, corrections and factor.
+        :param setup: integration setup created by _create_integration_setup
+        :return: hex digest string
+        """
+        integration = setup["integration"]
+        digest = hashlib.sha1()
+        digest.update(repr((
+            geometry_key(setup["pattern_geometry"]),
+            setup["polarization_factor"],
+            setup["supersampling_factor"],
+            setup["correct_solid_angle"],
+            integration["unit"],
+            integration["num_points"],
+            integration["azi_range"],
+            self.configuration.trim_trailing_zeros,
+            [transformation.__name__ for transformation in setup["transformations"]],
+            setup["factor"],
+            tuple(setup["img_shape"]),
+        )).encode())
+        for array in (integration["mask"], setup["background"], setup["corrections"]):
+            if array is None:
+                digest.update(b"None")
+            else:
+                digest.update(np.ascontiguousarray(array).tobytes())
+        return digest.hexdigest()
+
+    def _read_previous_results(self, output_file, manifest):
+        """
+        Reads the manifest of a previous integration from output_file and checks which images of the manifest are
+        already integrated with the same inputs. The stored patterns are not read.
+        :return: dictionary with "done" flags for the manifest pos_map, None if nothing can be reused.
+        """
+        previous = read_batch_manifest(output_file)
+        if previous is None:
+            return None
+        if previous["digest"] != manifest["digest"] or list(previous["files"]) != [str(f) for f in self.files]:
+            logger.info("Integration inputs changed, previous results in {} are not used.".format(output_file))
+            return None
+
+        # images of files which changed since the previous integration are stale
+        unchanged_files = np.all(previous["file_stats"] == manifest["file_stats"], axis=1) \
+            if previous["file_stats"].shape == manifest["file_stats"].shape \
+            else np.zeros(len(self.files), dtype=bool)
+        previous_done = set(
+            (file_index, pos) for file_index, pos in previous["pos_map"][previous["done"]].tolist()
+            if unchanged_files[file_index]
+        )
+
+        done = np.array([(f, p) in previous_done for f, p in manifest["pos_map"].tolist()], dtype=bool)
+        if not np.any(done):
+            return None
+        return {"done": done}
+
+    def _load_resumed_result(self, output_file):
+        """
+        Reads the patterns of a resumed integration lazily from the processed file, which contains the previous and the
+        newly integrated patterns.
+        """
+        self._close_proc_file()
+        data_file = h5py.File(output_file, "r")
+        self.data = LazyDataset(data_file["processed/result/data"])
+        self.binning = data_file["processed/result/binning"][()]
+        self.pos_map = data_file["processed/process/pos_map"][()]
+        self.bkg = None
+        self.n_img = self.data.shape[0]
+        self._proc_file = data_file
+
+    def _integrate_raw_data_serial(self, pos_map, job, callback_fn=None, result_fn=None):
+        """
+        Integrates the images given in pos_map block-wise in the current thread. The images are loaded with a separate
+        image model and integrated with a separate calibration model, so that the integration can run in a worker
+        thread, while the models of the configuration are used by the GUI.
+
+        :param pos_map: array of (file index, position in file) pairs
+        :param job: integration job created by prepare_integration, each integrated block is appended to its writer
+        :param callback_fn: see integrate_raw_data
+        :param result_fn: see integrate_raw_data
+        :return: binning, intensities and pos_map of the integrated images, None if no image was integrated
+        """
+        setup = job["setup"]
+        writer = job["writer"]
+        intensity_data = None
+        binning = None
+        image_counter = 0
+        current_file = None
+        image_data = None
+        self._open_writer(job)
+
+        img_model = ImgModel()
+        calibration_model = create_calibration_model(img_model, setup)
+        for file_index, positions in get_image_blocks(pos_map, self.block_size):
             if file_index != current_file:
                 current_file = file_index
-                self.configuration.calibration_model.img_model.load(
-                    self.files[file_index]
-                )
+                image_data = open_image_file(img_model, str(job["files"][file_index]), positions[0], setup["source"])
 
-            self.configuration.img_model.load_series_img(pos + 1)
-            self.configuration.mask_model.set_dimension(
-                self.configuration.img_model.img_data.shape
-            )
+            images = read_image_block(image_data, positions, setup)
+            binning, intensity = calibration_model.integrate_1d_stack(images, **setup["integration"])
 
-            binning, intensity = self.configuration.integrate_image_1d()
-            image_counter += 1
-            pos_map.append((file_index, pos))
-            intensity_data.append(intensity)
-            binning_data.append(binning)
+            # the result array is allocated once, when the number of points is known
+            if intensity_data is None:
+                intensity_data = np.empty((len(pos_map), intensity.shape[1]))
+            intensity_data[image_counter:image_counter + len(positions)] = intensity
+            image_counter += len(positions)
+
+            if writer is not None:
+                writer.append(binning, intensity, [(file_index, pos) for pos in positions])
+            if result_fn is not None:
+                result_fn(binning, intensity, [(file_index, pos) for pos in positions])
 
             if callback_fn is not None:
                 if not callback_fn(image_counter):
                     break
 
-        self.configuration.img_model.blockSignals(False)
+        if image_counter == 0:
+            return None
+        return binning, intensity_data[:image_counter], pos_map[:image_counter]
 
-        # deal with different x lengths due to trimmed zeros:
-        binning_lengths = [len(binning) for binning in binning_data]
-        binning_max_length_ind = np.argmax(binning_lengths)
-        binning_max_length = binning_lengths[binning_max_length_ind]
-        binning = binning_data[binning_max_length_ind]
+    @staticmethod
+    def _open_writer(job):
+        writer = job["writer"]
+        if writer is None or writer.is_open:  # already open, when an integration is resumed
+            return
+        writer.open(job["files"], job["file_map"], job["cal_file"], job["mask_file"], job["mask_shape"])
 
-        for ind in range(len(intensity_data)):
-            intensity_data[ind] = np.append(
-                intensity_data[ind],
-                np.zeros((binning_max_length - binning_lengths[ind], 1)),
-            )
+    def _create_integration_setup(self, pos_map):
+        """
+        Collects everything needed to integrate the images given in pos_map without the image and mask model of the
+        configuration: the calibration, the integration parameters and mask, and the source, transformations,
+        background, corrections and factor of the image model. The calibration and the arrays are copies, so that the
+        integration can run in a worker thread or in worker processes, while the models of the configuration are used
+        and changed by the GUI. The first image is loaded to get the shape of the images, a mask with a different
+        shape is not used.
+
+        :param pos_map: array of (file index, position in file) pairs
+        :return: dictionary used by _integrate_raw_data_serial and _init_integration_worker
+        """
+        img_model = self.configuration.img_model
+        calibration_model = self.configuration.calibration_model
+        pattern_geometry, detector = copy.deepcopy(
+            (copy_geometry(calibration_model.pattern_geometry), calibration_model.detector))
+        setup = {
+            "pattern_geometry": pattern_geometry,
+            "detector": detector,
+            "polarization_factor": calibration_model.polarization_factor,
+            "supersampling_factor": calibration_model.supersampling_factor,
+            "correct_solid_angle": calibration_model.correct_solid_angle,
+            "source": img_model.selected_source,
+            "transformations": list(img_model.img_transformations),
+            "factor": img_model.factor,
+            "background": None,
+            "corrections": None,
+        }
+
+        file_index, pos = pos_map[0]
+        image_data = open_image_file(ImgModel(), str(self.files[file_index]), pos, setup["source"])
+        img_shape = read_image_block(image_data, [pos], setup).shape[1:]
+        setup["img_shape"] = img_shape
+        background, corrections = img_model.get_background_and_corrections(img_shape)
+        setup["background"] = background
+        setup["corrections"] = None if corrections is None else np.array(corrections)
+
+        mask = self.configuration._get_integration_mask()
+        if mask is not None and mask.shape != img_shape:
+            mask = None
+        if mask is not None:
+            mask = np.array(mask)
+        if self.configuration.use_mask and mask is not None:
+            if self.configuration.mask_model.filename != "":
+                self.used_mask = self.configuration.mask_model.filename
+            self.used_mask_shape = mask.shape
 
-        # finish and save everything
+        num_points = self.configuration.integration_rad_points
+        if num_points is None:
+            supersampled_shape = np.array(img_shape) * calibration_model.supersampling_factor
+            num_points = calibration_model.calculate_number_of_pattern_points(supersampled_shape, 2)
+        setup["integration"] = {
+            "num_points": num_points,
+            "mask": mask,
+            "unit": self.configuration.integration_unit,
+            "azi_range": self.configuration.oned_azimuth_range,
+        }
+        return setup
+
+    def _integrate_raw_data_parallel(self, pos_map, job, callback_fn=None, result_fn=None):
+        """
+        Integrates the images given in pos_map with num_processes worker processes. The integration setup is sent to
+        each worker once, the workers then load and integrate blocks of images with the same loaders as the image model
+        and write the patterns directly into a shared memory array.
+
+        :param pos_map: array of (file index, position in file) pairs
+        :param job: integration job created by prepare_integration. The integrated patterns are appended to its writer
+                    in order, as soon as all previous blocks are finished. Blocks finished out of order are appended
+                    when the integration is aborted, so that the writer contains the same patterns as the result.
+        :param callback_fn: see integrate_raw_data
+        :param result_fn: see integrate_raw_data, called in the same order as the writer
+        :return: binning, intensities and pos_map of the integrated images, None if no image was integrated
+        """
+        setup = job["setup"]
+        writer = job["writer"]
+        self._open_writer(job)
 
-        if self.configuration.calibration_model.filename != "":
-            self.used_calibration = self.configuration.calibration_model.filename
-        self.pos_map = np.array(pos_map)
-        self.binning = np.array(binning)
-        self.data = np.array(intensity_data)
-        self.bkg = None
-        self.n_img = self.data.shape[0]
+        tasks = []
+        row = 0
+        for file_index, positions in get_image_blocks(pos_map, self.block_size):
+            tasks.append((str(job["files"][file_index]), positions, row))
+            row += len(positions)
+
+        result_shape = (len(pos_map), setup["integration"]["num_points"])
+        shared_memory = SharedMemory(create=True, size=int(np.prod(result_shape)) * 8)
+        worker_setup = dict(setup, result=(shared_memory.name, result_shape))
+
+        binning = None
+        image_counter = 0
+        written_rows = 0
+        integrated = np.zeros(len(pos_map), dtype=bool)
+        result = np.ndarray(result_shape, dtype=np.float64, buffer=shared_memory.buf)
+        executor = ProcessPoolExecutor(
+            max_workers=min(self.num_processes, len(tasks)),
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_integration_worker,
+            initargs=(worker_setup,),
+        )
+        futures = []
+        try:
+            futures = [executor.submit(_integrate_image_block, *task) for task in tasks]
+            for future in as_completed(futures):
+                row, num_images, binning = future.result()
+                integrated[row:row + num_images] = True
+                image_counter += num_images
+                if writer is not None or result_fn is not None:
+                    finished_rows = written_rows + np.argmin(np.append(integrated[written_rows:], False))
+                    if finished_rows > written_rows:
+                        if writer is not None:
+                            writer.append(binning, result[written_rows:finished_rows],
+                                          pos_map[written_rows:finished_rows])
+                        if result_fn is not None:
+                            result_fn(binning, result[written_rows:finished_rows].copy(),
+                                      pos_map[written_rows:finished_rows])
+                        written_rows = finished_rows
+                if callback_fn is not None:
+                    if not callback_fn(image_counter):
+                        break
+            shutdown_executor(executor, futures)
+            if writer is not None and written_rows < len(pos_map):
+                # blocks finished after an unfinished block (e.g. when the integration is aborted) are written with
+                # their positions, the writer sorts them into the order of the images when it is closed
+                rows = np.flatnonzero(integrated)
+                rows = rows[rows >= written_rows]
+                for run in np.split(rows, np.flatnonzero(np.diff(rows) != 1) + 1):
+                    if len(run):
+                        writer.append(binning, result[run[0]:run[-1] + 1], pos_map[run[0]:run[-1] + 1])
+            # the patterns are copied out of the shared memory only once
+            if integrated.all():
+                intensity_data = np.array(result)
+            else:
+                num_integrated = _compact_rows(result, integrated)
+                intensity_data = np.array(result[:num_integrated])
+        finally:
+            shutdown_executor(executor, futures)
+            del result
+            shared_memory.close()
+            shared_memory.unlink()
+
+        if image_counter == 0:
+            return None
+        return binning, intensity_data, np.array(pos_map)[integrated]
 
     def extract_background(self, parameters, callback_fn=None):
         """
-        Subtract background calculated with respect of given parameters
-        """
+        Subtract background calculated with respect of given parameters. The backgrounds of blocks of bkg_block_size
+        patterns are extracted at once (see extract_background_stack). Very large batches are distributed to
+        num_processes worker processes.
 
+        :param parameters: smooth width, iterations and polynomial order of the SmoothBrucknerBackground
+        :param callback_fn: function called with the number of processed patterns before each block. If it returns
+                            False, the extraction is stopped and the remaining backgrounds stay zero.
+        """
         bkg = np.zeros(self.data.shape)
-        auto_bkg = SmoothBrucknerBackground(*parameters)
-        for i, y in enumerate(self.data):
-            if callback_fn is not None:
-                if not callback_fn(i):
-                    break
-            bkg[i] = auto_bkg.extract_background(Pattern(self.binning, y))
+        blocks = [
+            (start, min(start + self.bkg_block_size, self.data.shape[0]))
+            for start in range(0, self.data.shape[0], self.bkg_block_size)
+        ]
+        if self.num_processes > 1 and len(blocks) > 1 and self.data.size > PARALLEL_BACKGROUND_SIZE:
+            self._extract_background_parallel(parameters, blocks, bkg, callback_fn)
+        else:
+            for start, stop in blocks:
+                if callback_fn is not None:
+                    if not callback_fn(start):
+                        break
+                bkg[start:stop] = extract_background_stack(self.binning, self.data[start:stop], *parameters)
         self.bkg = bkg
 
+    def _extract_background_parallel(self, parameters, blocks, bkg, callback_fn=None):
+        executor = ProcessPoolExecutor(
+            max_workers=min(self.num_processes, len(blocks)),
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+        futures = {}
+        try:
+            futures = {
+                executor.submit(extract_background_stack, self.binning, np.asarray(self.data[start:stop]), *parameters):
+                    (start, stop)
+                for start, stop in blocks
+            }
+            num_finished = 0
+            for future in as_completed(futures):
+                start, stop = futures[future]
+                bkg[start:stop] = future.result()
+                num_finished += stop - start
+                if callback_fn is not None:
+                    if not callback_fn(num_finished):
+                        break
+        finally:
+            shutdown_executor(executor, futures)
+
     def normalize(self, range_ind=(10, 30)):
         if self.data is None:
             return
+        # the normalized patterns are no integration result, which can be resumed
+        self.manifest = None
+        self.data = np.asarray(self.data)
         average_intensities = np.mean(self.data[:, range_ind[0] : range_ind[1]], axis=1)
         factors = average_intensities[0] / average_intensities
         self.data = (self.data.T * factors).T
@@ -384,6 +859,150 @@ class BatchModel(QtCore.QObject):
         return files[: self.n_img_all]
 
 
+def get_default_num_processes():
+    """
+    :return: number of worker processes for the integration, one core is left for the GUI and the process collecting
+             the results
+    """
+    return max(1, min((os.cpu_count() or 1) - 1, MAX_DEFAULT_PROCESSES))
+
+
+def shutdown_executor(executor, futures):
+    """
+    Shuts a process pool down without starting the pending jobs, executor.shutdown(cancel_futures=True) needs
+    python >= 3.9.
+    :param futures: futures of the jobs submitted to the executor
+    """
+    for future in futures:
+        future.cancel()
+    executor.shutdown(wait=True)
+
+
+def _compact_rows(data, mask):
+    """
+    Moves the rows of data selected by mask in place to the beginning of data, keeping their order.
+
+    :param data: 2D array, which is changed in place
+    :param mask: boolean array with True for each row to keep
+    :return: number of kept rows
+    """
+    rows = np.flatnonzero(mask)
+    num_rows = 0
+    for run in np.split(rows, np.flatnonzero(np.diff(rows) != 1) + 1):
+        if len(run):
+            if run[0] != num_rows:
+                data[num_rows:num_rows + len(run)] = data[run[0]:run[-1] + 1]
+            num_rows += len(run)
+    return num_rows
+
+
+def get_image_blocks(pos_map, block_size):
+    """
+    Groups consecutive images of the same file into blocks, which can be integrated together.
+    :param pos_map: array of (file index, position in file) pairs
+    :param block_size: maximum number of images per block
+    :return: generator yielding tuples of file index and list of positions
+    """
+    current_file = None
+    positions = []
+    for file_index, pos in pos_map:
+        if file_index != current_file or len(positions) >= block_size:
+            if positions:
+                yield current_file, positions
+            current_file = file_index
+            positions = []
+        positions.append(pos)
+    if positions:
+        yield current_file, positions
+
+
+def create_calibration_model(img_model, setup):
+    """
+    Creates a calibration model with the calibration of an integration setup, which is independent of the calibration
+    model of the configuration.
+    :param img_model: image model of the calibration model
+    :param setup: integration setup created by BatchModel._create_integration_setup
+    """
+    calibration_model = CalibrationModel(img_model)
+    calibration_model.pattern_geometry = setup["pattern_geometry"]
+    calibration_model.detector = setup["detector"]
+    calibration_model.polarization_factor = setup["polarization_factor"]
+    calibration_model.supersampling_factor = setup["supersampling_factor"]
+    calibration_model.correct_solid_angle = setup["correct_solid_angle"]
+    return calibration_model
+
+
+# state of a batch integration worker process, set up once by _init_integration_worker
+_worker = {}
+
+
+def _init_integration_worker(setup):
+    """
+    Initializes a worker process of the parallel batch integration.
+    :param setup: dictionary with the calibration, integration parameters, image processing arrays and the name and
+                  shape of the shared result array, created by BatchModel._integrate_raw_data_parallel
+    """
+    img_model = ImgModel()
+    calibration_model = create_calibration_model(img_model, setup)
+
+    name, shape = setup["result"]
+    shared_memory = SharedMemory(name=name)
+    _worker.update(setup)
+    _worker["img_model"] = img_model
+    _worker["calibration_model"] = calibration_model
+    _worker["shared_memory"] = shared_memory
+    _worker["result"] = np.ndarray(shape, dtype=np.float64, buffer=shared_memory.buf)
+
+
+def _integrate_image_block(filename, positions, row):
+    """
+    Loads and integrates a block of images of one file in a worker process and writes the patterns into the shared
+    result array.
+    :param filename: image file
+    :param positions: positions of the images in the file, starting at 0
+    :param row: row of the first image in the result array
+    :return: row, number of integrated images and the binning of the patterns
+    """
+    image_data = open_image_file(_worker["img_model"], filename, positions[0], _worker["source"])
+    images = read_image_block(image_data, positions, _worker)
+    binning, intensities = _worker["calibration_model"].integrate_1d_stack(images, **_worker["integration"])
+    _worker["result"][row:row + len(positions)] = intensities
+    return row, len(positions), binning
+
+
+def open_image_file(img_model, filename, pos, source=None):
+    """
+    Opens an image file with the loaders of the given image model, without changing the state of the model.
+    :param img_model: ImgModel, whose loaders are used
+    :param filename: image file
+    :param pos: position of an image in the file
+    :param source: image source to be selected in files with several sources (e.g. hdf5 datasets)
+    :return: the data returned by ImgModel.get_image_data
+    """
+    image_data = img_model.get_image_data(filename, pos)
+    if source is not None and image_data.get("select_source") is not None:
+        image_data["select_source"](source)
+    return image_data
+
+
+def read_image_block(image_data, positions, setup):
+    """
+    Reads a block of images from a file opened with open_image_file and processes them like ImgModel.get_series_images
+    :param image_data: data of the opened file
+    :param positions: positions of the images in the file, starting at 0
+    :param setup: integration setup with the transformations, background, corrections and factor
+    :return: 3d array of the processed images
+    """
+    series_get_image = image_data.get("series_get_image")
+    if series_get_image is None:
+        raw_images = [image_data["img_data"]] * len(positions)
+    else:
+        raw_images = read_series_images(positions, series_get_image, image_data.get("series_get_images"))
+
+    images = compose_transformations(setup["transformations"])(np.array(raw_images))
+    return apply_background_and_corrections(images, setup["background"], setup["corrections"], setup["factor"])
+
+
 def iterate_folder(folder_path, step):
     pattern = re.compile(r"\d+")
     match_iterator = pattern.finditer(folder_path)
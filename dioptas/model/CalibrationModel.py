@@ -22,10 +22,13 @@ import logging
 import os
 import sys
 import time
+import threading
+from functools import wraps
 from enum import Enum
 from copy import deepcopy
 
 import numpy as np
+from scipy import sparse
 from pyFAI.azimuthalIntegrator import AzimuthalIntegrator
 from pyFAI.blob_detection import BlobDetection
 from pyFAI.calibrant import Calibrant
@@ -43,12 +46,29 @@ from .util.HelperModule import (
     rotate_matrix_m90,
     get_partial_index,
 )
-from .util.calc import supersample_image, trim_trailing_zeros
+from .util.calc import supersample_image, trim_trailing_zeros, trim_trailing_zeros_stack
+from .util.IntegratorCache import IntegratorEngineCache, geometry_key, mask_digest
+from .util.PixelGeometry import PixelGeometryCache
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
 
+def synchronized_integration(integrate_fcn):
+    """
+    Runs an integration method of CalibrationModel under the integration lock of the model, since the batch
+    integration uses the calibration model in a worker thread, while the GUI thread can integrate the current image.
+    The pyFAI integrators and the engine cache can not be used by two threads at once.
+    """
+
+    @wraps(integrate_fcn)
+    def synchronized(self, *args, **kwargs):
+        with self.integration_lock:
+            return integrate_fcn(self, *args, **kwargs)
+
+    return synchronized
+
+
 class CalibrationModel(object):
 
     def __init__(self, img_model=None):
@@ -111,6 +131,14 @@ class CalibrationModel(object):
 
         self.peak_search_algorithm = None
 
+        # keeps the prepared pyFAI integration engines for recently used integration setups
+        self.engine_cache = IntegratorEngineCache()
+        self._stack_matrix = (None, None)  # (pyFAI CSR engine, scipy sparse matrix) used by integrate_1d_stack
+        # float32 two theta, azimuth and solid angle arrays of the recently used calibrations, see get_pixel_geometry
+        self.pixel_geometry_cache = PixelGeometryCache()
+        # held by the integration methods, see synchronized_integration
+        self.integration_lock = threading.RLock()
+
         self.img_model.img_changed.connect(self._check_detector_and_image_shape)
 
         self.detector_reset = Signal()
@@ -257,7 +285,7 @@ class CalibrationModel(object):
         tth_calibrant = float(tth_calibrant_list[ring_index])
 
         # get the calculated two theta values for the whole image
-        tth_array = self.pattern_geometry.twoThetaArray(self.img_model.img_data.shape)
+        tth_array = self.get_pixel_geometry("tth")
 
         # create mask based on two_theta position
         ring_mask = abs(tth_array - tth_calibrant) <= delta_tth
@@ -408,9 +436,10 @@ class CalibrationModel(object):
             if mask is not None:
                 mask = supersample_image(mask, self.supersampling_factor)
         else:
-            img_data = self.img_model.img_data
+            img_data = get_writeable_image(self.img_model.img_data)
         return img_data, mask
 
+    @synchronized_integration
     def integrate_1d(
         self,
         num_points=None,
@@ -461,13 +490,24 @@ class CalibrationModel(object):
 
         t1 = time.time()
 
-        if unit == "d_A":
+        pyfai_unit = "2th_deg" if unit == "d_A" else unit
+        engine_key = self._create_engine_key(
+            self.pattern_geometry,
+            img_data.shape,
+            mask,
+            pyfai_unit,
+            method,
+            num_points,
+            azi_range,
+        )
+
+        with self.engine_cache.use(self.pattern_geometry, engine_key):
             try:
                 self.tth, self.int = self.pattern_geometry.integrate1d(
                     img_data,
                     num_points,
                     method=method,
-                    unit="2th_deg",
+                    unit=pyfai_unit,
                     azimuth_range=azi_range,
                     mask=mask,
                     polarization_factor=polarization_factor,
@@ -479,44 +519,20 @@ class CalibrationModel(object):
                     img_data,
                     num_points,
                     method="csr",
-                    unit="2th_deg",
+                    unit=pyfai_unit,
                     azimuth_range=azi_range,
                     mask=mask,
                     polarization_factor=polarization_factor,
                     correctSolidAngle=self.correct_solid_angle,
                     filename=filename,
                 )
+
+        if unit == "d_A":
             self.tth = (
                 self.pattern_geometry.wavelength
                 / (2 * np.sin(self.tth / 360 * np.pi))
                 * 1e10
             )
-            self.int = self.int
-        else:
-            try:
-                self.tth, self.int = self.pattern_geometry.integrate1d(
-                    img_data,
-                    num_points,
-                    method=method,
-                    unit=unit,
-                    azimuth_range=azi_range,
-                    mask=mask,
-                    polarization_factor=polarization_factor,
-                    correctSolidAngle=self.correct_solid_angle,
-                    filename=filename,
-                )
-            except NameError:
-                self.tth, self.int = self.pattern_geometry.integrate1d(
-                    img_data,
-                    num_points,
-                    method="csr",
-                    unit=unit,
-                    azimuth_range=azi_range,
-                    mask=mask,
-                    polarization_factor=polarization_factor,
-                    correctSolidAngle=self.correct_solid_angle,
-                    filename=filename,
-                )
         logger.info(
             "1d integration of {0}: {1}s.".format(
                 os.path.basename(self.img_model.filename), time.time() - t1
@@ -530,6 +546,140 @@ class CalibrationModel(object):
 
         return self.tth, self.int
 
+    @synchronized_integration
+    def integrate_1d_stack(
+        self,
+        frames,
+        num_points=None,
+        mask=None,
+        polarization_factor=None,
+        unit="2th_deg",
+        method="csr",
+        azi_range=None,
+        trim_zeros=False,
+    ):
+        """
+        Integrates a stack of images, which share the same geometry, mask and integration parameters. The first image
+        is integrated by pyFAI, which prepares the sparse integration matrix (or takes it from the engine_cache). All
+        images are then integrated at once by a single sparse matrix product.
+        :param frames: 3d array with shape (N, height, width) containing the (already corrected) images
+        :param num_points: number of points for the integration
+        :param mask: mask for the integration
+        :param polarization_factor: polarization factor for the integration
+        :param unit: unit for the integration, possible values are '2th_deg', 'q_A^-1', 'r_mm', 'r_m', 'd_A'
+        :param method: method for the integration, if the method does not use a CSR sparse matrix, the images are
+                       integrated one after another
+        :param azi_range: azimuthal range for the integration
+        :param trim_zeros: if True, the points after the last non-zero value of all patterns are trimmed, so that all
+                           patterns keep the same length
+        :return: x, intensities - 1d array with the x-values and 2d array with shape (N, num_points)
+        """
+        frames = np.asarray(frames)
+        if frames.ndim == 2:
+            frames = frames[np.newaxis]
+        img_shape = frames.shape[1:]
+
+        if self.pattern_geometry_img_shape != img_shape:
+            self.pattern_geometry.reset()
+            self.pattern_geometry_img_shape = img_shape
+
+        if polarization_factor is None:
+            polarization_factor = self.polarization_factor
+
+        mask = self._prepare_integration_mask(mask)
+        factor = self.supersampling_factor
+        if factor > 1:
+            frames = np.repeat(np.repeat(frames, factor, axis=1), factor, axis=2)
+            if mask is not None:
+                mask = supersample_image(mask, factor)
+        frames = get_writeable_image(frames.astype(np.float32, copy=False))
+
+        if num_points is None:
+            num_points = self.calculate_number_of_pattern_points(frames.shape[1:], 2)
+        self.num_points = num_points
+
+        t1 = time.time()
+
+        pyfai_unit = "2th_deg" if unit == "d_A" else unit
+        engine_key = self._create_engine_key(
+            self.pattern_geometry,
+            frames.shape[1:],
+            mask,
+            pyfai_unit,
+            method,
+            num_points,
+            azi_range,
+        )
+        integration_parameters = {
+            "method": method,
+            "unit": pyfai_unit,
+            "azimuth_range": azi_range,
+            "mask": mask,
+            "polarization_factor": polarization_factor,
+            "correctSolidAngle": self.correct_solid_angle,
+        }
+
+        with self.engine_cache.use(self.pattern_geometry, engine_key):
+            res = self.pattern_geometry.integrate1d(
+                frames[0], num_points, **integration_parameters
+            )
+            matrix = self._get_sparse_integration_matrix(
+                self.pattern_geometry.engines, frames[0].size
+            )
+            if matrix is None:
+                intensities = [res.intensity]
+                for frame in frames[1:]:
+                    intensities.append(
+                        self.pattern_geometry.integrate1d(
+                            frame, num_points, **integration_parameters
+                        ).intensity
+                    )
+                intensities = np.array(intensities)
+
+        if matrix is not None:
+            normalization = np.asarray(res.sum_normalization, dtype=np.float64)
+            signal = matrix.dot(frames.reshape(len(frames), -1).T).T
+            intensities = np.zeros(signal.shape)
+            valid = normalization != 0
+            intensities[:, valid] = signal[:, valid] / normalization[valid]
+
+        x = res.radial
+        if unit == "d_A":
+            x = self.pattern_geometry.wavelength / (2 * np.sin(x / 360 * np.pi)) * 1e10
+
+        logger.info(
+            "1d integration of {0} images: {1}s.".format(len(frames), time.time() - t1)
+        )
+        if trim_zeros:
+            x, intensities = trim_trailing_zeros_stack(x, intensities)
+        return x, intensities
+
+    def _get_sparse_integration_matrix(self, engines, size):
+        """
+        Finds the 1d CSR integration engine prepared by pyFAI and returns its sparse matrix.
+        :param engines: engines dictionary of a pyFAI integrator
+        :param size: number of pixels of the images to be integrated
+        :return: scipy sparse matrix with shape (num_points, size) or None if no CSR engine is available
+        """
+        for method, engine in engines.items():
+            if (
+                method.dimension != 1
+                or method.algo_lower != "csr"
+                or method.impl_lower != "cython"
+            ):
+                continue
+            csr_engine = engine.engine
+            if csr_engine is None or csr_engine.size != size:
+                continue
+            if self._stack_matrix[0] is not csr_engine:
+                matrix = sparse.csr_matrix(
+                    csr_engine.lut, shape=(csr_engine.bins, csr_engine.size)
+                ).astype(np.float64)
+                self._stack_matrix = (csr_engine, matrix)
+            return self._stack_matrix[1]
+        return None
+
+    @synchronized_integration
     def integrate_2d(
         self,
         mask=None,
@@ -558,17 +708,28 @@ class CalibrationModel(object):
 
         t1 = time.time()
 
-        res = self.cake_geometry.integrate2d(
-            img_data,
-            rad_points,
-            azimuth_points,
-            azimuth_range=azimuth_range,
-            method=method,
-            mask=mask,
-            unit=unit,
-            polarization_factor=polarization_factor,
-            correctSolidAngle=self.correct_solid_angle,
+        engine_key = self._create_engine_key(
+            self.cake_geometry,
+            img_data.shape,
+            mask,
+            unit,
+            method,
+            (rad_points, azimuth_points),
+            azimuth_range,
         )
+
+        with self.engine_cache.use(self.cake_geometry, engine_key):
+            res = self.cake_geometry.integrate2d(
+                img_data,
+                rad_points,
+                azimuth_points,
+                azimuth_range=azimuth_range,
+                method=method,
+                mask=mask,
+                unit=unit,
+                polarization_factor=polarization_factor,
+                correctSolidAngle=self.correct_solid_angle,
+            )
         logger.info(
             "2d integration of {0}: {1}s.".format(
                 os.path.basename(self.img_model.filename), time.time() - t1
@@ -579,6 +740,45 @@ class CalibrationModel(object):
         self.cake_azi = res[2]
         return self.cake_img
 
+    def _create_engine_key(
+        self, integrator, img_shape, mask, unit, method, num_points, azimuth_range
+    ):
+        """
+        Creates the key under which the pyFAI integration engines for an integration setup are stored in the
+        engine_cache.
+        :param integrator: AzimuthalIntegrator used for the integration
+        :param img_shape: shape of the (supersampled) image
+        :param mask: mask used for the integration, already combined with the detector mask
+        :param unit: unit used for the integration in pyFAI
+        :param method: integration method
+        :param num_points: number of points or tuple of radial and azimuthal points for 2d integration
+        :param azimuth_range: azimuthal range for the integration
+        :return: hashable tuple
+        """
+        if azimuth_range is not None:
+            azimuth_range = tuple(azimuth_range)
+        return (
+            geometry_key(integrator),
+            tuple(img_shape),
+            mask_digest(mask),
+            str(unit),
+            str(method),
+            num_points,
+            azimuth_range,
+            self.supersampling_factor,
+        )
+
+    def get_engine_cache_info(self):
+        """
+        :return: dictionary with the number of hits, misses and stored setups of the integration engine cache
+        """
+        return {
+            "hits": self.engine_cache.hits,
+            "misses": self.engine_cache.misses,
+            "size": len(self.engine_cache),
+            "max_size": self.engine_cache.max_size,
+        }
+
     def cake_integral(self, tth, bins=1):
         """
         calculates a histogram of the cake in tth direction, thus the result will be pixel vs intensity
@@ -704,6 +904,8 @@ class CalibrationModel(object):
         """
         self.detector = detector
         self.detector.calc_mask()
+        self.engine_cache.clear()
+        self.pixel_geometry_cache.clear()
         self.orig_pixel1 = self.detector.pixel1
         self.orig_pixel2 = self.detector.pixel2
 
@@ -874,8 +1076,20 @@ class CalibrationModel(object):
         y *= self.supersampling_factor
         return self.pattern_geometry.chi(x - 0.5, y - 0.5)[0]
 
+    def get_pixel_geometry(self, name, shape=None):
+        """
+        Returns a per-pixel geometry array of the current calibration. The arrays are calculated only once per
+        calibration, image shape and supersampling factor and are shared by all callers, therefore they are read-only.
+        :param name: "tth" (two theta in radians), "chi" (azimuth in radians) or "solid_angle"
+        :param shape: shape of the array, defaults to the shape of the current image
+        :return: float32 array
+        """
+        if shape is None:
+            shape = self.img_model.img_data.shape
+        return self.pixel_geometry_cache.get(name, self.pattern_geometry, shape)
+
     def get_two_theta_array(self):
-        return self.pattern_geometry.twoThetaArray(self.img_model.img_data.shape)[
+        return self.get_pixel_geometry("tth")[
             :: self.supersampling_factor, :: self.supersampling_factor
         ]
 
@@ -889,7 +1103,7 @@ class CalibrationModel(object):
         :return:
             tuple of index 1 and 2
         """
-        tth_ind = find_contours(self.pattern_geometry.ttha, tth)
+        tth_ind = find_contours(self.get_pixel_geometry("tth", self.detector.shape), tth)
         if len(tth_ind) == 0:
             return []
         tth_ind = np.vstack(tth_ind)
@@ -941,6 +1155,8 @@ class CalibrationModel(object):
             return
 
         self.detector = deepcopy(self._original_detector)
+        self.engine_cache.clear()
+        self.pixel_geometry_cache.clear()
         self.orig_pixel1, self.orig_pixel2 = self.detector.pixel1, self.detector.pixel2
         self.pattern_geometry.detector = self.detector
         if self.cake_geometry is not None:
@@ -979,6 +1195,8 @@ class CalibrationModel(object):
         """
         :param transform_function: function pointer which will affect the dx, dy and pixel corners of the detector
         """
+        self.engine_cache.clear()
+        self.pixel_geometry_cache.clear()
         if self.detector._pixel_corners is not None:
             self.detector._pixel_corners = np.ascontiguousarray(
                 transform_function(self.detector.get_pixel_corners())
@@ -1041,6 +1259,17 @@ class DummyStdOut(object):
         pass
 
 
+def get_writeable_image(img_data):
+    """
+    The img_data of ImgModel is read-only, since it is cached and shared. pyFAI converts all images to float32 and
+    uses float32 images directly, but its csr, bbox and lut engines can not handle read-only buffers. Therefore,
+    read-only float32 images are copied, all other images are converted by pyFAI anyway.
+    """
+    if img_data.dtype == np.float32 and not img_data.flags.writeable:
+        return img_data.copy()
+    return img_data
+
+
 def get_available_detectors():
     detector_classes = set()
     detector_names = []
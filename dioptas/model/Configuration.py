@@ -100,12 +100,7 @@ class Configuration(object):
         auto_save_integrated is True.
         """
         if self.calibration_model.is_calibrated:
-            if self.use_mask:
-                mask = self.mask_model.get_mask()
-            elif self.mask_model.roi is not None:
-                mask = self.mask_model.roi_mask
-            else:
-                mask = None
+            mask = self._get_integration_mask()
 
             x, y = self.calibration_model.integrate_1d(
                 azi_range=self.oned_azimuth_range,
@@ -124,16 +119,38 @@ class Configuration(object):
 
             return x, y
 
-    def integrate_image_2d(self):
+    def integrate_image_stack_1d(self, images):
         """
-        Integrates the image in the ImageModel to a Cake.
+        Integrates a stack of images with the current integration settings of the configuration. Contrary to
+        integrate_image_1d, the pattern model is not updated and no patterns are saved. If trim_trailing_zeros is set,
+        the patterns are trimmed to the common length of the stack.
+        :param images: 3d array with shape (N, height, width), e.g. from ImgModel.get_series_images
+        :return: x, intensities - 1d array with the x-values and 2d array with shape (N, num_points)
+        """
+        return self.calibration_model.integrate_1d_stack(
+            images,
+            azi_range=self.oned_azimuth_range,
+            mask=self._get_integration_mask(),
+            unit=self.integration_unit,
+            num_points=self.integration_rad_points,
+            trim_zeros=self.trim_trailing_zeros,
+        )
+
+    def _get_integration_mask(self):
+        """
+        :return: the mask to be used for integration, depending on the use_mask setting and the roi of the mask model
         """
         if self.use_mask:
-            mask = self.mask_model.get_mask()
+            return self.mask_model.get_mask()
         elif self.mask_model.roi is not None:
-            mask = self.mask_model.roi_mask
-        else:
-            mask = None
+            return self.mask_model.roi_mask
+        return None
+
+    def integrate_image_2d(self):
+        """
+        Integrates the image in the ImageModel to a Cake.
+        """
+        mask = self._get_integration_mask()
 
         self.calibration_model.integrate_2d(
             mask=mask,
@@ -809,10 +826,10 @@ class Configuration(object):
                     params[param] = val
                 if name == "cbn":
                     tth_array = (
-                        180.0 / np.pi * self.calibration_model.pattern_geometry.ttha
+                        180.0 / np.pi * self.calibration_model.get_pixel_geometry("tth")
                     )
                     azi_array = (
-                        180.0 / np.pi * self.calibration_model.pattern_geometry.chia
+                        180.0 / np.pi * self.calibration_model.get_pixel_geometry("chi")
                     )
                     cbn_correction = CbnCorrection(
                         tth_array=tth_array, azi_array=azi_array
@@ -823,10 +840,10 @@ class Configuration(object):
                     self.img_model.add_img_correction(cbn_correction, name)
                 elif name == "oiadac":
                     tth_array = (
-                        180.0 / np.pi * self.calibration_model.pattern_geometry.ttha
+                        180.0 / np.pi * self.calibration_model.get_pixel_geometry("tth")
                     )
                     azi_array = (
-                        180.0 / np.pi * self.calibration_model.pattern_geometry.chia
+                        180.0 / np.pi * self.calibration_model.get_pixel_geometry("chi")
                     )
                     oiadac = ObliqueAngleDetectorAbsorptionCorrection(
                         tth_array=tth_array, azi_array=azi_array
@@ -18,9 +18,12 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import errno
 import logging
 import os
 import copy
+import threading
+from functools import wraps
 
 import numpy as np
 from PIL import Image
@@ -29,17 +32,60 @@ import h5py
 import fabio
 
 from .util import Signal
-from dioptas.model.loader.spe import SpeFile
+from dioptas.model.loader.spe import SpeFile, get_frame_count as get_spe_frame_count
 from .util.NewFileWatcher import NewFileInDirectoryWatcher
-from .util.HelperModule import rotate_matrix_p90, rotate_matrix_m90, FileNameIterator
+from .util.Prefetcher import Prefetcher
+from .util.FrameCache import frame_cache
+from .util.HelperModule import rotate_matrix_p90, rotate_matrix_m90, FileNameIterator, read_series_images, \
+    compose_transformations
+from .util.calc import apply_background_and_corrections
+from .util.ImageStacking import StackReducer, reduce_image_files
 from .util.ImgCorrection import ImgCorrectionManager, ImgCorrectionInterface, TransferFunctionCorrection
-from dioptas.model.loader.LambdaLoader import LambdaImage
-from dioptas.model.loader.KaraboLoader import KaraboFile
-from dioptas.model.loader.hdf5Loader import Hdf5Image
-from dioptas.model.loader.FabioLoader import FabioLoader
+from dioptas.model.loader.LambdaLoader import LambdaImage, get_frame_count as get_lambda_frame_count
+from dioptas.model.loader.KaraboLoader import KaraboFile, get_frame_count as get_karabo_frame_count
+from dioptas.model.loader.hdf5Loader import Hdf5Image, get_frame_count as get_hdf5_frame_count
+from dioptas.model.loader.FabioLoader import FabioLoader, get_frame_count as get_fabio_frame_count
+from dioptas.model.loader.LoaderRegistry import LoaderRegistry, is_pil_image, is_spe, is_fabio_image, is_hdf5, \
+    get_hdf5_layout
 
 logger = logging.getLogger(__name__)
 
+# the loaders are referred to by the names of the ImgModel load functions, the registration order is the order in
+# which detected or probed loaders are tried
+image_loader_registry = LoaderRegistry()
+image_loader_registry.register("load_PIL", is_pil_image)
+image_loader_registry.register("load_spe", is_spe)
+image_loader_registry.register("load_fabio", is_fabio_image, fallback=True, layouts=("eiger", "lima"))
+image_loader_registry.register("load_lambda", is_hdf5, layouts=("lambda",))
+image_loader_registry.register("load_karabo", is_hdf5, layouts=("karabo",))
+image_loader_registry.register("load_hdf5", is_hdf5, fallback=True, layouts=("hdf5",))
+image_loader_registry.register_sniffer(is_hdf5, get_hdf5_layout)
+
+# functions of the loaded file data, which use the loader of the file
+LOADER_FUNCTIONS = ("series_get_image", "series_get_images", "select_source", "find_all_sources")
+
+
+def synchronize_loader(image_file_data):
+    """
+    Wraps the loader functions of the data of an image file with a common lock. The loaders are not thread safe, but
+    the frames of a series are read by the frame prefetch thread and e.g. by get_series_images on the calling thread.
+    :param image_file_data: dictionary returned by a load function
+    :return: the same dictionary with the wrapped functions
+    """
+    lock = threading.RLock()
+
+    def synchronized(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with lock:
+                return func(*args, **kwargs)
+        return wrapper
+
+    for name in LOADER_FUNCTIONS:
+        if image_file_data.get(name) is not None:
+            image_file_data[name] = synchronized(image_file_data[name])
+    return image_file_data
+
 
 class ImgModel(object):
     """
@@ -66,10 +112,23 @@ class ImgModel(object):
         self.series_max = 1
         self.selected_source = None
 
+        # the next files or frames in the navigation direction are loaded in the background
+        self.num_prefetch = 2
+        self.file_prefetcher = Prefetcher(num_workers=2)
+        self.frame_prefetcher = Prefetcher(num_workers=1)  # the loaders of a file are not thread safe
+        self._file_key = None
+        self._file_data = None
+
+        # decoded frames of multi-frame files, shared by all image models
+        self.frame_cache = frame_cache
+
+        # img_data is cached until one of its inputs changes, see img_data_version
+        self._img_data_version = 0
+        self._img_data_cache = None
+        self._img_data_cache_version = None
+        self._img_data_dtype = None
+
         self._img_data = None
-        self._img_data_background_subtracted = None
-        self._img_data_absorption_corrected = None
-        self._img_data_background_subtracted_absorption_corrected = None
 
         self.background_filename = ''
         self._background_data = None
@@ -98,12 +157,24 @@ class ImgModel(object):
             # a single parameter pos (position in the series starting at 0) and return a 2d array with the image data
             {"name": "series_get_image", "default": None, "attribute": "series_get_image"},
 
+            # optional function to get several consecutive images of the current series at once, taking the parameters
+            # start and stop (positions starting at 0) and returning a 3d array with the images
+            {"name": "series_get_images", "default": None, "attribute": "series_get_images"},
+
             # list of sources for different image series within 1 file. This is used by an HDF5 file with several
             # datasets
             {"name": "sources", "default": None, "attribute": "sources"},
 
             # a function to select a source:
-            {"name": "select_source", "default": None, "attribute": "_select_source"}
+            {"name": "select_source", "default": None, "attribute": "_select_source"},
+
+            # optional function returning all sources, if the sources list is not complete after loading, since searching
+            # the whole file takes long, see find_all_sources
+            {"name": "find_all_sources", "default": None, "attribute": "_find_all_sources"},
+
+            # loader object of the file and the currently selected source, used by select_source
+            {"name": "loader", "default": None, "attribute": "loader"},
+            {"name": "selected_source", "default": None, "attribute": "selected_source"},
         ]
 
         # set the loadable attributes to their defaults
@@ -138,7 +209,22 @@ class ImgModel(object):
         logger.info("Loading {0}.".format(filename))
         self.filename = filename
 
-        image_file_data = self.get_image_data(filename, pos)
+        file_key = self._get_file_key(filename)
+        image_file_data = None
+        if file_key is not None and file_key == self._file_key:
+            # another frame of the current file, e.g. from the batch or map view, the open loader is reused
+            image_file_data = self._get_series_file_data(pos)
+        if image_file_data is None:
+            self._file_key = file_key
+            self.frame_prefetcher.clear()
+            if file_key is not None:
+                image_file_data = self.file_prefetcher.pop(file_key + (pos,))
+            if image_file_data is None:
+                image_file_data = self.get_image_data(filename, pos)
+            self._file_data = {key: value for key, value in image_file_data.items() if key != "img_data"}
+            if image_file_data.get("series_max", 1) > 1:
+                frame_key = (file_key, image_file_data.get("selected_source"), pos)
+                image_file_data["img_data"] = self.frame_cache.put(frame_key, image_file_data["img_data"])
         self.set_loadable_attributes(image_file_data)
 
         self.file_name_iterator.update_filename(filename)
@@ -153,22 +239,69 @@ class ImgModel(object):
     def get_image_data(self, filename, pos=0):
         """
         Tries to load the given file using different image loader libraries and returns a dictionary containing all
-        retrieved file data.
+        retrieved file data. The loaders are tried in the order given by the loader registry: first the loaders matching
+        the file extension and header, and then all other loaders, the loader which was able to read the previous file
+        with the same directory and extension is tried before the loaders of the same precedence. HDF5 files are first
+        given to the loader matching the layout of the file. Loaders not able to read the file return None or raise an
+        IOError, all other errors are raised. Missing or unreadable files raise FileNotFoundError or PermissionError.
         :param filename: string containing a path to an image file
         :param pos: position of image in the image file to be loaded
         :return: dictionary containing all retrieved file information. Look at "loadable data" for possible key names.
                  Present key names depend on applied image loader
         """
-        img_loaders = [self.load_PIL, self.load_spe, self.load_fabio, self.load_lambda, self.load_karabo,
-                       self.load_hdf5]
-
-        for loader in img_loaders:
-            data = loader(filename, pos)
+        if not os.path.exists(filename):
+            raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), filename)
+        for loader_name in image_loader_registry.get_candidates(filename):
+            try:
+                data = getattr(self, loader_name)(filename, pos)
+            except (FileNotFoundError, PermissionError):  # e.g. missing external files of a HDF5 file
+                raise
+            except IOError:  # e.g. a remembered or wrongly detected loader not able to read the file
+                continue
             if data:
-                return data
+                image_loader_registry.remember(filename, loader_name)
+                return synchronize_loader(data)
         else:
             raise IOError("No handler found for given image with filename: " + filename)
 
+    def get_frame_count(self, filename):
+        """
+        Determines the number of images in a file by reading only the file headers or dataset shapes. The loaders are
+        probed in the same order as in get_image_data, if none of them is able to read the file, the file is loaded
+        completely. The state of the model is not changed, so that the function can be used from several threads.
+        :param filename: string containing a path to an image file
+        :return: number of images, which can be loaded from the file
+        """
+        frame_count_probes = {"load_PIL": self._count_frames_PIL,
+                              "load_spe": self._count_frames_spe,
+                              "load_fabio": get_fabio_frame_count,
+                              "load_lambda": get_lambda_frame_count,
+                              "load_karabo": get_karabo_frame_count,
+                              "load_hdf5": get_hdf5_frame_count}
+        for loader_name in image_loader_registry.get_candidates(filename):
+            probe = frame_count_probes[loader_name]
+            try:
+                num_frames = probe(filename)
+            except Exception:  # the header readers of the different libraries raise very different errors
+                continue
+            if num_frames:
+                return int(num_frames)
+
+        return self.get_image_data(filename).get("series_max", 1)
+
+    @staticmethod
+    def _count_frames_PIL(filename):
+        with Image.open(filename) as im:  # only reads the header
+            if np.prod(im.size) <= 1:
+                return None
+            return 1  # multi page images are loaded as single image, see load_PIL
+
+    @staticmethod
+    def _count_frames_spe(filename):
+        if os.path.splitext(filename)[1].lower() == '.spe':
+            return get_spe_frame_count(filename)
+        return None
+
     def set_loadable_attributes(self, loaded_data):
         """
         Sets all attributes that change with the loading of an image to either their defaults or a given value.
@@ -207,17 +340,23 @@ class ImgModel(object):
         except IOError:
             return None
 
-    def load_spe(self, filename, *args):
+    def load_spe(self, filename, frame_index=0):
         """
-        Loads an image using the builtin spe library.
+        Loads an image using the builtin spe library. The frames are memory mapped and only read when they are used.
         :param filename: path to the image file to be loaded
-        :return: dictionary with image_data, None if unsuccessful
+        :param frame_index: frame index of the image file to be loaded inside of multi-frame file
+        :return: dictionary with img_data, series_max and series_get_image, None if unsuccessful
         """
-        if os.path.splitext(filename)[1].lower() == '.spe':
-            spe = SpeFile(filename)
-            return {"img_data": spe.img}
-        else:
+        if os.path.splitext(filename)[1].lower() != '.spe':
+            return None
+        spe = SpeFile(filename)
+        if frame_index >= spe.num_frames:
             return None
+        if spe.num_frames == 1:
+            return {"img_data": spe.img}
+        return {"img_data": spe.get_frame(frame_index),
+                "series_max": spe.num_frames,
+                "series_get_image": spe.get_frame}
 
     def load_fabio(self, filename, frame_index=0):
         """
@@ -227,12 +366,13 @@ class ImgModel(object):
         :return: dictionary with image_data and image_data_fabio, None if unsuccessful
         """
         try:
-            self.loader = FabioLoader(filename)
+            loader = FabioLoader(filename)
             return {
-                "img_data_fabio": self.loader.fabio_image,
-                "img_data": self.loader.get_image(frame_index),
-                "series_max": self.loader.series_max,
-                "series_get_image": self.loader.get_image
+                "img_data_fabio": loader.fabio_image,
+                "img_data": loader.get_image(frame_index),
+                "series_max": loader.series_max,
+                "series_get_image": loader.get_image,
+                "loader": loader
             }
         except (IOError, fabio.fabioutils.NotGoodReader):
             return None
@@ -253,7 +393,8 @@ class ImgModel(object):
             return None
         return {"img_data": lambda_im.get_image(frame_index),
                 "series_max": lambda_im.series_max,
-                "series_get_image": lambda_im.get_image}
+                "series_get_image": lambda_im.get_image,
+                "series_get_images": lambda_im.get_images}
 
     def load_karabo(self, filename, frame_index=0):
         """
@@ -271,7 +412,8 @@ class ImgModel(object):
             return None
         return {"img_data": karabo_file.get_image(frame_index),
                 "series_max": karabo_file.series_max,
-                "series_get_image": karabo_file.get_image}
+                "series_get_image": karabo_file.get_image,
+                "series_get_images": karabo_file.get_images}
 
     def load_hdf5(self, filename, frame_index=0):
         """
@@ -283,21 +425,35 @@ class ImgModel(object):
         """
 
         hdf5_image = Hdf5Image(filename)
-        self.loader = hdf5_image
-        self.selected_source = hdf5_image.image_sources[0]
 
         return {"img_data": hdf5_image.get_image(frame_index),
                 "series_max": hdf5_image.series_max,
                 "series_get_image": hdf5_image.get_image,
+                "series_get_images": hdf5_image.get_images,
                 "sources": hdf5_image.image_sources,
-                "select_source": hdf5_image.select_source
+                "select_source": hdf5_image.select_source,
+                "find_all_sources": hdf5_image.find_all_image_sources,
+                "loader": hdf5_image,
+                "selected_source": hdf5_image.image_sources[0]
                 }
 
+    def find_all_sources(self):
+        """
+        Completes the list of sources of the current file. The search for sources in HDF5 files stops at the first image
+        source when loading the file, this should be called before all sources are shown, e.g. in a source selector.
+        :return: list of all sources
+        """
+        if self._find_all_sources is not None:
+            self.sources = self._find_all_sources()
+            self._find_all_sources = None
+        return self.sources
+
     def select_source(self, source):
         """
         Selects a source from the available sources and loads updates the current image in the model.
         :param source: string for source (check sources for available strings for the corresponding file)
         """
+        self.frame_prefetcher.clear()
         self._select_source(source)
         self.selected_source = source
         self.series_max = self.loader.series_max
@@ -353,9 +509,7 @@ class ImgModel(object):
         filename = str(filename)  # since it could also be QString
 
         img_data = self.get_image_data(filename)["img_data"]
-
-        for transformation in self.img_transformations:
-            img_data = transformation(img_data)
+        img_data = compose_transformations(self.img_transformations)(img_data)
 
         if not self._img_data.shape == img_data.shape:
             return
@@ -365,12 +519,85 @@ class ImgModel(object):
         if self._img_data.dtype == np.uint16:  # if dtype is only uint16 we will convert to 32 bit, so that more
             # additions are possible
             self._img_data = self._img_data.astype(np.uint32)
+        elif self._img_data.dtype == np.int16:  # e.g. Lambda detectors
+            self._img_data = self._img_data.astype(np.int32)
 
+        if not self._img_data.flags.writeable:  # shared frame of the frame cache
+            self._img_data = self._img_data.copy()
         self._img_data += img_data
 
         self._calculate_img_data()
         self.img_changed.emit()
 
+    def combine_files(self, filenames, mode='sum', num_workers=4, sigma=3.0):
+        """
+        Loads several image files and combines them into a single image, e.g. to sum or average dark images. The first
+        file is loaded as usual, the others are decoded in a thread pool and accumulated without keeping all images in
+        memory. Files with a different image shape are skipped. The images of a single series file are combined with
+        combine_series_images.
+        The img_changed signal is emitted once after all files are combined.
+        :param filenames: list of image file paths
+        :param mode: 'sum', 'mean', 'median', 'sigma_clip' or 'mad_clip', see StackReducer
+        :param num_workers: number of threads loading the files
+        :param sigma: rejection threshold for the outlier rejection modes
+        """
+        filenames = [str(filename) for filename in filenames]
+
+        img_changed_blocked = self.img_changed.blocked
+        self.img_changed.blocked = True
+        try:
+            self.load(filenames[0])
+        finally:
+            self.img_changed.blocked = img_changed_blocked
+
+        if len(filenames) == 1 and self.series_max > 1:
+            self.combine_series_images(mode, sigma=sigma)
+            return
+
+        reducer = StackReducer(mode, sigma=sigma)
+        reducer.add(self._img_data)
+        transform = compose_transformations(self.img_transformations)
+        reduce_image_files(filenames[1:], lambda filename: transform(self.get_image_data(filename)["img_data"]),
+                           reducer, num_workers)
+        if reducer.num_skipped:
+            logger.warning("{} files with a different image shape were not combined.".format(reducer.num_skipped))
+        self._set_combined_img_data(reducer, "{} files".format(reducer.num_images))
+
+    def combine_series_images(self, mode='mad_clip', positions=None, block_size=16, sigma=3.0):
+        """
+        Combines the images of the currently loaded series into a single image, e.g. repeated exposures of the same
+        sample. The outlier rejection modes remove zingers and cosmic rays per pixel across the whole stack. The series
+        is read in blocks of block_size images.
+        The img_changed signal is emitted once after all images are combined.
+        :param mode: 'sum', 'mean', 'median', 'sigma_clip' or 'mad_clip', see StackReducer
+        :param positions: list of image positions in the series, starting at 0, all images if None
+        :param block_size: number of images read at once
+        :param sigma: rejection threshold for the outlier rejection modes
+        """
+        if self.series_get_image is None:
+            return
+        if positions is None:
+            positions = range(self.series_max)
+        positions = list(positions)
+
+        reducer = StackReducer(mode, sigma=sigma)
+        transform = compose_transformations(self.img_transformations)
+        for ind in range(0, len(positions), block_size):
+            block_positions = positions[ind:ind + block_size]
+            images = read_series_images(block_positions, self.series_get_image, self.series_get_images)
+            reducer.add_images(transform(np.array(images)))
+        self._set_combined_img_data(reducer, "{} series images".format(reducer.num_images))
+
+    def _set_combined_img_data(self, reducer, description):
+        img_data = reducer.get_result()
+        if img_data is None:
+            return
+        logger.info("Combined {} ({}), {} outlier pixels rejected.".format(description, reducer.mode,
+                                                                          reducer.num_rejected))
+        self._img_data = img_data
+        self._calculate_img_data()
+        self.img_changed.emit()
+
     def _image_and_background_shape_equal(self):
         """
         Tests if the original image and original background image have the same shape
@@ -446,14 +673,56 @@ class ImgModel(object):
         if self.series_pos == pos:
             return
 
+        step = pos - self.series_pos
         self.series_pos = pos
-        self._img_data = self.series_get_image(pos - 1)
+        self._img_data = self._get_frame(pos - 1)
+        self._prefetch_frames(step)
 
         self._perform_img_transformations()
         self._calculate_img_data()
 
         self.img_changed.emit()
 
+    def get_series_images(self, positions):
+        """
+        Returns several images of the currently loaded series with all image transformations, background subtraction,
+        corrections and the factor applied, same as for img_data. The current image of the model is not changed and
+        no signal is emitted.
+        :param positions: list of image positions in the series, starting at 0
+        :return: 3d array with shape (len(positions), height, width)
+        """
+        if self.series_get_image is None:
+            # single image files, transformations are already applied
+            return self._apply_background_and_corrections(np.array([self._img_data] * len(positions)))
+
+        images = np.array(read_series_images(positions, self.series_get_image, self.series_get_images))
+        images = compose_transformations(self.img_transformations)(images)
+        return self._apply_background_and_corrections(images)
+
+    def _apply_background_and_corrections(self, img_data):
+        """
+        Applies the background subtraction, the image corrections and the factor to the given image data.
+        :param img_data: 2d image or 3d array of images with the same shape as the current image
+        :return: corrected image data
+        """
+        background, corrections = self.get_background_and_corrections(img_data.shape[-2:])
+        return apply_background_and_corrections(img_data, background, corrections, self.factor)
+
+    def get_background_and_corrections(self, img_shape):
+        """
+        Returns the arrays needed to process images of the given shape outside of the model (e.g. in worker
+        processes) in the same way as get_series_images does.
+        :param img_shape: shape of the (transformed) images
+        :return: scaled and offset background (or None) and the combined correction array (or None)
+        """
+        background = None
+        corrections = None
+        if self._background_data is not None and self._background_data.shape == tuple(img_shape):
+            background = self._background_scaling * self._background_data + self._background_offset
+        if self._img_corrections.has_items() and self._img_corrections.shape == tuple(img_shape):
+            corrections = self._img_corrections.get_data()
+        return background, corrections
+
     def load_next_file(self, step=1, pos=None):
         """
         Loads the next file based on the current iteration mode and the step you specify.
@@ -463,6 +732,7 @@ class ImgModel(object):
         next_file_name = self.file_name_iterator.get_next_filename(mode=self.file_iteration_mode, step=step, pos=pos)
         if next_file_name is not None:
             self.load(next_file_name)
+            self._prefetch_files(step, pos)
 
     def load_previous_file(self, step=1, pos=None):
         """
@@ -474,6 +744,7 @@ class ImgModel(object):
                                                                            step=step, pos=pos)
         if previous_file_name is not None:
             self.load(previous_file_name)
+            self._prefetch_files(-step, pos)
 
     def load_next_folder(self, mec_mode=False):
         """
@@ -498,6 +769,104 @@ class ImgModel(object):
         if next_previous_name is not None:
             self.load(next_previous_name)
 
+    def _prefetch_files(self, step, pos=None):
+        """
+        Starts loading the next files in the navigation direction in the background.
+        :param step: step of the last navigation, negative for previous files
+        :param pos: position of the number in the filename, see FileNameIterator.get_next_filename
+        """
+        if self.num_prefetch <= 0:
+            return
+        try:
+            filenames = self.file_name_iterator.get_next_filenames(self.num_prefetch, step,
+                                                                   self.file_iteration_mode, pos)
+        except (ValueError, OSError):  # the current file is not in the list of timed files anymore
+            return
+        keys = [self._get_file_key(filename) for filename in filenames]
+        keys = [key + (0,) for key in keys if key is not None]
+        self.file_prefetcher.retain(keys)
+        for key in keys:
+            self.file_prefetcher.prefetch(key, self.get_image_data, key[0], 0)
+
+    def _prefetch_frames(self, step):
+        """
+        Starts loading the next frames of the current series in the navigation direction in the background.
+        :param step: step of the last navigation, negative for previous frames
+        """
+        if self.num_prefetch <= 0 or self.series_get_image is None or step == 0:
+            return
+        positions = [self.series_pos - 1 + step * ind for ind in range(1, self.num_prefetch + 1)]
+        keys = [self._get_frame_key(pos) for pos in positions
+                if 0 <= pos < self.series_max and self._get_frame_key(pos) not in self.frame_cache]
+        self.frame_prefetcher.retain(keys)
+        if len(keys) == 0:
+            return
+        if self.series_get_images is not None and abs(step) == 1:
+            # the first request reads all frames as one block, the others are then taken from the frame cache
+            start = min(key[-1] for key in keys)
+            stop = max(key[-1] for key in keys) + 1
+            self.frame_prefetcher.prefetch(keys[0], self._load_frames, keys[0], start, stop)
+        for key in keys:
+            self.frame_prefetcher.prefetch(key, self._load_frame, key)
+
+    def _get_frame(self, pos):
+        """
+        Returns a frame of the current series from the frame cache or loads it. The frame is loaded by the prefetch
+        thread, so that a pending prefetch of the same frame is reused.
+        :param pos: position of the frame, starting at 0
+        """
+        key = self._get_frame_key(pos)
+        frame = self.frame_cache.get(key)
+        if frame is None:
+            self.frame_prefetcher.prefetch(key, self._load_frame, key)
+            frame = self.frame_prefetcher.pop(key)
+        if frame is None:  # loading failed, loading it again raises the error
+            frame = self.series_get_image(pos)
+        return frame
+
+    def _load_frame(self, key):
+        return self.frame_cache.get_or_load(key, self.series_get_image, key[-1])
+
+    def _load_frames(self, key, start, stop):
+        """
+        Loads the frames start to stop into the frame cache and returns the frame of the given key.
+        """
+        frame = None
+        for pos, img_data in zip(range(start, stop), self.series_get_images(start, stop)):
+            img_data = self.frame_cache.put(key[:-1] + (pos,), img_data)
+            if pos == key[-1]:
+                frame = img_data
+        return frame
+
+    def _get_series_file_data(self, pos):
+        """
+        Returns the data of the current file with the frame at pos, if the file is a series, which can be reused
+        without opening the file again.
+        """
+        if self._file_data is None or self._file_data.get("series_get_image") is None:
+            return None
+        if self.selected_source != self._file_data.get("selected_source"):
+            return None  # the loader was switched to another source
+        if self._file_data.get("series_max", 1) <= 1 or not 0 <= pos < self._file_data["series_max"]:
+            return None
+        image_file_data = dict(self._file_data)
+        image_file_data["img_data"] = self._get_frame(pos)
+        return image_file_data
+
+    def _get_frame_key(self, pos):
+        return self._file_key, self.selected_source, pos
+
+    @staticmethod
+    def _get_file_key(filename):
+        """
+        :return: key identifying a file and its version, None if the file does not exist
+        """
+        try:
+            stat = os.stat(filename)
+        except OSError:
+            return None
+        return os.path.abspath(filename), stat.st_mtime_ns, stat.st_size
+
     def set_file_iteration_mode(self, mode):
         """
         Sets the file iteration mode for the load_next_file and load_previous_file functions. Possible modes:
@@ -514,8 +883,8 @@ class ImgModel(object):
 
     def _calculate_img_data(self):
         """
-        Calculates compound img_data based on the state of the object. This function is used internally to not compute
-        those img arrays every time somebody requests the image data by get_img_data() and img_data.
+        Checks that the background and the corrections have the same dimensions as the image and marks img_data to be
+        recalculated on its next access. Needs to be called after changing any input of img_data in place.
         """
 
         # check that all data has the same dimensions
@@ -528,18 +897,7 @@ class ImgModel(object):
                 self.transfer_correction.reset()
                 self.corrections_removed.emit()
 
-        # calculate the current _img_data
-        if self._background_data is not None and not self._img_corrections.has_items():
-            self._img_data_background_subtracted = self._img_data - (self._background_scaling *
-                                                                     self._background_data +
-                                                                     self._background_offset)
-        elif self._background_data is None and self._img_corrections.has_items():
-            self._img_data_absorption_corrected = self._img_data / self._img_corrections.get_data()
-
-        elif self._background_data is not None and self._img_corrections.has_items():
-            self._img_data_background_subtracted_absorption_corrected = (self._img_data - (
-                    self._background_scaling * self._background_data + self._background_offset)) / \
-                                                                        self._img_corrections.get_data()
+        self._img_data_version += 1
 
     @property
     def img_data(self):
@@ -548,21 +906,72 @@ class ImgModel(object):
             The image based on the current state of the ImgData object. It will apply all image correction as well as
             background subtraction. in case you want the raw data without corrections, please use the
             raw_img_data property.
+            The image is cached until its inputs change and is read-only, please copy it before modifying it.
+        """
+        version = self.img_data_version
+        if self._img_data_cache_version != version:
+            self._img_data_cache = self._calculate_composite_img_data()
+            self._img_data_cache_version = version
+        return self._img_data_cache
+
+    def _calculate_composite_img_data(self):
+        img_data = self._img_data
+        if img_data is None:
+            return None
+
+        background, corrections = self.get_background_and_corrections(img_data.shape)
+        if self._img_data_dtype is not None:
+            img_data = img_data.astype(self._img_data_dtype, copy=False)
+            if background is not None:
+                background = background.astype(self._img_data_dtype, copy=False)
+            if corrections is not None:
+                corrections = corrections.astype(self._img_data_dtype, copy=False)
+
+        if background is None and corrections is None and self.factor == 1:
+            img_data = img_data.view()  # no copy of the raw image is needed
+        else:
+            img_data = apply_background_and_corrections(img_data, background, corrections, self.factor)
+        img_data.flags.writeable = False
+        return img_data
+
+    @property
+    def img_data_version(self):
+        """
+        Number, which increases whenever an input of img_data changes (raw image, background, corrections or factor).
+        Consumers can compare it with the version of their last update to skip redundant work.
         """
-        # if self._img_data is None:
-        #     return None
+        return self._img_data_version + self._img_corrections.version
 
-        if self._background_data is None and not self._img_corrections.has_items():
-            return self._img_data * self.factor
+    @property
+    def img_data_dtype(self):
+        """
+        dtype in which img_data is calculated, None uses the dtype resulting from the raw image, background and
+        corrections. np.float32 halves the memory of corrected images.
+        """
+        return self._img_data_dtype
 
-        elif self._background_data is not None and not self._img_corrections.has_items():
-            return self._img_data_background_subtracted * self.factor
+    @img_data_dtype.setter
+    def img_data_dtype(self, new_value):
+        self._img_data_dtype = new_value
+        self._img_data_version += 1
 
-        elif self._background_data is None and self._img_corrections.has_items():
-            return self._img_data_absorption_corrected * self.factor
+    @property
+    def _img_data(self):
+        return self._raw_img_data
+
+    @_img_data.setter
+    def _img_data(self, new_data):
+        self._raw_img_data = new_data
+        self._img_data_version += 1
+
+    @property
+    def _background_data(self):
+        return self._raw_background_data
 
-        elif self._background_data is not None and self._img_corrections.has_items():
-            return self._img_data_background_subtracted_absorption_corrected * self.factor
+    @_background_data.setter
+    def _background_data(self, new_data):
+        self._raw_background_data = new_data
+        self._img_data_version += 1
 
     @property
     def raw_img_data(self):
@@ -653,40 +1062,28 @@ class ImgModel(object):
             self.img_changed.emit()
 
     def _reset_img_transformations(self):
-        for transformation in reversed(self.img_transformations):
-            if transformation == rotate_matrix_p90:
-                self._img_data = rotate_matrix_m90(self._img_data)
-            elif transformation == rotate_matrix_m90:
-                self._img_data = rotate_matrix_p90(self._img_data)
-            else:
-                self._img_data = transformation(self._img_data)
+        if self.img_transformations:
+            self._img_data = compose_transformations(self.img_transformations, inverse=True)(self._img_data)
 
     def _reset_background_transformations(self):
-        if self._background_data is None:
-            return
-
-        for transformation in reversed(self.img_transformations):
-            if transformation == rotate_matrix_p90:
-                self._background_data = rotate_matrix_m90(self._background_data)
-            elif transformation == rotate_matrix_m90:
-                self._background_data = rotate_matrix_p90(self._background_data)
-            else:
-                self._background_data = transformation(self._background_data)
+        if self._background_data is not None and self.img_transformations:
+            self._background_data = compose_transformations(self.img_transformations, inverse=True)(
+                self._background_data)
 
     def _perform_img_transformations(self):
         """
-        Performs all saved image transformation on original image.
+        Performs all saved image transformation on original image. Rotations and flips are composed into a single
+        strided view of the image, see compose_transformations.
         """
-        for transformation in self.img_transformations:
-            self._img_data = transformation(self._img_data)
+        if self.img_transformations:
+            self._img_data = compose_transformations(self.img_transformations)(self._img_data)
 
     def _perform_background_transformations(self):
         """
         Performs all saved image transformation on background image.
         """
-        if self._background_data is not None:
-            for transformation in self.img_transformations:
-                self._background_data = transformation(self._background_data)
+        if self._background_data is not None and self.img_transformations:
+            self._background_data = compose_transformations(self.img_transformations)(self._background_data)
 
     def get_transformations_string_list(self):
         transformation_list = []
@@ -745,6 +1142,7 @@ class ImgModel(object):
                 self.get_img_correction('transfer') is None:
             self.add_img_correction(self.transfer_correction, 'transfer')
         if self.get_img_correction('transfer') is not None:
+            self._img_corrections.update()
             self._calculate_img_data()
             self.img_changed.emit()
 
@@ -826,6 +1224,7 @@ class ImgModel(object):
     @factor.setter
     def factor(self, new_value):
         self._factor = new_value
+        self._img_data_version += 1
         self.img_changed.emit()
 
     def blockSignals(self, block=True):
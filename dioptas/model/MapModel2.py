@@ -65,6 +65,9 @@ class MapModel2:
         self.possible_dimensions = None
         self.map = None
 
+        # number of frames of a multi-frame file which are integrated at once
+        self.block_size = 16
+
     def load(self, filepaths: list[str]):
         """Loads a list of files, integrates them and creates a map"""
         if len(filepaths) == 0:
@@ -120,14 +123,17 @@ class MapModel2:
             self.configuration.img_model.img_changed.blocked = False
 
     def _integrate(self):
+        img_model = self.configuration.img_model
         for file_ind, filepath in enumerate(self.filepaths):
-            self.configuration.img_model.load(filepath)
+            img_model.load(filepath)
+            series_max = img_model.series_max
 
-            for frame_ind in range(self.configuration.img_model.series_max):
-                self.configuration.img_model.load_series_img(frame_ind + 1)
-                x, y = self.configuration.integrate_image_1d()
+            for block_start in range(0, series_max, self.block_size):
+                positions = range(block_start, min(block_start + self.block_size, series_max))
+                images = img_model.get_series_images(positions)
+                x, intensities = self.configuration.integrate_image_stack_1d(images)
 
-                if file_ind == 0:
+                if file_ind == 0 and block_start == 0:
                     self.pattern_x = x
                 else:
                     if len(x) != len(self.pattern_x):
@@ -135,12 +141,13 @@ class MapModel2:
                             "The integrated patterns have different length, this is not supported"
                         )
 
-                self.point_infos.append(MapPointInfo(filepath, frame_ind))
-                self.pattern_intensities.append(y)
+                for frame_ind, y in zip(positions, intensities):
+                    self.point_infos.append(MapPointInfo(filepath, frame_ind))
+                    self.pattern_intensities.append(y)
 
-                self.point_integrated.emit(
-                    file_ind + (frame_ind + 1) / self.configuration.img_model.series_max
-                )
+                    self.point_integrated.emit(
+                        file_ind + (frame_ind + 1) / series_max
+                    )
         self.pattern_intensities = np.array(self.pattern_intensities)
 
     def _reset(self):
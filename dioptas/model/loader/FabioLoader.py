@@ -18,7 +18,9 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import numpy as np
 import fabio
+from fabio.edfimage import EdfImage
 
 
 class FabioLoader:
@@ -30,6 +32,55 @@ class FabioLoader:
 
         self.fabio_image = fabio.open(filename)
         self.series_max = self.fabio_image.nframes
+        self.filename = filename
+        self._frame_layout = get_edf_frame_layout(filename, self.fabio_image)
+        self._memmap = None
 
     def get_image(self, ind=0):
+        if self._frame_layout is not None:
+            return self._get_memmap_frame(ind)[::-1]
         return self.fabio_image.get_frame(ind).data[::-1]
+
+    def _get_memmap_frame(self, ind):
+        if self._memmap is None:
+            self._memmap = np.memmap(self.filename, dtype=np.uint8, mode='r')
+        start, shape, dtype = self._frame_layout[ind]
+        size = int(np.prod(shape)) * dtype.itemsize
+        return self._memmap[start:start + size].view(dtype).reshape(shape)
+
+
+def get_edf_frame_layout(filename, fabio_image):
+    """
+    Determines the position of the frames of a multi-frame EDF file, if all of them are stored uncompressed in the
+    native byte order, so that they can be used directly from the memory mapped file.
+    :param filename: path to the image file
+    :param fabio_image: fabio image opened from the file
+    :return: list of (start, shape, dtype) for each frame or None if the frames can not be memory mapped
+    """
+    if not isinstance(fabio_image, EdfImage) or fabio_image.nframes <= 1:
+        return None
+    if not filename.lower().endswith('.edf'):  # e.g. compressed .edf.gz files
+        return None
+
+    layout = []
+    for ind in range(fabio_image.nframes):
+        frame = fabio_image.get_frame(ind)
+        if frame.bfname is not None or frame.start is None:
+            return None  # data in an external file
+        if frame.swap_needed():
+            return None
+        dtype = np.dtype(frame.bytecode)
+        shape = tuple(int(dim) for dim in frame.shape)
+        if int(np.prod(shape)) * dtype.itemsize != frame.blobsize:
+            return None  # compressed data
+        layout.append((int(frame.start), shape, dtype))
+    return layout
+
+
+def get_frame_count(filename):
+    """
+    Reads the number of frames from the header of a fabio image, without reading the image data
+    :param filename: path to the image file
+    :return: number of frames
+    """
+    return fabio.openheader(filename).nframes
@@ -18,15 +18,19 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import numpy as np
+
 try:
-    from extra_data import H5File
+    from extra_data import H5File, by_index
     from extra_data.exceptions import FileStructureError
 except ImportError:
     karabo_installed = False
 else:
     karabo_installed = True
 
-__all__ = ['KaraboFile', 'karabo_installed']
+__all__ = ['KaraboFile', 'karabo_installed', 'get_frame_count']
+
+IMAGE_KEY = 'data.image.pixels'
 
 
 class KaraboFile:
@@ -40,8 +44,54 @@ class KaraboFile:
         self.series_max = len(self.f.train_ids)
         self.sources = [s for s in self.f.instrument_sources if "daqOutput" in s]
         self.current_source = self.sources[source_ind]
+        self._key_data = {}
+
+    def _get_key_data(self, source=None):
+        """
+        Returns the image data of a source, the selection is cached, since selecting the data of a file with many trains
+        is expensive.
+        :param source: instrument source, default is the current source
+        :return: extra_data KeyData of the image pixels
+        """
+        source = source or self.current_source
+        if source not in self._key_data:
+            self._key_data[source] = self.f[source, IMAGE_KEY]
+        return self._key_data[source]
 
     def get_image(self, ind):
-        sel = self.f.select(self.current_source, 'data.image.pixels')
-        tid, data = sel.train_from_index(ind)
-        return data[self.current_source]['data.image.pixels']
+        tid, data = self._get_key_data().train_from_index(ind)
+        return data
+
+    def get_images(self, start, stop, out=None):
+        """
+        Reads the images of the trains start to stop at once. Trains without image or with several images are read
+        one by one.
+        :param start: index of the first train, starting at 0
+        :param stop: index after the last train
+        :param out: optional preallocated array with shape (stop - start, height, width) and the dtype of the images
+        :return: 3d array with the images
+        """
+        start, stop = max(int(start), 0), min(int(stop), self.series_max)
+        train_data = self._get_key_data().select_trains(by_index[start:stop])
+        if np.all(train_data.data_counts(labelled=False) == 1):
+            return train_data.ndarray(out=out)
+
+        images = np.array([self.get_image(ind) for ind in range(start, stop)])
+        if out is None:
+            return images
+        out[...] = images
+        return out
+
+
+def get_frame_count(filename):
+    """
+    Reads the number of trains of a karabo file from its index, without reading the image data
+    :param filename: path to the *.h5 karabo file
+    :return: number of trains
+    """
+    if not karabo_installed:
+        raise IOError('karabo_data is required to load karabo h5 files')
+    try:
+        return len(H5File(filename).train_ids)
+    except FileStructureError:
+        raise IOError('This hdf5 file is not a generated by karabo')
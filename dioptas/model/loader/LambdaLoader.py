@@ -22,6 +22,8 @@ import numpy as np
 import h5py
 import re
 
+from .hdf5Loader import read_frames
+
 
 def first(array):
     """  get first element if the only
@@ -39,6 +41,32 @@ def first(array):
     return array[...]
 
 
+DETECTOR_IDENTIFIERS = [["/entry/instrument/detector/description", "Lambda"],
+                        ["/entry/instrument/detector/description", b"Lambda"]]
+DATA_PATH = "entry/instrument/detector/data"
+
+
+def get_frame_count(filename):
+    """
+    Reads the number of images of a lambda file from the shape of its dataset, without reading the image data
+    :param filename: path to one of the module files
+    :return: number of images
+    """
+    try:
+        nx_file = h5py.File(filename, "r")
+    except OSError:
+        raise IOError("not a loadable hdf5 file")
+
+    with nx_file:
+        for identifier in DETECTOR_IDENTIFIERS:
+            try:
+                if first(nx_file[identifier[0]]) == identifier[1]:
+                    return nx_file[DATA_PATH].shape[0]
+            except KeyError:
+                pass
+    raise IOError("not a lambda image")
+
+
 class LambdaImage:
     def __init__(self, filename=None, file_list=None):
         """
@@ -46,12 +74,11 @@ class LambdaImage:
         :param filename: path to the image file to be loaded
         :return: dictionary with image_data, img_data_lambda and series_max, None if unsuccessful
         """
-        detector_identifiers = [["/entry/instrument/detector/description", "Lambda"],
-                                ["/entry/instrument/detector/description", b"Lambda"]]
+        detector_identifiers = DETECTOR_IDENTIFIERS
         filenumber_list = [1, 2, 3]
         regex_in = r"(.+_m)\d((_part\d+|).nxs)"
         regex_out = r"\g<1>{}\g<2>"
-        data_path = "entry/instrument/detector/data"
+        data_path = DATA_PATH
         module_positions_path = "/entry/instrument/detector/translation/distance"
 
         if not filename:
@@ -97,20 +124,52 @@ class LambdaImage:
         np.subtract(self._module_pos, self._module_pos[0][1], self._module_pos, where=[0, 1, 0])
         self.series_max = lambda_files[0][data_path].shape[0]
 
-    def get_image(self, image_nr):
+        self.dtype = np.result_type(*[module.dtype for module in self.full_img_data])
+        self.shape, self._module_slices = self._calculate_layout()
+
+    def _calculate_layout(self):
+        """
+        Calculates the shape of the stitched image and the position of each module in it. The stitched image is flipped
+        vertically, so the rows of each module are placed in reversed order.
+        :return: shape of the stitched image and a list of (row slice, column slice) for every module
+        """
+        tmp = self.shapes + self._module_pos[:, :2][:, ::-1]
+        shape = (int(np.max(tmp[:, 0])), int(np.max(tmp[:, 1])))
+
+        module_slices = []
+        for (height, width), (col, row) in zip(self.shapes, self._module_pos[:, :2]):
+            module_slices.append((slice(shape[0] - row - height, shape[0] - row), slice(col, col + width)))
+        return shape, module_slices
+
+    def get_image(self, image_nr, out=None):
         """
         Gets the data for the given image nr and stitches the tiles together
         :param image_nr: position from which to take the image from the image set
-        :return: image_data
+        :param out: optional image of a previous call, which is reused for stitching. The gaps between the modules are
+                    not cleared again.
+        :return: image_data in the data type of the detector
         """
+        if out is None:
+            out = np.zeros(self.shape, dtype=self.dtype)
 
-        tmp = self.shapes + self._module_pos[:, :2][:, ::-1]
-        shape = (np.max(tmp[:, 0]), np.max(tmp[:, 1]))
-        image = np.zeros(shape)
-
-        for modulenr, moduleImageData in enumerate(self.full_img_data):
-            image[self._module_pos[modulenr, 1]:self._module_pos[modulenr, 1] + self.shapes[modulenr][0],
-            self._module_pos[modulenr, 0]:self._module_pos[modulenr, 0] + self.shapes[modulenr][1]] = moduleImageData[
-                image_nr]
+        for module_image_data, (rows, cols) in zip(self.full_img_data, self._module_slices):
+            out[rows, cols] = module_image_data[image_nr][::-1]
+        return out
 
-        return image[::-1]
+    def get_images(self, start, stop, out=None):
+        """
+        Gets the data for the images start to stop and stitches the tiles of all images at once
+        :param start: position of the first image, starting at 0
+        :param stop: position after the last image
+        :param out: optional array with shape (stop - start,) + shape, see get_image
+        :return: 3d array with the images
+        """
+        start, stop = max(int(start), 0), min(int(stop), self.series_max)
+        if out is None:
+            out = np.zeros((max(stop - start, 0),) + self.shape, dtype=self.dtype)
+        if stop <= start:
+            return out
+
+        for module_image_data, (rows, cols) in zip(self.full_img_data, self._module_slices):
+            out[:, rows, cols] = read_frames(module_image_data, start, stop)[:, ::-1]
+        return out
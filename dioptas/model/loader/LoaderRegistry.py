@@ -0,0 +1,262 @@
+# -*- coding: utf-8 -*-
+# Dioptas - GUI program for fast processing of 2D X-ray diffraction data
+# Principal author: Clemens Prescher (clemens.prescher@gmail.com)
+# Copyright (C) 2014-2019 GSECARS, University of Chicago, USA
+# Copyright (C) 2015-2018 Institute for Geology and Mineralogy, University of Cologne, Germany
+# Copyright (C) 2019-2020 DESY, Hamburg, Germany
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import threading
+from collections import OrderedDict
+
+import h5py
+from PIL import Image
+
+from .LambdaLoader import DETECTOR_IDENTIFIERS as LAMBDA_IDENTIFIERS, first
+
+HEADER_SIZE = 512
+
+HDF5_SIGNATURE = b"\x89HDF\r\n\x1a\n"
+PIL_SIGNATURES = (
+    b"II*\x00",  # little endian tiff
+    b"MM\x00*",  # big endian tiff
+    b"\x89PNG\r\n\x1a\n",
+    b"\xff\xd8\xff",  # jpeg
+    b"BM",
+    b"GIF8",
+)
+
+
+def read_header(filename, size=HEADER_SIZE):
+    """
+    Reads the first bytes of a file.
+    :return: the bytes or an empty bytes object if the file can not be read
+    """
+    try:
+        with open(filename, "rb") as f:
+            return f.read(size)
+    except OSError:
+        return b""
+
+
+# detect functions, getting the lower case file extension and the first bytes of a file
+
+def is_hdf5(extension, header):
+    return header.startswith(HDF5_SIGNATURE)
+
+
+def is_pil_image(extension, header):
+    if header.startswith(PIL_SIGNATURES):
+        return True
+    return not is_hdf5(extension, header) and extension in Image.registered_extensions()
+
+
+def is_spe(extension, header):
+    return extension == '.spe'
+
+
+def is_fabio_image(extension, header):
+    return not header.startswith(PIL_SIGNATURES)
+
+
+def get_hdf5_layout(filename):
+    """
+    Determines the layout of a HDF5 file from its groups and datasets, with a single open of the file and without
+    reading image data. The checks are the same as the ones of the corresponding readers.
+    :param filename: path of the HDF5 file
+    :return: "eiger" or "lima" for files read by fabio, "lambda", "karabo" or "hdf5" for any other HDF5 file. None if
+             the file can not be inspected.
+    """
+    try:
+        h5_file = h5py.File(filename, "r")
+    except OSError:
+        return None
+    try:
+        with h5_file:
+            if _is_eiger_layout(h5_file):
+                return "eiger"
+            if _is_lima_layout(h5_file):
+                return "lima"
+            for path, value in LAMBDA_IDENTIFIERS:
+                if path in h5_file and first(h5_file[path]) == value:
+                    return "lambda"
+            if "INDEX/trainId" in h5_file:
+                return "karabo"
+            return "hdf5"
+    except (OSError, KeyError, TypeError):  # e.g. broken links
+        return None
+
+
+def _is_eiger_layout(h5_file):
+    entry = h5_file.get("entry")
+    if not isinstance(entry, h5py.Group):
+        return False
+    if "data" in entry and isinstance(entry["data"], h5py.Group):
+        return any(name.startswith("data") for name in entry["data"])
+    return any(name.startswith("data") for name in entry)
+
+
+def _is_lima_layout(h5_file):
+    entry_name = h5_file.attrs.get("default")
+    if entry_name is None or entry_name not in h5_file:
+        return False
+    entry = h5_file[entry_name]
+    return "measurement" in entry and "data" in entry["measurement"]
+
+
+class LoaderRegistry(object):
+    """
+    Ordered collection of image loaders, which decides in which order the loaders are tried for a file.
+
+    Every loader is registered with a detect function, which gets the lower case file extension and the first bytes of
+    the file and returns whether the loader can possibly read the file. The detected loaders are tried first in the
+    order of registration, followed by all remaining loaders as fallback, in case the detection was wrong.
+
+    Additionally, the loader which was able to read the last file with the same directory and extension is remembered,
+    since the files of a directory are usually written by the same detector. It is tried before the other loaders of
+    the same precedence level: consecutive detected loaders, which are all specific or all generic (fallback) loaders,
+    or the undetected loaders. A remembered generic loader is therefore never tried before a specific loader, which
+    has precedence in the registration order, so that the loaded data does not depend on the previous files.
+
+    Formats used by several loaders (e.g. HDF5) can be inspected further with a sniff function, which returns the
+    layout of the file. The first detected loader registered for this layout is then tried before all other loaders,
+    the remaining loaders follow in the order described above. The layouts are cached for the path, modification time
+    and size of the files, so that a file is only sniffed once, e.g. when its frames are counted and it is loaded
+    afterwards.
+
+    Usage:
+        registry = LoaderRegistry()
+        registry.register("load_PIL", is_pil_image)
+        registry.register("load_hdf5", is_hdf5, fallback=True, layouts=("hdf5",))
+        registry.register_sniffer(is_hdf5, get_hdf5_layout)
+        for name in registry.get_candidates(filename):
+            ...
+            registry.remember(filename, name)
+    """
+
+    def __init__(self, max_entries=1000):
+        """
+        :param max_entries: maximum number of remembered directory/extension combinations and of cached file layouts
+        """
+        self.max_entries = max_entries
+        self._loaders = OrderedDict()
+        self._fallback = set()
+        self._layouts = {}
+        self._sniffers = []
+        self._winners = OrderedDict()
+        self._sniffed_layouts = OrderedDict()
+        self._lock = threading.Lock()
+
+    def register(self, name, detect=None, fallback=False, layouts=()):
+        """
+        :param name: name of the loader
+        :param detect: function detect(extension, header) returning True if the loader can read the file, None means
+                       that the loader is only used for probing
+        :param fallback: whether the loader is a generic loader reading many different formats, a remembered generic
+                         loader is not moved before specific loaders
+        :param layouts: file layouts returned by a sniff function (see register_sniffer), which the loader reads
+        """
+        self._loaders[name] = detect
+        if fallback:
+            self._fallback.add(name)
+        self._layouts[name] = tuple(layouts)
+
+    def register_sniffer(self, detect, sniff):
+        """
+        :param detect: function detect(extension, header) returning True for the files the sniff function is used for
+        :param sniff: function sniff(filename) returning the layout of the file or None if it is unknown
+        """
+        self._sniffers.append((detect, sniff))
+
+    def _sniff(self, filename, extension, header):
+        sniffers = [sniff for detect, sniff in self._sniffers if detect(extension, header)]
+        if not sniffers:
+            return None
+        try:
+            stat = os.stat(filename)
+        except OSError:
+            return None
+        key = (os.path.abspath(filename), stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            if key in self._sniffed_layouts:
+                self._sniffed_layouts.move_to_end(key)
+                return self._sniffed_layouts[key]
+
+        layout = None
+        for sniff in sniffers:
+            layout = sniff(filename)
+            if layout is not None:
+                break
+        with self._lock:
+            self._sniffed_layouts[key] = layout
+            while len(self._sniffed_layouts) > self.max_entries:
+                self._sniffed_layouts.popitem(last=False)
+        return layout
+
+    @property
+    def names(self):
+        return list(self._loaders.keys())
+
+    @staticmethod
+    def _get_key(filename):
+        directory, basename = os.path.split(os.path.abspath(filename))
+        return directory, os.path.splitext(basename)[1].lower()
+
+    def get_candidates(self, filename):
+        """
+        :param filename: path of the image file
+        :return: names of all loaders in the order they should be tried
+        """
+        key = self._get_key(filename)
+        header = read_header(filename)
+        detected = [name for name, detect in self._loaders.items() if detect is not None and detect(key[1], header)]
+        candidates = detected + [name for name in self._loaders if name not in detected]
+
+        layout = self._sniff(filename, key[1], header)
+        sniffed = [name for name in detected if layout is not None and layout in self._layouts[name]]
+        if sniffed:
+            candidates.insert(0, candidates.pop(candidates.index(sniffed[0])))
+            return candidates
+
+        with self._lock:
+            winner = self._winners.get(key)
+        if winner in candidates:
+            levels = [(name in self._fallback) if name in detected else None for name in candidates]
+            ind = first = candidates.index(winner)
+            while first > 0 and levels[first - 1] == levels[ind]:
+                first -= 1
+            candidates.insert(first, candidates.pop(ind))
+        return candidates
+
+    def remember(self, filename, name):
+        """
+        Remembers the loader, which was able to read the file, for the files with the same directory and extension.
+        """
+        key = self._get_key(filename)
+        with self._lock:
+            self._winners.pop(key, None)
+            self._winners[key] = name
+            while len(self._winners) > self.max_entries:
+                self._winners.popitem(last=False)
+
+    def get_remembered(self, filename):
+        with self._lock:
+            return self._winners.get(self._get_key(filename))
+
+    def clear(self):
+        with self._lock:
+            self._winners = OrderedDict()
+            self._sniffed_layouts = OrderedDict()
@@ -18,9 +18,45 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import logging
+import os
+import posixpath
+import threading
+import zlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
 import h5py
 import hdf5plugin
 
+# bitshuffle is optional, it decodes bitshuffle-LZ4 chunks in parallel, without it they are decoded by the HDF5
+# library through hdf5plugin
+try:
+    import bitshuffle
+except ImportError:
+    bitshuffle_installed = False
+else:
+    bitshuffle_installed = True
+
+logger = logging.getLogger(__name__)
+
+# the chunks are only decoded in python, if they can be decoded in parallel, a single thread is slower than the
+# HDF5 library
+PARALLEL_DECODE_MIN_CPUS = 2
+
+FILTER_DEFLATE = 1
+FILTER_SHUFFLE = 2
+FILTER_BITSHUFFLE = 32008
+BITSHUFFLE_LZ4 = 2
+
+_decode_executor = None
+
+# image sources of recently opened files, see get_image_sources
+SOURCES_CACHE_SIZE = 256
+_sources_cache = OrderedDict()
+_sources_lock = threading.Lock()
+
 
 class Hdf5Image:
     def __init__(self, filename):
@@ -29,8 +65,12 @@ class Hdf5Image:
         :param filename: path to the hdf5 file to be loaded
         """
 
+        self.filename = filename
         self.f = h5py.File(filename, 'r')
-        self.image_sources = find_image_sources(self.f)
+        # the search for image sources stops at the first source, see find_all_image_sources
+        self.image_sources = get_image_sources(filename, complete=False, h5_file=self.f)
+        if len(self.image_sources) == 0:
+            raise IOError("no image source found in " + filename)
 
         self.dataset = self.f[self.image_sources[0]]
         self.series_max = self.dataset.shape[0]
@@ -38,22 +78,271 @@ class Hdf5Image:
     def get_image(self, ind):
         return self.dataset[ind]
 
+    def get_images(self, start, stop, out=None):
+        """
+        Reads the images start to stop of the selected source at once. For chunked datasets with complete frames in
+        each chunk and filters which can be decoded outside of the HDF5 library (deflate, shuffle and bitshuffle with
+        LZ4 if the bitshuffle package is installed), the raw chunks are read directly and decoded in parallel.
+        :param start: position of the first image, starting at 0
+        :param stop: position after the last image
+        :param out: optional preallocated array with shape (stop - start, height, width) and the dtype of the dataset
+        :return: 3d array with the images
+        """
+        return read_frames(self.dataset, start, stop, out)
+
     def select_source(self, source):
         self.dataset = self.f[source]
         self.series_max = self.dataset.shape[0]
 
+    def find_all_image_sources(self):
+        """
+        Searches the whole file for image sources, which takes long for files with many groups.
+        :return: list of all image sources, starting with the default source
+        """
+        self.image_sources = get_image_sources(self.filename, complete=True, h5_file=self.f)
+        return self.image_sources
+
+
+def get_frame_count(filename):
+    """
+    Reads the number of images of the first image source from the dataset shape, without reading the image data
+    :param filename: path to the hdf5 file
+    :return: number of images
+    """
+    with h5py.File(filename, 'r') as f:
+        image_sources = get_image_sources(filename, complete=False, h5_file=f)
+        if len(image_sources) == 0:
+            raise IOError("no image source found in " + filename)
+        return f[image_sources[0]].shape[0]
+
+
+def get_image_sources(filename, complete=True, h5_file=None):
+    """
+    Returns the image sources of an hdf5 file, see find_image_sources. The sources are cached for the path and
+    modification time of the file, so that the file is only searched once.
+    :param filename: path to the hdf5 file
+    :param complete: whether all image sources are needed, otherwise the search stops at the default source
+    :param h5_file: already opened h5py.File of the filename
+    :return: list of image sources
+    """
+    stat = os.stat(filename)
+    key = (os.path.abspath(filename), stat.st_mtime_ns)
+    with _sources_lock:
+        cached = _sources_cache.get(key)
+        if cached is not None:
+            _sources_cache.move_to_end(key)
+    if cached is not None and (cached[1] or not complete):
+        return list(cached[0])
+
+    if h5_file is None:
+        with h5py.File(filename, 'r') as f:
+            image_sources = find_image_sources(f, first_only=not complete)
+    else:
+        image_sources = find_image_sources(h5_file, first_only=not complete)
 
-def find_image_sources(hd5_file):
-    image_paths = []
+    with _sources_lock:
+        _sources_cache[key] = (image_sources, complete or len(image_sources) == 0)
+        while len(_sources_cache) > SOURCES_CACHE_SIZE:
+            _sources_cache.popitem(last=False)
+    return list(image_sources)
 
-    def traverse_groups(group, parent_path=''):
-        if isinstance(group, h5py.Dataset):
-            if len(group.shape) >= 3:
-                image_paths.append(parent_path)
-        else:  # node is a group
-            for key in group.keys():
-                traverse_groups(group[key], parent_path + '/' + key)
 
-    traverse_groups(hd5_file)
+def find_image_sources(hd5_file, first_only=False):
+    """
+    Searches an hdf5 file for image sources, i.e. datasets with at least 3 dimensions. The first source is the default
+    source, which is the signal of the default NXdata group for NeXus files, or the first image source found otherwise.
+    The signals of NXdata groups are preferred over the remaining datasets in the same group.
+    :param hd5_file: opened h5py.File
+    :param first_only: whether to stop the search at the default source
+    :return: list of paths of the image sources, starting with the default source
+    """
+    default_source = _get_nexus_default_signal(hd5_file)
+    if default_source is None:
+        def find_first(name, obj):
+            if isinstance(obj, h5py.Group):
+                return _get_nxdata_signal(obj)
+            if _is_image_dataset(obj):
+                return '/' + name
 
+        default_source = _visit_objects(hd5_file, find_first)
+
+    if default_source is None:
+        return []
+    image_paths = [default_source]
+    if first_only:
+        return image_paths
+
+    def find_all(name, obj):
+        if _is_image_dataset(obj) and '/' + name != default_source:
+            image_paths.append('/' + name)
+
+    _visit_objects(hd5_file, find_all)
     return image_paths
+
+
+def _visit_objects(group, func, prefix='', visited=None):
+    """
+    Calls func(name, obj) for all objects in the group, until func returns something else than None. In contrast to
+    visititems, soft and external links are followed, e.g. to the scan files of Bliss master files or the data files of
+    Eiger master files. Each group is visited only once.
+    :return: the first value returned by func, which is not None
+    """
+    if visited is None:
+        visited = {group.id}
+
+    for name in group:
+        try:
+            obj = group[name]
+        except (KeyError, OSError):  # dangling links
+            continue
+        result = func(prefix + name, obj)
+        if result is None and isinstance(obj, h5py.Group) and obj.id not in visited:
+            visited.add(obj.id)
+            result = _visit_objects(obj, func, prefix + name + '/', visited)
+        if result is not None:
+            return result
+    return None
+
+
+def _is_image_dataset(obj):
+    return isinstance(obj, h5py.Dataset) and len(obj.shape) >= 3
+
+
+def _get_str_attr(obj, name):
+    value = obj.attrs.get(name)
+    if isinstance(value, np.ndarray) and value.size == 1:
+        value = value.item()
+    if isinstance(value, bytes):
+        value = value.decode(errors='replace')
+    return value if isinstance(value, str) else None
+
+
+def _get_nxdata_signal(group):
+    """
+    :return: path of the signal dataset of an NXdata group, if it is an image dataset, otherwise None
+    """
+    if _get_str_attr(group, 'NX_class') != 'NXdata':
+        return None
+    signal = _get_str_attr(group, 'signal')
+    if signal is None or not _is_image_dataset(group.get(signal)):
+        return None
+    return posixpath.join(group.name, signal)
+
+
+def _get_nexus_default_signal(hd5_file):
+    """
+    Follows the NeXus "default" attributes from the root over the default NXentry to the default NXdata group.
+    :return: path of the signal dataset of the default NXdata group or None
+    """
+    group = hd5_file
+    for _ in range(2):
+        default = _get_str_attr(group, 'default')
+        if default is None or not isinstance(group.get(default), h5py.Group):
+            return None
+        group = group[default]
+    return _get_nxdata_signal(group)
+
+
+def read_frames(dataset, start, stop, out=None):
+    """
+    Reads the frames start to stop of a 3d dataset into a preallocated array, see Hdf5Image.get_images.
+    """
+    start, stop = max(int(start), 0), min(int(stop), dataset.shape[0])
+    if out is None:
+        out = np.empty((max(stop - start, 0),) + dataset.shape[1:], dtype=dataset.dtype)
+    if stop <= start:
+        return out
+
+    pipeline = None
+    if (os.cpu_count() or 1) >= PARALLEL_DECODE_MIN_CPUS:
+        pipeline = _get_decodable_pipeline(dataset)
+    if pipeline is not None:
+        try:
+            _read_chunks_parallel(dataset, pipeline, start, stop, out)
+            return out
+        except Exception as e:  # e.g. chunks which were never written, the HDF5 library uses the fill value for them
+            logger.debug("Direct chunk reading of {} failed: {}".format(dataset.name, e))
+    dataset.read_direct(out, np.s_[start:stop])
+    return out
+
+
+def _get_decodable_pipeline(dataset):
+    """
+    :return: list of the filter ids of the dataset, if the chunks contain complete frames and all filters can be
+             decoded by _decode_chunk, otherwise None
+    """
+    if dataset.chunks is None or tuple(dataset.chunks[1:]) != tuple(dataset.shape[1:]):
+        return None
+    if dataset.dtype.kind not in 'iuf':
+        return None
+    plist = dataset.id.get_create_plist()
+    pipeline = []
+    for ind in range(plist.get_nfilters()):
+        filter_id, _, values, _ = plist.get_filter(ind)
+        if filter_id in (FILTER_DEFLATE, FILTER_SHUFFLE):
+            pipeline.append(filter_id)
+        elif filter_id == FILTER_BITSHUFFLE and bitshuffle_installed and len(values) > 4 and \
+                values[4] == BITSHUFFLE_LZ4:
+            pipeline.append(filter_id)
+        else:
+            return None
+    if len(pipeline) == 0:
+        return None  # nothing to decode, reading through the HDF5 library is as fast
+    return pipeline
+
+
+def _read_chunks_parallel(dataset, pipeline, start, stop, out):
+    chunk_rows = dataset.chunks[0]
+    dtype = dataset.dtype
+    chunk_shape = tuple(dataset.chunks)
+
+    def decode(chunk_start, filter_mask, raw):
+        chunk = _decode_chunk(raw, filter_mask, pipeline, dtype, chunk_shape)
+        first = max(start, chunk_start)
+        last = min(stop, chunk_start + chunk_rows)
+        out[first - start:last - start] = chunk[first - chunk_start:last - chunk_start]
+
+    futures = []
+    executor = _get_decode_executor()
+    try:
+        for chunk_start in range(start // chunk_rows * chunk_rows, stop, chunk_rows):
+            # reading is serialized by h5py anyway, only the decompression is done in parallel
+            filter_mask, raw = dataset.id.read_direct_chunk((chunk_start,) + (0,) * (len(chunk_shape) - 1))
+            futures.append(executor.submit(decode, chunk_start, filter_mask, raw))
+    finally:
+        # all decoding has to be finished before out is used, also when reading failed
+        exceptions = [future.exception() for future in futures]
+    for exception in exceptions:
+        if exception is not None:
+            raise exception
+
+
+def _decode_chunk(raw, filter_mask, pipeline, dtype, chunk_shape):
+    """
+    Decodes a raw chunk by applying the filters of the pipeline in reverse order, filters whose bit is set in the
+    filter mask were not applied when writing the chunk.
+    """
+    num_items = int(np.prod(chunk_shape))
+    data = raw
+    for ind in reversed(range(len(pipeline))):
+        if filter_mask & (1 << ind):
+            continue
+        if pipeline[ind] == FILTER_DEFLATE:
+            data = zlib.decompress(data)
+        elif pipeline[ind] == FILTER_SHUFFLE:
+            unshuffled = np.empty(num_items, dtype=dtype)
+            unshuffled.view(np.uint8).reshape(num_items, dtype.itemsize)[:] = \
+                np.frombuffer(data, np.uint8, count=num_items * dtype.itemsize).reshape(dtype.itemsize, num_items).T
+            data = unshuffled
+        elif pipeline[ind] == FILTER_BITSHUFFLE:
+            block_size = int.from_bytes(bytes(data[8:12]), 'big') // dtype.itemsize
+            data = bitshuffle.decompress_lz4(np.frombuffer(data, np.uint8, offset=12), (num_items,), dtype,
+                                             block_size).tobytes()
+    return np.frombuffer(data, dtype=dtype, count=num_items).reshape(chunk_shape)
+
+
+def _get_decode_executor():
+    global _decode_executor
+    if _decode_executor is None:
+        _decode_executor = ThreadPoolExecutor(max_workers=os.cpu_count() or 1)
+    return _decode_executor
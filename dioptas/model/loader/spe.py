@@ -27,6 +27,12 @@ import numpy as np
 from numpy.polynomial.polynomial import polyval
 from dateutil import parser
 
+DATA_OFFSET = 4100
+NUM_FRAMES_OFFSET = 1446
+
+# data types as defined on page 10 in the SPE 3.0 File format manual
+DATA_TYPES = {0: np.float32, 1: np.int32, 2: np.int16, 3: np.uint16, 8: np.uint32}
+
 
 class SpeFile(object):
     """Implements the SPE_File class for loading princeton instrument binary SPE files into Python
@@ -40,8 +46,9 @@ class SpeFile(object):
     num_frames - number of frames collected
     exposure_time
 
-    img - 2d data if num_frames==1
-          list of 2d data if num_frames>1
+    img - 2d data of the first frame
+    frames - 3d memory mapped array with all frames (num_frames, ydim, xdim), the frames are only read from the
+             file when they are accessed
 
     x_calibration - wavelength information of x-axis
 
@@ -311,36 +318,26 @@ class SpeFile(object):
         return np.fromfile(self._fid, ntype, size)
 
     def _read_img(self):
-        self.img = self._read_frame(4100)
-        if self.num_frames > 1:
-            img_temp = []
-            img_temp.append(self.img)
-            for n in range(self.num_frames - 1):
-                img_temp.append(self._read_frame())
-            self.img = img_temp
-        if type(self.img) == list:
-            self.img = self.img[0]
-
-    def _read_frame(self, pos=None):
-        """Reads in a frame at a specific binary position. The following parameters have to
-        be predefined before calling this function:
-        datatype - either 0,1,2,3,8 for float32, int32, int16, uint16 or uint32 (datatypes can be found on page 10 in
-        the SPE 3.0 File format manual)
-        _xdim, _ydim - being the dimensions.
+        """Memory maps the frames of the file, the following parameters have to be predefined before calling this
+        function:
+        datatype - either 0,1,2,3,8 for float32, int32, int16, uint16 or uint32
+        _xdim, _ydim - being the dimensions
+        num_frames - number of frames, limited to the frames which are completely present in the file
         """
-        if pos == None:
-            pos = self._fid.tell()
-        if self._data_type == 0:
-            img = self._read_at(pos, self._xdim * self._ydim, np.float32)
-        elif self._data_type == 1:
-            img = self._read_at(pos, self._xdim * self._ydim, np.int32)
-        elif self._data_type == 2:
-            img = self._read_at(pos, self._xdim * self._ydim, np.int16)
-        elif self._data_type == 3:
-            img = self._read_at(pos, self._xdim * self._ydim, np.uint16)
-        elif self._data_type == 8:
-            img = self._read_at(pos, self._xdim * self._ydim, np.uint32)
-        return img.reshape((self._ydim, self._xdim))
+        dtype = np.dtype(DATA_TYPES[int(self._data_type)]).newbyteorder('<')
+        frame_size = int(self._xdim * self._ydim) * dtype.itemsize
+        xml_offset = int(self.xml_offset[0])
+        data_end = xml_offset if xml_offset > 0 else self.get_file_size()
+        self.num_frames = int(min(self.num_frames, (data_end - DATA_OFFSET) // frame_size))
+        self.frames = np.memmap(self.filename, dtype=dtype, mode='r', offset=DATA_OFFSET,
+                                shape=(self.num_frames, int(self._ydim), int(self._xdim)))
+        self.img = self.frames[0]
+
+    def get_frame(self, ind):
+        """Returns the frame at the given index as view of the memory mapped file
+        :param ind: index of the frame, starting at 0
+        """
+        return self.frames[ind]
 
     def get_index_from(self, wavelength):
         """
@@ -391,3 +388,24 @@ class SpeFile(object):
         self._fid.seek(0, 2)
         self.file_size = self._fid.tell()
         return self.file_size
+
+
+def get_frame_count(filename):
+    """
+    Reads the number of frames from the header of a SPE file, without reading the image data
+    :param filename: path to the SPE file
+    :return: number of frames, which are completely present in the file
+    """
+    with open(filename, 'rb') as f:
+        header = f.read(DATA_OFFSET)
+        f.seek(0, 2)
+        file_size = f.tell()
+    xdim = int(np.frombuffer(header, np.int16, 1, 42)[0])
+    ydim = int(np.frombuffer(header, np.int16, 1, 656)[0])
+    data_type = int(np.frombuffer(header, np.uint16, 1, 108)[0])
+    xml_offset = int(np.frombuffer(header, np.int64, 1, 678)[0])
+    num_frames = int(np.frombuffer(header, np.int32, 1, NUM_FRAMES_OFFSET)[0])
+
+    data_end = xml_offset if xml_offset > 0 else file_size
+    frame_size = xdim * ydim * np.dtype(DATA_TYPES[data_type]).itemsize
+    return min(num_frames, (data_end - DATA_OFFSET) // frame_size)
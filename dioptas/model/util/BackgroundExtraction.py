@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+# Dioptas - GUI program for fast processing of 2D X-ray diffraction data
+# Principal author: Clemens Prescher (clemens.prescher@gmail.com)
+# Copyright (C) 2014-2019 GSECARS, University of Chicago, USA
+# Copyright (C) 2015-2018 Institute for Geology and Mineralogy, University of Cologne, Germany
+# Copyright (C) 2019-2020 DESY, Hamburg, Germany
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import numpy as np
+
+
+def extract_background_stack(x, y, smooth_width=0.1, iterations=50, cheb_order=50):
+    """
+    Extracts the backgrounds of a stack of patterns sharing the same x values. The result is the same as calling
+    xypattern's SmoothBrucknerBackground(smooth_width, iterations, cheb_order).extract_background for each pattern,
+    but the Bruckner smoothing and the Chebyshev fit are done for all patterns at once.
+    :param x: x values of the patterns
+    :param y: 2d array with one pattern per row
+    :param smooth_width: width of the window in x-units used for the Bruckner smoothing
+    :param iterations: number of iterations of the Bruckner smoothing
+    :param cheb_order: order of the fitted Chebyshev polynomial
+    :return: 2d array with the background of each pattern
+    """
+    x = np.asarray(x, dtype=np.float64)
+    smooth_points = int((float(smooth_width) / (x[1] - x[0])))
+    y_smooth = smooth_bruckner_stack(y, abs(smooth_points), int(iterations))
+    return chebyshev_fit_stack(x, y_smooth, int(cheb_order))
+
+
+def smooth_bruckner_stack(y, smooth_points, iterations):
+    """
+    Bruckner smoothing of a stack of patterns. The smoothing of a pattern is sequential along x, each point depends on
+    the already smoothed points before it, therefore the loop runs over the x-positions and each step is done for all
+    patterns at once.
+    :param y: 2d array with one pattern per row
+    :param smooth_points: half width of the smoothing window in points
+    :param iterations: number of iterations
+    :return: 2d array with the smoothed patterns
+    """
+    y = np.asarray(y, dtype=np.float64)
+    if y.ndim == 1:
+        return smooth_bruckner_stack(y[np.newaxis], smooth_points, iterations)[0]
+    num_patterns, n = y.shape
+    N = smooth_points
+    window_size = 2 * N + 1
+
+    # transposed and extended by N points on each side, so that a step along x accesses contiguous memory
+    y_extended = np.empty((n + 2 * N, num_patterns))
+    y_extended[:N] = y[:, 0]
+    y_extended[N:N + n] = y.T
+    y_extended[N + n:] = y[:, -1]
+
+    window_avg = np.empty(num_patterns)
+    diff = np.empty(num_patterns)
+    for _ in range(iterations):
+        np.mean(y_extended[:window_size], axis=0, out=window_avg)
+        for i in range(N, n - N - 2):
+            y_i = y_extended[i]
+            # points above the window average are set to it, which also changes the average
+            np.subtract(window_avg, y_i, out=diff)
+            np.minimum(diff, 0, out=diff)
+            y_i += diff
+            # shifting average by one index
+            diff += y_extended[i + N + 1]
+            diff -= y_extended[i - N]
+            diff /= window_size
+            window_avg += diff
+    return np.ascontiguousarray(y_extended[N:N + n].T)
+
+
+def chebyshev_fit_stack(x, y, order):
+    """
+    Fits a Chebyshev polynomial to each pattern of a stack and returns the evaluated polynomials. All patterns are fitted
+    with a single least squares solution, since they share the same x values.
+    :param x: x values of the patterns
+    :param y: 2d array with one pattern per row
+    :param order: order of the polynomial
+    :return: 2d array with the evaluated polynomials
+    """
+    x = np.asarray(x, dtype=np.float64)
+    x_cheb = 2. * (x - x[0]) / (x[-1] - x[0]) - 1.
+    cheb_parameters = np.polynomial.chebyshev.chebfit(x_cheb, np.asarray(y, dtype=np.float64).T, order)
+    return np.polynomial.chebyshev.chebval(x_cheb, cheb_parameters)
@@ -0,0 +1,345 @@
+# -*- coding: utf-8 -*-
+# Dioptas - GUI program for fast processing of 2D X-ray diffraction data
+# Principal author: Clemens Prescher (clemens.prescher@gmail.com)
+# Copyright (C) 2014-2019 GSECARS, University of Chicago, USA
+# Copyright (C) 2015-2018 Institute for Geology and Mineralogy, University of Cologne, Germany
+# Copyright (C) 2019-2020 DESY, Hamburg, Germany
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import time
+
+import h5py
+import numpy as np
+
+# number of patterns which are copied at once, when the patterns are sorted into the order of the manifest
+SORT_BLOCK_SIZE = 4096
+
+
+class BatchResultWriter(object):
+    """
+    Writes integrated batch patterns into a processed NeXus/HDF5 file, which can be read by BatchModel.load_proc_data.
+
+    The file structure and the metadata of the process are created when the writer is opened, the patterns can then be
+    appended in blocks while they are integrated. The data is stored in a chunked and compressed dataset and the file
+    is flushed periodically, so that an interrupted integration keeps all patterns written up to the last flush.
+
+    If a manifest is given, it is stored in the process group together with a flag for each frame of the manifest,
+    which is set when the pattern of the frame is appended. An interrupted integration can then be resumed by opening
+    the file with resume() and appending only the missing frames. The patterns can be appended in any order, when the
+    writer is closed they are sorted into the order of the manifest.
+
+    Usage:
+        with BatchResultWriter(filename) as writer:
+            writer.open(files, file_map, cal_file)
+            writer.append(binning, intensities, pos_map)
+    """
+
+    def __init__(self, filename, chunk_rows=64, compression="gzip", compression_opts=4, flush_interval=10,
+                 manifest=None):
+        """
+        :param filename: path of the processed file, an existing file will be overwritten
+        :param chunk_rows: number of patterns per chunk of the data dataset
+        :param compression: h5py compression filter for the data dataset, None disables compression
+        :param compression_opts: options of the compression filter
+        :param flush_interval: time in seconds after which appended data is flushed to the disk
+        :param manifest: dictionary with "digest" (string describing the integration inputs), "pos_map" (frames to be
+                         integrated as (file index, position in file) pairs) and "file_stats" ((mtime, size) of each
+                         file) or None
+        """
+        self.filename = filename
+        self.chunk_rows = chunk_rows
+        self.compression = compression
+        self.compression_opts = compression_opts
+        self.flush_interval = flush_interval
+        self.manifest = manifest
+
+        self.n_img = 0
+        self.num_points = 0
+        self._file = None
+        self._nxdata = None
+        self._nxprocess = None
+        self._last_flush = 0
+        self._manifest_indices = {}
+
+    def open(self, files=None, file_map=None, cal_file=None, mask_file=None, mask_shape=None):
+        """
+        Creates the file with the processed entry and writes the metadata of the process.
+        :param files: list of raw image files
+        :param file_map: array with the index of the first image of each file
+        :param cal_file: calibration file used for the integration
+        :param mask_file: mask file used for the integration
+        :param mask_shape: shape of the mask
+        """
+        if os.path.dirname(self.filename) != "":
+            os.makedirs(os.path.dirname(self.filename), exist_ok=True)
+        self._file = h5py.File(self.filename, mode="w")
+        self._file.attrs["default"] = "processed"
+
+        nxentry = self._file.create_group("processed")
+        nxentry.attrs["NX_class"] = "NXentry"
+        nxentry.attrs["default"] = "result"
+
+        self._nxdata = nxentry.create_group("result")
+        self._nxdata.attrs["NX_class"] = "NXdata"
+        self._nxdata.attrs["signal"] = "data"
+        self._nxdata.attrs["axes"] = [".", "binning"]
+
+        self._nxprocess = nxentry.create_group("process")
+        self._nxprocess.attrs["NX_class"] = "NXprocess"
+
+        if cal_file is not None:
+            self._nxprocess["cal_file"] = str(cal_file)
+
+        if mask_file is not None:
+            self._nxprocess["mask_file"] = str(mask_file)
+            self._nxprocess["mask_shape"] = mask_shape
+
+        self._nxprocess["int_method"] = "csr"
+        self._nxprocess["int_unit"] = "2th_deg"
+
+        self._nxprocess.create_dataset("pos_map", shape=(0, 2), maxshape=(None, 2), dtype=np.int64,
+                                       chunks=(max(self.chunk_rows, 1024), 2))
+        if file_map is not None:
+            self._nxprocess.create_dataset("file_map", data=file_map)
+        if files is not None:
+            self._nxprocess.create_dataset("files", data=np.array(files).astype("S"))
+        self.n_img = 0
+        self.num_points = 0
+        self._write_manifest()
+        self.flush()
+
+    def resume(self, done=None):
+        """
+        Opens an existing file, which was written by this class, for appending further patterns. The manifest of the
+        writer replaces the manifest stored in the file.
+        :param done: boolean array with the frames of the manifest, which are already in the file
+        """
+        self._file = h5py.File(self.filename, mode="a")
+        self._nxdata = self._file["processed/result"]
+        self._nxprocess = self._file["processed/process"]
+        self.n_img = self._nxprocess["pos_map"].shape[0]
+        if "data" in self._nxdata:
+            self.num_points = self._nxdata["data"].shape[1]
+        self._write_manifest(done)
+        self.flush()
+
+    def _write_manifest(self, done=None):
+        if self.manifest is None:
+            return
+        if "manifest" in self._nxprocess:
+            del self._nxprocess["manifest"]
+        pos_map = np.reshape(self.manifest["pos_map"], (-1, 2))
+        if done is None:
+            done = np.zeros(len(pos_map), dtype=bool)
+
+        manifest_group = self._nxprocess.create_group("manifest")
+        manifest_group.attrs["NX_class"] = "NXcollection"
+        manifest_group.attrs["digest"] = self.manifest["digest"]
+        manifest_group.create_dataset("pos_map", data=pos_map)
+        manifest_group.create_dataset("file_stats", data=np.reshape(self.manifest["file_stats"], (-1, 2)))
+        manifest_group.create_dataset("done", data=done)
+        self._manifest_indices = {(f, p): ind for ind, (f, p) in enumerate(pos_map.tolist())}
+
+    @property
+    def is_open(self):
+        return self._file is not None
+
+    def append(self, binning, intensities, pos_map):
+        """
+        Appends a block of integrated patterns. The data and binning datasets are created with the first block.
+        :param binning: x-values of the patterns
+        :param intensities: 2d array with shape (number of patterns, number of points)
+        :param pos_map: array of (file index, position in file) pairs of the patterns
+        """
+        intensities = np.asarray(intensities)
+        if intensities.ndim == 1:
+            intensities = intensities[np.newaxis]
+        if "data" not in self._nxdata:
+            self._create_data(binning, intensities.dtype)
+
+        data = self._nxdata["data"]
+        if intensities.shape[1] > data.shape[1]:
+            # patterns of a resumed integration can be longer than the trimmed patterns in the file
+            data.resize((data.shape[0], intensities.shape[1]))
+            del self._nxdata["binning"]
+            self._create_binning(binning)
+        elif intensities.shape[1] < data.shape[1]:
+            intensities = np.pad(intensities, ((0, 0), (0, data.shape[1] - intensities.shape[1])))
+
+        nonzero_points = np.flatnonzero(np.any(intensities, axis=0))
+        if len(nonzero_points):
+            self.num_points = max(self.num_points, int(nonzero_points[-1]) + 1)
+
+        start = self.n_img
+        self.n_img += len(intensities)
+        data.resize((self.n_img, data.shape[1]))
+        data[start:self.n_img] = intensities
+
+        pos_map = np.reshape(pos_map, (-1, 2))
+        pos_map_dataset = self._nxprocess["pos_map"]
+        pos_map_dataset.resize((self.n_img, 2))
+        pos_map_dataset[start:self.n_img] = pos_map
+
+        if self._manifest_indices:
+            done_indices = [self._manifest_indices.get((f, p)) for f, p in pos_map.tolist()]
+            done_indices = sorted(ind for ind in done_indices if ind is not None)
+            if done_indices:
+                self._nxprocess["manifest/done"][done_indices] = True
+
+        if time.time() - self._last_flush > self.flush_interval:
+            self.flush()
+
+    def _create_data(self, binning, dtype):
+        num_points = len(binning)
+        self._nxdata.create_dataset("data", shape=(0, num_points), maxshape=(None, None), dtype=dtype,
+                                    chunks=(self.chunk_rows, num_points), compression=self.compression,
+                                    compression_opts=self.compression_opts if self.compression is not None else None,
+                                    shuffle=self.compression is not None)
+        self._create_binning(binning)
+
+    def _create_binning(self, binning):
+        tth = self._nxdata.create_dataset("binning", data=binning, maxshape=(None,))
+        tth.attrs["unit"] = "deg"
+        tth.attrs["long_name"] = "two_theta (degrees)"
+        if "num_points" in self._nxprocess:
+            del self._nxprocess["num_points"]
+        self._nxprocess["num_points"] = len(binning)
+
+    def flush(self):
+        self._file.flush()
+        self._last_flush = time.time()
+
+    def _sort_patterns(self):
+        """
+        Sorts the patterns into the order of the manifest. Only the patterns of frames flagged as done are kept, if a
+        frame was appended several times (e.g. after its file changed) the last pattern is used. Patterns which are
+        already in order are not copied, otherwise they are copied block-wise into a new file, which replaces the
+        current file. HDF5 does not reclaim the space of deleted datasets, therefore sorting within the file would
+        leave the unsorted patterns as unused space.
+        """
+        if self.manifest is None or "data" not in self._nxdata:
+            return
+        manifest_group = self._nxprocess["manifest"]
+        done = manifest_group["done"][()]
+        manifest_pos_map = manifest_group["pos_map"][()][done]
+        rows = {(f, p): row for row, (f, p) in enumerate(self._nxprocess["pos_map"][()].tolist())}
+        sorted_pos_map = [(f, p) for f, p in manifest_pos_map.tolist() if (f, p) in rows]
+        order = np.array([rows[frame] for frame in sorted_pos_map], dtype=np.int64)
+        if np.array_equal(order, np.arange(self.n_img)):
+            return
+
+        sorted_filename = self.filename + ".sorting"
+        try:
+            with h5py.File(sorted_filename, mode="w") as sorted_file:
+                self._write_sorted_file(sorted_file, order, np.reshape(sorted_pos_map, (-1, 2)))
+            self._file.close()
+            os.replace(sorted_filename, self.filename)
+        finally:
+            if os.path.exists(sorted_filename):
+                os.remove(sorted_filename)
+
+        self._file = h5py.File(self.filename, mode="a")
+        self._nxdata = self._file["processed/result"]
+        self._nxprocess = self._file["processed/process"]
+        self.n_img = len(order)
+
+    def _write_sorted_file(self, sorted_file, order, sorted_pos_map):
+        """
+        Copies the file with the rows given by order of the data and the sorted pos_map into sorted_file.
+        """
+        sorted_file.attrs.update(self._file.attrs)
+        nxentry = sorted_file.create_group("processed")
+        nxentry.attrs.update(self._file["processed"].attrs)
+        for name in self._file["processed"]:
+            if name not in ("result", "process"):
+                self._file.copy(self._file["processed"][name], nxentry, name)
+
+        nxdata = nxentry.create_group("result")
+        nxdata.attrs.update(self._nxdata.attrs)
+        for name in self._nxdata:
+            if name != "data":
+                self._file.copy(self._nxdata[name], nxdata, name)
+        nxprocess = nxentry.create_group("process")
+        nxprocess.attrs.update(self._nxprocess.attrs)
+        for name in self._nxprocess:
+            if name != "pos_map":
+                self._file.copy(self._nxprocess[name], nxprocess, name)
+        nxprocess.create_dataset("pos_map", data=sorted_pos_map, maxshape=(None, 2),
+                                 chunks=self._nxprocess["pos_map"].chunks)
+
+        data = self._nxdata["data"]
+        sorted_data = nxdata.create_dataset(
+            "data", shape=(len(order), data.shape[1]), maxshape=(None, None), dtype=data.dtype,
+            chunks=data.chunks, compression=data.compression, compression_opts=data.compression_opts,
+            shuffle=data.shuffle)
+        sorted_data.attrs.update(data.attrs)
+        for start in range(0, len(order), SORT_BLOCK_SIZE):
+            block_rows = order[start:start + SORT_BLOCK_SIZE]
+            sort_indices = np.argsort(block_rows)  # h5py reads rows only in increasing order
+            block = np.empty((len(block_rows), data.shape[1]), dtype=data.dtype)
+            block[sort_indices] = data[block_rows[sort_indices]]
+            sorted_data[start:start + len(block_rows)] = block
+
+    def close(self, trim_trailing_zeros=False, bkg=None):
+        """
+        Finishes and closes the file. The patterns are sorted into the order of the manifest.
+        :param trim_trailing_zeros: whether the points after the last non-zero value of all appended patterns are
+                                    removed, as for the patterns of BatchModel
+        :param bkg: background patterns to be saved with the data
+        """
+        if self._file is None:
+            return
+        self._sort_patterns()
+        if trim_trailing_zeros and "data" in self._nxdata and 0 < self.num_points < self._nxdata["data"].shape[1]:
+            data = self._nxdata["data"]
+            data.resize((data.shape[0], self.num_points))
+            self._nxdata["binning"].resize((self.num_points,))
+            self._nxprocess["num_points"][()] = self.num_points
+        if bkg is not None:
+            self._nxprocess.create_dataset("bkg", data=bkg)
+        self._file.close()
+        self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def read_batch_manifest(filename):
+    """
+    Reads the manifest of a processed file written by BatchResultWriter, the stored patterns are not read.
+    :param filename: path of the processed file
+    :return: dictionary with "digest", "files", "file_stats", "pos_map" and "done" of the manifest, None if the file or
+             the manifest does not exist
+    """
+    if not os.path.isfile(filename):
+        return None
+    try:
+        with h5py.File(filename, "r") as f:
+            if "processed/process/manifest" not in f:
+                return None
+            manifest_group = f["processed/process/manifest"]
+            return {
+                "digest": manifest_group.attrs["digest"],
+                "files": f["processed/process/files"][()].astype("U"),
+                "file_stats": manifest_group["file_stats"][()],
+                "pos_map": manifest_group["pos_map"][()],
+                "done": manifest_group["done"][()],
+            }
+    except (OSError, KeyError):
+        return None
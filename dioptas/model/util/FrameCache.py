@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+# Dioptas - GUI program for fast processing of 2D X-ray diffraction data
+# Principal author: Clemens Prescher (clemens.prescher@gmail.com)
+# Copyright (C) 2014-2019 GSECARS, University of Chicago, USA
+# Copyright (C) 2015-2018 Institute for Geology and Mineralogy, University of Cologne, Germany
+# Copyright (C) 2019-2020 DESY, Hamburg, Germany
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+class FrameCache(object):
+    """
+    Least recently used cache for decoded frames of multi-frame image files, with a limited memory budget.
+
+    Frames are identified by a key (file, source, frame index), where file should also contain the modification
+    time of the file, so that frames of a changed file are not used. The cached frames are made read-only, since they
+    are shared by everyone using the cache.
+    """
+
+    def __init__(self, max_bytes=512 * 2 ** 20):
+        """
+        :param max_bytes: maximum memory of the cached frames
+        """
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._frames = OrderedDict()
+        self._nbytes = 0
+
+    def get(self, key):
+        """
+        :return: the cached frame or None
+        """
+        with self._lock:
+            frame = self._frames.get(key)
+            if frame is None:
+                self.misses += 1
+                return None
+            self._frames.move_to_end(key)
+            self.hits += 1
+            return frame
+
+    def put(self, key, frame):
+        """
+        Adds a frame to the cache, the least recently used frames are removed when the memory budget is exceeded.
+        :return: the frame
+        """
+        frame = np.asarray(frame)
+        if frame.nbytes > self.max_bytes:
+            return frame
+        frame.flags.writeable = False
+        with self._lock:
+            if key in self._frames:
+                self._nbytes -= self._frames.pop(key).nbytes
+            self._frames[key] = frame
+            self._nbytes += frame.nbytes
+            while self._nbytes > self.max_bytes:
+                self._nbytes -= self._frames.popitem(last=False)[1].nbytes
+        return frame
+
+    def get_or_load(self, key, load_fn, *args):
+        """
+        Returns the cached frame or loads it with load_fn(*args) and adds it to the cache.
+        """
+        frame = self.get(key)
+        if frame is None:
+            frame = self.put(key, load_fn(*args))
+        return frame
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._frames
+
+    def __len__(self):
+        return len(self._frames)
+
+    def clear(self):
+        with self._lock:
+            self._frames = OrderedDict()
+            self._nbytes = 0
+
+    @property
+    def nbytes(self):
+        return self._nbytes
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.
+
+    def get_statistics(self):
+        """
+        :return: dictionary with the number of cached frames, the used memory in bytes, the hits, misses and hit rate
+        """
+        return {"frames": len(self), "nbytes": self.nbytes, "max_bytes": self.max_bytes, "hits": self.hits,
+                "misses": self.misses, "hit_rate": self.hit_rate}
+
+
+# cache shared by all image models, so that e.g. the batch and map views reuse the frames decoded for the image view
+frame_cache = FrameCache()
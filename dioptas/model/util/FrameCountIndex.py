@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+# Dioptas - GUI program for fast processing of 2D X-ray diffraction data
+# Principal author: Clemens Prescher (clemens.prescher@gmail.com)
+# Copyright (C) 2014-2019 GSECARS, University of Chicago, USA
+# Copyright (C) 2015-2018 Institute for Geology and Mineralogy, University of Cologne, Germany
+# Copyright (C) 2019-2020 DESY, Hamburg, Germany
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+class FrameCountIndex(object):
+    """
+    Small on-disk index of the number of images in image files. The entries are keyed by the absolute path, the
+    modification time and the size of a file, so that changed files are counted again.
+
+    Usage:
+        index = FrameCountIndex(os.path.join(config_folder, "frame_counts.json"))
+        counts = index.get_frame_counts(files, img_model.get_frame_count)
+    """
+
+    def __init__(self, filename=None, max_entries=100000, max_workers=8):
+        """
+        :param filename: json file, in which the index is stored. If None, the index is only kept in memory.
+        :param max_entries: maximum number of files in the index, the oldest entries are removed first
+        :param max_workers: number of threads used to count the images of files, which are not in the index
+        """
+        self.filename = filename
+        self.max_entries = max_entries
+        self.max_workers = max_workers
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        if self.filename is None or not os.path.isfile(self.filename):
+            return
+        try:
+            with open(self.filename, "r") as f:
+                self._entries = OrderedDict((path, tuple(entry)) for path, entry in json.load(f).items())
+        except (OSError, ValueError, TypeError):
+            logger.info("Frame count index {} could not be read.".format(self.filename))
+            self._entries = OrderedDict()
+
+    def save(self):
+        """
+        Writes the index to its file, the file is replaced atomically.
+        """
+        if self.filename is None:
+            return
+        with self._lock:
+            entries = dict(self._entries)
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.filename)), exist_ok=True)
+            temp_filename = self.filename + ".tmp"
+            with open(temp_filename, "w") as f:
+                json.dump(entries, f)
+            os.replace(temp_filename, self.filename)
+        except OSError:
+            logger.info("Frame count index {} could not be written.".format(self.filename))
+
+    def get(self, path):
+        """
+        :param path: path of an image file
+        :return: the stored number of images or None if the file is not in the index or has changed
+        """
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        with self._lock:
+            entry = self._entries.get(path)
+        if entry is not None and entry[0] == stat.st_mtime and entry[1] == stat.st_size:
+            return entry[2]
+        return None
+
+    def set(self, path, num_frames):
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        with self._lock:
+            self._entries.pop(path, None)
+            self._entries[path] = (stat.st_mtime, stat.st_size, int(num_frames))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get_frame_counts(self, files, count_fn):
+        """
+        Returns the number of images for each file. Files which are not in the index are counted with count_fn in a
+        thread pool and added to the index, the index is saved afterwards.
+        :param files: list of image file paths
+        :param count_fn: function returning the number of images for a file path
+        :return: list with the number of images of each file
+        """
+        counts = [self.get(file) for file in files]
+        missing = [ind for ind, count in enumerate(counts) if count is None]
+        if len(missing) == 0:
+            return counts
+
+        def count(ind):
+            num_frames = count_fn(files[ind])
+            self.set(files[ind], num_frames)
+            return num_frames
+
+        if len(missing) == 1 or self.max_workers <= 1:
+            missing_counts = [count(ind) for ind in missing]
+        else:
+            with ThreadPoolExecutor(max_workers=min(self.max_workers, len(missing))) as executor:
+                missing_counts = list(executor.map(count, missing))
+
+        for ind, num_frames in zip(missing, missing_counts):
+            counts[ind] = num_frames
+        self.save()
+        return counts
+
+    def clear(self):
+        with self._lock:
+            self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
@@ -22,6 +22,7 @@
 import os
 import re
 import time
+from functools import lru_cache, partial
 
 import numpy as np
 from qtpy import QtCore
@@ -211,6 +212,32 @@ class FileNameIterator(QtCore.QObject):
         elif mode == "number":
             return self._iterate_file_number(self.complete_path, -step, pos)
 
+    def get_next_filenames(self, num, step=1, mode="number", pos=None):
+        """
+        Predicts the files following the current file, without changing the current file of the iterator.
+
+        :param num: maximum number of filenames
+        :param step: step between the files, negative values give the previous files
+        :param mode: "number" or "time", see get_next_filename
+        :param pos: position of the number in the filename, see get_next_filename
+        :return: list of the existing filenames, can be shorter than num
+        """
+        complete_path = self.complete_path
+        filenames = []
+        try:
+            filename = complete_path
+            for _ in range(num):
+                if step > 0:
+                    filename = self.get_next_filename(step, filename, mode, pos)
+                else:
+                    filename = self.get_previous_filename(-step, filename, mode, pos)
+                if filename is None:
+                    break
+                filenames.append(filename)
+        finally:
+            self.complete_path = complete_path
+        return filenames
+
     def get_next_folder(self, filename=None, mec_mode=False):
         if filename is not None:
             self.complete_path = filename
@@ -286,6 +313,63 @@ def rotate_matrix_p90(matrix):
     return np.rot90(matrix)
 
 
+def compose_transformations(transformations, inverse=False):
+    """
+    Composes a list of image transformations into a single function. Any sequence of rotations by 90 degree and flips
+    (e.g. rotate_matrix_p90, np.fliplr) is equal to a single rotation followed by an optional flip, which is applied as
+    a strided view without copying the image. The composed function transforms the last two axes, so it can also be
+    used for stacks of images. Other transformations are applied one after another to every image.
+    :param transformations: list of functions transforming a 2d array
+    :param inverse: whether to compose the inverse of the transformations, undoing them
+    :return: function taking a 2d image or a 3d stack of images and returning the transformed data
+    """
+    return _compose_transformations(tuple(transformations), inverse)
+
+
+@lru_cache(maxsize=64)
+def _compose_transformations(transformations, inverse):
+    if inverse:
+        inverse_rotations = {rotate_matrix_p90: rotate_matrix_m90, rotate_matrix_m90: rotate_matrix_p90}
+        transformations = tuple(inverse_rotations.get(transformation, transformation)
+                                for transformation in reversed(transformations))
+
+    if len(transformations) == 0:
+        return partial(_apply_transformations, transformations=transformations)
+
+    test_data = np.arange(6).reshape(2, 3)
+    try:
+        transformed_test_data = test_data
+        for transformation in transformations:
+            transformed_test_data = transformation(transformed_test_data)
+    except Exception:
+        transformed_test_data = None
+
+    for num_rotations in range(4):
+        for flip in (False, True):
+            if np.array_equal(_rotate_and_flip(test_data, num_rotations, flip), transformed_test_data):
+                return partial(_rotate_and_flip, num_rotations=num_rotations, flip=flip)
+    return partial(_apply_transformations, transformations=transformations)
+
+
+def _rotate_and_flip(img_data, num_rotations, flip):
+    if img_data.ndim < 2:  # e.g. an empty list of images
+        return img_data
+    img_data = np.rot90(img_data, num_rotations, axes=(-2, -1))
+    if flip:
+        img_data = np.flip(img_data, axis=-1)
+    return img_data
+
+
+def _apply_transformations(img_data, transformations):
+    if len(transformations) == 0:
+        return img_data
+    if img_data.ndim == 3:
+        return np.array([_apply_transformations(image, transformations) for image in img_data])
+    for transformation in transformations:
+        img_data = transformation(img_data)
+    return img_data
+
+
 def get_base_name(filename):
     str = os.path.basename(filename)
     if "." in str:
@@ -387,3 +471,25 @@ def reverse_interpolate_two_array(
         result_ind = (result_ind[0][common_ind], result_ind[1][common_ind])
 
     return result_ind[0], result_ind[1]
+
+
+def read_series_images(positions, get_image, get_images=None):
+    """
+    Reads several images of a series. Consecutive positions are read as one block with get_images, if the loader
+    supports it, otherwise every image is read with get_image.
+    :param positions: positions of the images in the series, starting at 0
+    :param get_image: function get_image(pos) returning a 2d image
+    :param get_images: optional function get_images(start, stop) returning a 3d array of images
+    :return: list of 2d images
+    """
+    positions = [int(pos) for pos in positions]
+    if get_images is None:
+        return [get_image(pos) for pos in positions]
+
+    images = []
+    run_start = 0
+    for ind in range(1, len(positions) + 1):
+        if ind == len(positions) or positions[ind] != positions[ind - 1] + 1:
+            images.extend(get_images(positions[run_start], positions[ind - 1] + 1))
+            run_start = ind
+    return images
@@ -0,0 +1,231 @@
+# -*- coding: utf-8 -*-
+# Dioptas - GUI program for fast processing of 2D X-ray diffraction data
+# Principal author: Clemens Prescher (clemens.prescher@gmail.com)
+# Copyright (C) 2014-2019 GSECARS, University of Chicago, USA
+# Copyright (C) 2015-2018 Institute for Geology and Mineralogy, University of Cologne, Germany
+# Copyright (C) 2019-2020 DESY, Hamburg, Germany
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from collections import OrderedDict
+
+import numpy as np
+
+
+class ImagePyramid(object):
+    """
+    Multi-resolution min/max/mean pyramid of a 2d image, which is read row block-wise from a source function, e.g. the
+    scaled batch data shown in the heatmap of the batch window.
+
+    The level (r, c) reduces blocks of 2**r rows and 2**c columns of the source image into one pixel. Levels are only
+    computed when they are requested, from the nearest finer level which was already computed (or from the source),
+    and the computed levels are kept in a cache limited to max_bytes. If rows of the source change or rows are appended,
+    update() recomputes only the affected rows of the cached levels.
+    """
+
+    MODES = ("min", "max", "mean")
+
+    def __init__(self, source=None, shape=(0, 0), max_bytes=256 * 2 ** 20, block_rows=1024):
+        """
+        :param source: function source(start, stop) returning the rows start to stop of the image as 2d array
+        :param shape: shape of the complete image
+        :param max_bytes: maximum memory of the cached levels
+        :param block_rows: number of source rows which are read at once
+        """
+        self.max_bytes = max_bytes
+        self.block_rows = block_rows
+        self.set_source(source, shape)
+
+    def set_source(self, source, shape):
+        """
+        Sets a new source image, all computed levels are discarded.
+        """
+        self.source = source
+        self.shape = (int(shape[0]), int(shape[1]))
+        self._levels = OrderedDict()
+
+    @property
+    def num_levels(self):
+        """
+        :return: number of row and column levels, the last level of an axis has a size of one pixel
+        """
+        return tuple(max(int(np.ceil(np.log2(max(size, 1)))), 0) + 1 for size in self.shape)
+
+    def get_level(self, rows_per_pixel, columns_per_pixel):
+        """
+        Returns the coarsest level, which still has at least one pixel per displayed pixel.
+        :param rows_per_pixel: number of image rows per displayed pixel
+        :param columns_per_pixel: number of image columns per displayed pixel
+        :return: level as (row level, column level)
+        """
+        max_levels = self.num_levels
+        return tuple(int(min(max(np.floor(np.log2(max(per_pixel, 1))), 0), max_level - 1))
+                     for per_pixel, max_level in zip((rows_per_pixel, columns_per_pixel), max_levels))
+
+    def level_shape(self, level):
+        return tuple(int(np.ceil(size / 2 ** lvl)) for size, lvl in zip(self.shape, level))
+
+    def get_window(self, level, row_range=(0, None), column_range=(0, None), mode="max"):
+        """
+        Returns the part of a level covering a window of the image.
+        :param level: (row level, column level)
+        :param row_range: (start, stop) rows of the window in image coordinates
+        :param column_range: (start, stop) columns of the window in image coordinates
+        :param mode: "min", "max" or "mean" of the reduced blocks
+        :return: 2d array with the level data and the window (row start, row stop, column start, column stop) in image
+                 coordinates covered by it, which is the requested window extended to the block borders of the level
+        """
+        if mode not in self.MODES:
+            raise ValueError("mode has to be one of {}".format(self.MODES))
+        row_factor, column_factor = 2 ** level[0], 2 ** level[1]
+        row_start, row_stop = self._to_level_range(row_range, self.shape[0], row_factor)
+        column_start, column_stop = self._to_level_range(column_range, self.shape[1], column_factor)
+        window = (row_start * row_factor, min(row_stop * row_factor, self.shape[0]),
+                  column_start * column_factor, min(column_stop * column_factor, self.shape[1]))
+
+        if tuple(level) == (0, 0):
+            data = self.source(row_start, row_stop)[:, column_start:column_stop]
+        else:
+            data = self._get_level(tuple(level))[mode][row_start:row_stop, column_start:column_stop]
+        return data, window
+
+    @staticmethod
+    def _to_level_range(image_range, size, factor):
+        start, stop = image_range
+        if stop is None:
+            stop = size
+        start = min(max(int(start), 0), size)
+        stop = min(max(int(np.ceil(stop)), start), size)
+        return start // factor, int(np.ceil(stop / factor))
+
+    def update(self, start, stop=None, shape=None):
+        """
+        Recomputes the cached levels for changed or appended rows of the source image.
+        :param start: first changed row
+        :param stop: end of the changed rows, defaults to the number of rows
+        :param shape: new shape of the image if rows were appended
+        """
+        if shape is not None:
+            shape = (int(shape[0]), int(shape[1]))
+            if shape[1] != self.shape[1] or shape[0] < self.shape[0]:
+                self.set_source(self.source, shape)
+                return
+            self.shape = shape
+        if stop is None:
+            stop = self.shape[0]
+        if len(self._levels) == 0 or start >= stop:
+            return
+
+        max_factor = max(2 ** level[0] for level in self._levels)
+        raw_start = start // max_factor * max_factor
+        raw_stop = min(int(np.ceil(stop / max_factor)) * max_factor, self.shape[0])
+        raw = self._read_source(raw_start, raw_stop)
+
+        for level, arrays in self._levels.items():
+            row_factor, column_factor = 2 ** level[0], 2 ** level[1]
+            level_start = start // row_factor
+            level_stop = int(np.ceil(stop / row_factor))
+            num_rows = self.level_shape(level)[0]
+            if arrays["min"].shape[0] < num_rows:
+                for mode in self.MODES:
+                    grown = np.empty((num_rows, arrays[mode].shape[1]), dtype=arrays[mode].dtype)
+                    grown[:arrays[mode].shape[0]] = arrays[mode]
+                    arrays[mode] = grown
+            offset = level_start * row_factor - raw_start
+            block = raw[offset:offset + (level_stop - level_start) * row_factor]
+            reduced = _reduce_block(block, block, block, np.ones(len(block)), np.ones(block.shape[1]),
+                                    row_factor, column_factor)
+            for mode, values in zip(self.MODES, reduced):
+                arrays[mode][level_start:level_stop] = values
+
+    def clear(self):
+        self._levels = OrderedDict()
+
+    @property
+    def nbytes(self):
+        return sum(arrays[mode].nbytes for arrays in self._levels.values() for mode in self.MODES)
+
+    def _get_level(self, level):
+        arrays = self._levels.get(level)
+        if arrays is None:
+            arrays = self._compute_level(level)
+            self._levels[level] = arrays
+            while self.nbytes > self.max_bytes and len(self._levels) > 1:
+                self._levels.popitem(last=False)
+        else:
+            self._levels.move_to_end(level)
+        return arrays
+
+    def _compute_level(self, level):
+        row_factor, column_factor = 2 ** level[0], 2 ** level[1]
+
+        parents = [parent for parent in self._levels if parent[0] <= level[0] and parent[1] <= level[1]]
+        if parents:
+            parent = min(parents, key=lambda lvl: np.prod(self.level_shape(lvl)))
+            parent_arrays = self._levels[parent]
+            parent_row_factor, parent_column_factor = 2 ** parent[0], 2 ** parent[1]
+            reduced = _reduce_block(parent_arrays["min"], parent_arrays["max"], parent_arrays["mean"],
+                                    _block_sizes(self.shape[0], parent_row_factor),
+                                    _block_sizes(self.shape[1], parent_column_factor),
+                                    row_factor // parent_row_factor, column_factor // parent_column_factor)
+            return dict(zip(self.MODES, reduced))
+
+        level_shape = self.level_shape(level)
+        arrays = {mode: np.empty(level_shape, dtype=np.float32) for mode in self.MODES}
+        block_rows = max(self.block_rows // row_factor, 1) * row_factor
+        for start in range(0, self.shape[0], block_rows):
+            block = self._read_source(start, min(start + block_rows, self.shape[0]))
+            reduced = _reduce_block(block, block, block, np.ones(len(block)), np.ones(block.shape[1]),
+                                    row_factor, column_factor)
+            level_start = start // row_factor
+            for mode, values in zip(self.MODES, reduced):
+                arrays[mode][level_start:level_start + len(values)] = values
+        return arrays
+
+    def _read_source(self, start, stop):
+        return np.asarray(self.source(start, stop), dtype=np.float32)
+
+
+def _block_sizes(size, factor):
+    """
+    Number of pixels reduced into each pixel along an axis of a level with the given reduction factor.
+    """
+    sizes = np.full(int(np.ceil(size / factor)), factor, dtype=np.float64)
+    if len(sizes) and size % factor:
+        sizes[-1] = size % factor
+    return sizes
+
+
+def _reduce_block(mins, maxs, means, row_weights, column_weights, row_factor, column_factor):
+    """
+    Reduces blocks of row_factor x column_factor pixels into min, max and mean values. The means are weighted with the
+    number of pixels each input pixel represents.
+    """
+    row_ind = np.arange(0, mins.shape[0], row_factor)
+    column_ind = np.arange(0, mins.shape[1], column_factor)
+
+    weighted = means * row_weights[:, np.newaxis] * column_weights[np.newaxis, :]
+    if row_factor > 1:
+        mins = np.minimum.reduceat(mins, row_ind, axis=0)
+        maxs = np.maximum.reduceat(maxs, row_ind, axis=0)
+        weighted = np.add.reduceat(weighted, row_ind, axis=0)
+        row_weights = np.add.reduceat(row_weights, row_ind)
+    if column_factor > 1:
+        mins = np.minimum.reduceat(mins, column_ind, axis=1)
+        maxs = np.maximum.reduceat(maxs, column_ind, axis=1)
+        weighted = np.add.reduceat(weighted, column_ind, axis=1)
+        column_weights = np.add.reduceat(column_weights, column_ind)
+    means = weighted / (row_weights[:, np.newaxis] * column_weights[np.newaxis, :])
+    return (mins.astype(np.float32, copy=False), maxs.astype(np.float32, copy=False),
+            means.astype(np.float32, copy=False))
@@ -0,0 +1,272 @@
+# -*- coding: utf-8 -*-
+# Dioptas - GUI program for fast processing of 2D X-ray diffraction data
+# Principal author: Clemens Prescher (clemens.prescher@gmail.com)
+# Copyright (C) 2014-2019 GSECARS, University of Chicago, USA
+# Copyright (C) 2015-2018 Institute for Geology and Mineralogy, University of Cologne, Germany
+# Copyright (C) 2019-2020 DESY, Hamburg, Germany
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import tempfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+STACKING_MODES = ('sum', 'mean', 'median', 'sigma_clip', 'mad_clip')
+
+# maximum number of pixels of a row tile of the whole stack, which is reduced at once, limits the memory of the
+# temporary arrays
+TILE_SIZE = 2 ** 22
+
+# maximum number of bytes of images kept in memory, larger stacks are written to a temporary file
+SPOOL_SIZE = 2 ** 29
+
+# scales the median absolute deviation to the standard deviation of normally distributed data
+MAD_TO_STD = 1.4826
+
+
+class StackReducer(object):
+    """
+    Combines a stream of images of the same shape into a single image.
+
+    Modes:
+        - 'sum': sum of all images, accumulated as int64 for integer images and as float64 otherwise
+        - 'mean': mean of all images
+        - 'median': median of all images
+        - 'sigma_clip': the pixels deviating more than sigma times the standard deviation from the center of the
+                        pixel stack are rejected iteratively, the result is the mean of all remaining pixels
+        - 'mad_clip': same as 'sigma_clip', but the pixels are rejected once based on the median and the median
+                      absolute deviation, which is more robust for small stacks. For count images the standard
+                      deviation is at least the Poisson noise of the median, see poisson_noise.
+
+    The outlier rejection modes remove zingers and cosmic rays from repeated exposures. 'sum' and 'mean' accumulate
+    the images directly. The other modes need all images of a pixel, therefore the images are stored (in a temporary
+    file for large stacks) and the whole stack is reduced in row tiles by a thread pool, so that the memory is limited
+    by the tile size and not by the number of images.
+
+    Usage:
+        reducer = StackReducer('mean')
+        for img_data in images:
+            reducer.add(img_data)
+        result = reducer.get_result()
+    """
+
+    def __init__(self, mode='sum', sigma=3.0, max_iterations=5, num_workers=4, poisson_noise=None):
+        """
+        :param mode: one of STACKING_MODES
+        :param sigma: rejection threshold in standard deviations for the outlier rejection modes
+        :param max_iterations: maximum number of rejection iterations for the sigma_clip mode
+        :param num_workers: number of threads reducing the row tiles of the stack
+        :param poisson_noise: whether the images are counts, whose standard deviation is at least the Poisson noise in
+                              the mad_clip mode. None uses the Poisson noise only for integer images, float images
+                              may e.g. be normalized to values well below 1.
+        """
+        if mode not in STACKING_MODES:
+            raise ValueError("Unknown stacking mode {}, use one of {}".format(mode, STACKING_MODES))
+        self.mode = mode
+        self.sigma = sigma
+        self.max_iterations = max_iterations
+        self.num_workers = num_workers
+        self.poisson_noise = poisson_noise
+
+        self.shape = None
+        self.dtype = None
+        self.num_images = 0
+        self.num_skipped = 0
+        self.num_rejected = 0
+
+        self._sum = None
+        self._images = None
+        self._spool = None
+        self._counts = False
+
+    def add(self, img_data):
+        """
+        Adds an image to the stack, images with a shape different from the first image are skipped.
+        :return: whether the image was added
+        """
+        img_data = np.asarray(img_data)
+        if self.shape is None:
+            self._allocate(img_data)
+        elif img_data.shape != self.shape:
+            self.num_skipped += 1
+            return False
+
+        self.num_images += 1
+        if self._images is None:
+            np.add(self._sum, img_data, out=self._sum, casting='unsafe')
+        else:
+            self._store(img_data.astype(self.dtype))
+        return True
+
+    def add_images(self, images):
+        """
+        Adds a 3d array or list of images to the stack.
+        """
+        for img_data in images:
+            self.add(img_data)
+
+    def _allocate(self, img_data):
+        self.shape = img_data.shape
+        self.dtype = img_data.dtype
+        if self.mode == 'sum' and img_data.dtype.kind in 'iub':
+            self._sum = np.zeros(self.shape, dtype=np.int64)
+        elif self.mode == 'sum' or self.mode == 'mean':
+            self._sum = np.zeros(self.shape, dtype=np.float64)
+        else:
+            self._images = []
+        self._counts = self.poisson_noise if self.poisson_noise is not None else img_data.dtype.kind in 'iub'
+
+    def _store(self, img_data):
+        if self._spool is None:
+            self._images.append(img_data)
+            if self.num_images * img_data.nbytes <= SPOOL_SIZE:
+                return
+            self._spool = tempfile.TemporaryFile()
+            for img in self._images:
+                self._spool.write(img.tobytes())
+            self._images = []
+        else:
+            self._spool.write(img_data.tobytes())
+
+    def _get_stack(self):
+        if self._spool is None:
+            return self._images
+        self._spool.flush()
+        return np.memmap(self._spool, dtype=self.dtype, mode='r', shape=(self.num_images,) + self.shape)
+
+    def _reduce_stack(self):
+        stack = self._get_stack()
+        row_size = self.num_images * int(np.prod(self.shape[1:]))
+        tile_rows = max(1, TILE_SIZE // max(row_size, 1))
+        tiles = [slice(row, row + tile_rows) for row in range(0, self.shape[0], tile_rows)]
+        result = np.zeros(self.shape, dtype=np.float64)
+        count = np.zeros(self.shape, dtype=np.int64)
+        with ThreadPoolExecutor(max_workers=self.num_workers) as executor:
+            # every tile writes to different rows of the result
+            for _ in executor.map(lambda rows: self._reduce_tile(stack, rows, result, count), tiles):
+                pass
+        del stack
+        if self.mode == 'median':
+            return result
+        self.num_rejected = self.num_images * int(np.prod(self.shape)) - int(count.sum())
+        return result / np.maximum(count, 1)
+
+    def _reduce_tile(self, stack, rows, result, count):
+        if isinstance(stack, list):
+            tile = np.array([img[rows] for img in stack])
+        else:
+            tile = np.array(stack[:, rows])
+        # float32 only for images it represents exactly, e.g. uint16 counts, larger integers need float64
+        tile = tile.astype(np.result_type(tile.dtype, np.float32), copy=False)
+        if self.mode == 'median':
+            result[rows] = stack_median(tile)
+            return
+        if self.mode == 'sigma_clip':
+            keep = sigma_clip_tile(tile, self.sigma, self.max_iterations)
+        else:
+            keep = mad_clip_tile(tile, self.sigma, self._counts)
+        result[rows] = np.sum(np.where(keep, tile, 0), axis=0, dtype=np.float64)
+        count[rows] = np.count_nonzero(keep, axis=0)
+
+    def get_result(self):
+        """
+        :return: the combined image or None if no image was added
+        """
+        if self.num_images == 0:
+            return None
+        if self.mode == 'sum':
+            return self._sum
+        if self.mode == 'mean':
+            return self._sum / self.num_images
+        return self._reduce_stack()
+
+
+def sigma_clip_tile(tile, sigma, max_iterations=5):
+    """
+    Iteratively rejects the pixels of a stack of images, which deviate more than sigma times the standard deviation
+    from the center of the pixel stack. The first center is the median, afterwards the mean of the remaining pixels.
+    :param tile: 3d array of images (or parts of images)
+    :param sigma: rejection threshold
+    :param max_iterations: maximum number of iterations, stops earlier when no further pixels are rejected
+    :return: boolean array with the shape of tile, True for the kept pixels
+    """
+    keep = np.ones(tile.shape, dtype=bool)
+    center = stack_median(tile)
+    for _ in range(max_iterations):
+        deviation = np.abs(tile - center)
+        count = np.maximum(np.count_nonzero(keep, axis=0), 1)
+        std = np.sqrt(np.sum(np.where(keep, deviation ** 2, 0), axis=0) / count)
+        new_keep = deviation <= sigma * std
+        if np.array_equal(new_keep, keep):
+            break
+        keep = new_keep
+        center = np.sum(np.where(keep, tile, 0), axis=0) / np.maximum(np.count_nonzero(keep, axis=0), 1)
+    return keep
+
+
+def mad_clip_tile(tile, sigma, poisson_noise=False):
+    """
+    Rejects the pixels of a stack of images, which deviate more than sigma times the standard deviation estimated
+    from the median absolute deviation from the median of the pixel stack.
+    :param tile: 3d array of images (or parts of images)
+    :param sigma: rejection threshold
+    :param poisson_noise: whether the images are counts. The median absolute deviation of pixels with only a few
+                          different counts is often zero, therefore the standard deviation is then at least the Poisson
+                          noise sqrt(|median| + 1) of the pixel.
+    :return: boolean array with the shape of tile, True for the kept pixels
+    """
+    median = stack_median(tile)
+    deviation = np.abs(tile - median)
+    std = MAD_TO_STD * stack_median(deviation)
+    if poisson_noise:
+        std = np.maximum(std, np.sqrt(np.abs(median) + 1))
+    return deviation <= sigma * std
+
+
+def stack_median(tile):
+    """
+    Median along the first axis of a stack of images. Sorting the images along the stack is considerably faster than
+    np.median, which partitions the stack for every pixel separately.
+    """
+    tile = np.sort(tile, axis=0)
+    center = len(tile) // 2
+    if len(tile) % 2:
+        return tile[center]
+    return 0.5 * (tile[center - 1] + tile[center])
+
+
+def reduce_image_files(filenames, load_image, reducer, num_workers=4):
+    """
+    Loads image files in a thread pool and adds them to the reducer in the order of the filenames. Only a few more
+    images than workers are kept in memory, so that the reduction of many files is limited by reading the files.
+    :param filenames: list of image files
+    :param load_image: function returning the image data for a filename
+    :param reducer: StackReducer
+    :param num_workers: number of threads loading the files
+    :return: the reducer
+    """
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        pending = deque()
+        for filename in filenames:
+            pending.append(executor.submit(load_image, filename))
+            if len(pending) > 2 * num_workers:
+                reducer.add(pending.popleft().result())
+        while pending:
+            reducer.add(pending.popleft().result())
+    return reducer
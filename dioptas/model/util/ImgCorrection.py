@@ -18,16 +18,29 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import threading
+import weakref
+from collections import OrderedDict
+
 import numpy as np
 import fabio
 from PIL import Image
 
+from .HelperModule import compose_transformations
+
 
 class ImgCorrectionManager(object):
     def __init__(self, img_shape=None):
         self._corrections = {}
         self._ind = 0
         self.shape = img_shape
+        # increased whenever the corrections change
+        self.version = 0
+
+        # combined correction array and the version and correction arrays it was calculated from
+        self._data = None
+        self._data_version = None
+        self._data_inputs = ()
 
     def add(self, img_correction, name=None):
         if self.shape is None:
@@ -38,6 +51,7 @@ class ImgCorrectionManager(object):
                 name = self._ind
                 self._ind += 1
             self._corrections[name] = img_correction
+            self.version += 1
             return True
         return False
 
@@ -51,6 +65,7 @@ class ImgCorrectionManager(object):
             self._ind -= 1
             name = self._ind
         del self._corrections[name]
+        self.version += 1
         if len(self._corrections) == 0:
             self.clear()
 
@@ -58,15 +73,37 @@ class ImgCorrectionManager(object):
         self._corrections = {}
         self.shape = None
         self._ind = 0
+        self.version += 1
+        self._data = None
+        self._data_inputs = ()
+
+    def update(self):
+        """
+        Marks the combined correction to be recalculated, needs to be called after changing the data of an added
+        correction in place.
+        """
+        self.version += 1
 
     def get_data(self):
+        """
+        Returns the product of all corrections as float32 array. The product is cached and only recalculated when a
+        correction is added or deleted or the data array of a correction is replaced (e.g. by updating its parameters).
+        The returned array is read-only, since it is shared by all callers.
+        """
         if len(self._corrections) == 0:
             return None
 
-        res = np.ones(self.shape)
-        for key, correction in self._corrections.items():
-            res *= correction.get_data()
-        return res
+        inputs = tuple(correction.get_data() for correction in self._corrections.values())
+        if self._data_version != self.version or len(inputs) != len(self._data_inputs) or \
+                any(data is not cached for data, cached in zip(inputs, self._data_inputs)):
+            res = np.array(inputs[0], dtype=np.float32)
+            for data in inputs[1:]:
+                np.multiply(res, data, out=res, casting='unsafe')
+            res.flags.writeable = False
+            self._data = res
+            self._data_version = self.version
+            self._data_inputs = inputs
+        return self._data
 
     def get_correction(self, name):
         try:
@@ -139,8 +176,18 @@ class CbnCorrection(ImgCorrectionInterface):
         self._center_offset = params['center_offset']
         self._center_offset_angle = params['center_offset_angle']
 
+    def get_params_tuple(self):
+        return tuple(self.get_params().values())
+
     def update(self):
+        """
+        Calculates the correction. The results are cached per parameters in the angle geometry of the tth and azi
+        arrays, so that going back to previous parameters in the GUI does not recalculate the correction.
+        """
+        geometry = get_angle_geometry(self._tth_array, self._azi_array)
+        self._data = geometry.get_result(('cbn',) + self.get_params_tuple(), self._calculate, geometry)
 
+    def _calculate(self, geometry):
         # diam - diamond thickness
         # ds - seat thickness
         # r1 - small radius
@@ -156,67 +203,64 @@ class CbnCorrection(ImgCorrectionInterface):
         tilt_rotation = self._tilt_rotation * dtor + np.pi / 2
         center_offset_angle = self._center_offset_angle * dtor
 
-        two_theta = self._tth_array * dtor
-        azi = self._azi_array * dtor
-
         # calculate radius of the cone for each pixel specific to a center_offset and rotation angle
         if self._center_offset != 0:
+            azi = geometry.azi
             beta = azi - np.arcsin(
                 self._center_offset * np.sin((np.pi - (azi + center_offset_angle))) / r1) + center_offset_angle
             r1 = np.sqrt(r1 ** 2 + self._center_offset ** 2 - 2 * r1 * self._center_offset * np.cos(beta))
             r2 = np.sqrt(r2 ** 2 + self._center_offset ** 2 - 2 * r2 * self._center_offset * np.cos(beta))
 
         # defining rotation matrices for the diamond anvil cell
-        Rx = np.matrix([[1, 0, 0],
-                        [0, np.cos(tilt_rotation), -np.sin(tilt_rotation)],
-                        [0, np.sin(tilt_rotation), np.cos(tilt_rotation)]])
-
-        Ry = np.matrix([[np.cos(tilt), 0, np.sin(tilt)],
-                        [0, 1, 0],
-                        [-np.sin(tilt), 0, np.cos(tilt)]])
-
-        dac_vector = np.array(Rx * Ry * np.matrix([1, 0, 0]).T)
-
-        # calculating a diffraction vector for each pixel
-        diffraction_vec = np.array([np.cos(two_theta),
-                                    np.cos(azi) * np.sin(two_theta),
-                                    np.sin(azi) * np.sin(two_theta)])
-
-        # angle between diffraction vector and diamond anvil cell vector based on dot product:
-        tt = np.arccos(dot_product(dac_vector, diffraction_vec) /
-                       (vector_len(dac_vector) * vector_len(diffraction_vec)))
-
-        # calculate path through diamond its absorption
-        path_diamond = diam / np.cos(tt)
-        abs_diamond = np.exp(-path_diamond / self._diamond_abs_length)
-
-        # define the different regions for the absorption in the seat
-        # region 2 is partial absorption (in the cone) and region 3 is complete absorbtion
-        ts1 = np.arctan(r1 / diam)
-        ts2 = np.arctan(r2 / (diam + ds))
-        tseat = np.arctan((r2 - r1) / ds)
-
-        region2 = np.logical_and(tt > ts1, tt < ts2)
-        region3 = tt >= ts2
-
-        # calculate the paths through each region
-        path_seat = np.zeros(tt.shape)
-        if self._center_offset != 0:
-            deltar = diam * np.tan(tt[region2]) - r1[region2]
-            alpha = np.pi / 2. - tseat[region2]
-            gamma = np.pi - (alpha + tt[region2] + np.pi / 2)
-        else:
-            deltar = diam * np.tan(tt[region2]) - r1
-            alpha = np.pi / 2. - tseat
-            gamma = np.pi - (alpha + tt[region2] + np.pi / 2)
-
-        path_seat[region2] = deltar * np.sin(alpha) / np.sin(gamma)
-        path_seat[region3] = ds / np.cos(tt[region3])
-
-        abs_seat = np.exp(-path_seat / self._seat_abs_length)
+        Rx = np.array([[1, 0, 0],
+                       [0, np.cos(tilt_rotation), -np.sin(tilt_rotation)],
+                       [0, np.sin(tilt_rotation), np.cos(tilt_rotation)]])
+
+        Ry = np.array([[np.cos(tilt), 0, np.sin(tilt)],
+                       [0, 1, 0],
+                       [-np.sin(tilt), 0, np.cos(tilt)]])
+
+        dac_vector = Rx.dot(Ry).dot([1, 0, 0])
+
+        with geometry.lock:
+            # cosine of the angle between the unit diffraction vector of each pixel and the dac vector:
+            # (cos(tth), cos(azi) * sin(tth), sin(azi) * sin(tth)) . dac_vector
+            cos_tt, temp = geometry.get_buffers(2)
+            np.multiply(geometry.cos_azi, dac_vector[1], out=cos_tt)
+            np.multiply(geometry.sin_azi, dac_vector[2], out=temp)
+            cos_tt += temp
+            cos_tt *= geometry.sin_tth
+            np.multiply(geometry.cos_tth, dac_vector[0], out=temp)
+            cos_tt += temp
+
+            # absorption of the path through the diamond: diam / cos(tt)
+            res = np.divide(-diam / self._diamond_abs_length, cos_tt, dtype=np.float32)
+            np.exp(res, out=res)
+
+            # define the different regions for the absorption in the seat
+            # region 2 is partial absorption (in the cone) and region 3 is complete absorbtion,
+            # the angle limits ts1 = arctan(r1 / diam) and ts2 = arctan(r2 / (diam + ds)) are compared by their cosines
+            cos_ts1 = diam / np.sqrt(diam ** 2 + r1 ** 2)
+            cos_ts2 = (diam + ds) / np.sqrt((diam + ds) ** 2 + r2 ** 2)
+            tseat = np.arctan((r2 - r1) / ds)
+
+            region2 = np.logical_and(cos_tt < cos_ts1, cos_tt > cos_ts2)
+            region3 = cos_tt <= cos_ts2
+
+            # the path in the cone: (diam * tan(tt) - r1) * sin(alpha) / sin(gamma), with alpha = pi / 2 - tseat and
+            # gamma = tseat - tt. The sine of tt is calculated from the cross product in float64, since it is
+            # inaccurate for small angles when calculated from the float32 cosine.
+            cos_tt2, sin_tt2 = geometry.get_dac_angle(dac_vector, region2)
+            if self._center_offset != 0:
+                r1 = r1[region2]
+                tseat = tseat[region2]
+            deltar = diam * sin_tt2 / cos_tt2 - r1
+            path_seat = deltar * np.cos(tseat) / (np.sin(tseat) * cos_tt2 - np.cos(tseat) * sin_tt2)
+            res[region2] *= np.exp(-path_seat / self._seat_abs_length)
+            res[region3] *= np.exp(-ds / (cos_tt[region3] * self._seat_abs_length))
 
         # combine both, diamond and seat absorption correction
-        self._data = abs_diamond * abs_seat
+        return res
 
     def __eq__(self, other):
         if not isinstance(other, CbnCorrection):
@@ -333,8 +377,7 @@ class TransferFunctionCorrection(ImgCorrectionInterface):
     def calculate_transfer_data(self):
         transfer_data = self.response_data / self.original_data
         if self.img_transformations:
-            for transformation in self.img_transformations:
-                transfer_data = transformation(transfer_data)
+            transfer_data = compose_transformations(self.img_transformations)(transfer_data)
         self.transfer_data = transfer_data
 
     def get_data(self):
@@ -367,6 +410,98 @@ class TransferFunctionCorrection(ImgCorrectionInterface):
         self.img_transformations = None
 
 
+class AngleGeometry(object):
+    """
+    Two theta and azimuth angles of all pixels of a calibration with their sines and cosines as float32 arrays, which
+    are shared by all corrections calculated for this calibration. The geometry also keeps work buffers and the
+    results of the corrections for the most recently used parameters, since the GUI recalculates the corrections on
+    every change of a parameter.
+    """
+
+    results_cache_size = 4
+
+    def __init__(self, tth_array, azi_array):
+        """
+        :param tth_array: two theta angles of the pixels in degree
+        :param azi_array: azimuth angles of the pixels in degree
+        """
+        tth = np.deg2rad(np.asarray(tth_array, dtype=np.float64))
+        azi = np.deg2rad(np.asarray(azi_array, dtype=np.float64))
+        self.shape = tth.shape
+        self.azi = azi.astype(np.float32)
+        self.cos_tth = np.cos(tth).astype(np.float32)
+        self.sin_tth = np.sin(tth).astype(np.float32)
+        self.cos_azi = np.cos(azi).astype(np.float32)
+        self.sin_azi = np.sin(azi).astype(np.float32)
+
+        self.lock = threading.RLock()
+        self._buffers = []
+        self._results = OrderedDict()
+
+    def get_buffers(self, num):
+        """
+        Returns float32 work buffers with the shape of the geometry, should only be used while holding the lock.
+        """
+        while len(self._buffers) < num:
+            self._buffers.append(np.empty(self.shape, dtype=np.float32))
+        return self._buffers[:num]
+
+    def get_dac_angle(self, dac_vector, selection):
+        """
+        Calculates the cosine and sine of the angle between the diffraction vectors of the selected pixels and the
+        given unit vector in float64.
+        :param dac_vector: unit vector, e.g. the direction of the diamond anvil cell
+        :param selection: boolean array or index selecting the pixels
+        :return: cosine and sine of the angles as 1d arrays
+        """
+        sin_tth = self.sin_tth[selection].astype(np.float64)
+        d0 = self.cos_tth[selection].astype(np.float64)
+        d1 = self.cos_azi[selection] * sin_tth
+        d2 = self.sin_azi[selection] * sin_tth
+        v0, v1, v2 = dac_vector
+        cos_angle = d0 * v0 + d1 * v1 + d2 * v2
+        sin_angle = np.sqrt((d1 * v2 - d2 * v1) ** 2 + (d2 * v0 - d0 * v2) ** 2 + (d0 * v1 - d1 * v0) ** 2)
+        return cos_angle, sin_angle
+
+    def get_result(self, key, calculate, *args):
+        """
+        Returns the cached result for the key or calculates it with calculate(*args). The results are read-only,
+        since they are shared by all corrections with the same parameters.
+        """
+        with self.lock:
+            if key in self._results:
+                self._results.move_to_end(key)
+                return self._results[key]
+            result = calculate(*args)
+            result.flags.writeable = False
+            self._results[key] = result
+            while len(self._results) > self.results_cache_size:
+                self._results.popitem(last=False)
+            return result
+
+
+_angle_geometry_lock = threading.Lock()
+_angle_geometry = (None, None, None)
+
+
+def get_angle_geometry(tth_array, azi_array):
+    """
+    Returns the AngleGeometry of the given tth and azi arrays (in degree). The geometry of the most recently used
+    arrays is kept, so that all corrections using the same array objects share it.
+    """
+    global _angle_geometry
+    with _angle_geometry_lock:
+        tth_ref, azi_ref, geometry = _angle_geometry
+        if geometry is not None and tth_ref() is tth_array and azi_ref() is azi_array:
+            return geometry
+        geometry = AngleGeometry(tth_array, azi_array)
+        try:
+            _angle_geometry = (weakref.ref(tth_array), weakref.ref(azi_array), geometry)
+        except TypeError:  # e.g. lists can not be weakly referenced
+            pass
+        return geometry
+
+
 class DummyCorrection(ImgCorrectionInterface):
     """
     Used in particular for unit tests
@@ -392,11 +527,3 @@ def load_image(filename):
         _img_data_fabio = fabio.open(filename)
         img_data = _img_data_fabio.data[::-1]
     return img_data
-
-
-def vector_len(vec):
-    return np.sqrt(vec[0] ** 2 + vec[1] ** 2 + vec[2] ** 2)
-
-
-def dot_product(vec1, vec2):
-    return vec1[0] * vec2[0] + vec1[1] * vec2[1] + vec1[2] * vec2[2]
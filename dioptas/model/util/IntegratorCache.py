@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+# Dioptas - GUI program for fast processing of 2D X-ray diffraction data
+# Principal author: Clemens Prescher (clemens.prescher@gmail.com)
+# Copyright (C) 2014-2019 GSECARS, University of Chicago, USA
+# Copyright (C) 2015-2018 Institute for Geology and Mineralogy, University of Cologne, Germany
+# Copyright (C) 2019-2020 DESY, Hamburg, Germany
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import zlib
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import numpy as np
+
+__all__ = ["IntegratorEngineCache", "mask_digest", "geometry_key"]
+
+
+class IntegratorEngineCache(object):
+    """
+    Bounded least recently used cache for the integration engines of pyFAI AzimuthalIntegrators.
+
+    pyFAI keeps the prepared (sparse matrix) integrators of an AzimuthalIntegrator in its engines dictionary and
+    rebuilds them whenever the image shape, mask, unit, number of points or azimuth range changes. This cache keeps
+    one engines dictionary per integration setup. During an integration the dictionary belonging to the current setup
+    is attached to the integrator, so returning to a previously used setup reuses the already prepared engines.
+    The engines are detached again afterwards, therefore a reset of the integrator (e.g. due to changed geometry
+    parameters) does not destroy the stored engines.
+
+    Usage:
+        with engine_cache.use(integrator, key):
+            integrator.integrate1d(...)
+    """
+
+    def __init__(self, max_size=8):
+        """
+        :param max_size: maximum number of integration setups for which the engines are kept
+        """
+        self._entries = OrderedDict()
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+
+    @contextmanager
+    def use(self, integrator, key):
+        """
+        Attaches the engines stored for key to the given integrator for the duration of the with block. If the key is
+        not in the cache, a new and empty engines dictionary is created, which will be filled by pyFAI during the
+        integration.
+        :param integrator: pyFAI AzimuthalIntegrator
+        :param key: hashable key describing the integration setup
+        """
+        integrator.engines = self.get(key)
+        try:
+            yield integrator
+        finally:
+            integrator.engines = {}
+
+    def get(self, key):
+        """
+        :param key: hashable key describing the integration setup
+        :return: engines dictionary for the key
+        """
+        engines = self._entries.get(key)
+        if engines is None:
+            self.misses += 1
+            engines = {}
+            self._entries[key] = engines
+            self._evict()
+        else:
+            self.hits += 1
+            self._entries.move_to_end(key)
+        return engines
+
+    def _evict(self):
+        while len(self._entries) > self.max_size:
+            _, engines = self._entries.popitem(last=False)
+            _reset_engines(engines)
+
+    def clear(self):
+        """
+        Removes all stored engines, should be called when the detector definition changes.
+        """
+        for engines in self._entries.values():
+            _reset_engines(engines)
+        self._entries = OrderedDict()
+
+    def reset_counters(self):
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        if total == 0:
+            return 0.0
+        return self.hits / total
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+
+def _reset_engines(engines):
+    for key in list(engines.keys()):
+        engines.pop(key).reset()
+
+
+def mask_digest(mask):
+    """
+    Calculates a cheap digest of a mask array
+    :param mask: 2d mask array or None
+    :return: tuple of shape and crc32 checksum or None if no mask is given
+    """
+    if mask is None:
+        return None
+    mask = np.ascontiguousarray(mask, dtype=bool)
+    return mask.shape, zlib.crc32(mask.view(np.uint8))
+
+
+def geometry_key(integrator):
+    """
+    Creates a hashable tuple of all geometry parameters which determine the pixel positions of an integrator
+    :param integrator: pyFAI AzimuthalIntegrator
+    """
+    return (integrator.detector.name, integrator.dist, integrator.poni1, integrator.poni2,
+            integrator.rot1, integrator.rot2, integrator.rot3,
+            integrator.pixel1, integrator.pixel2, integrator.wavelength,
+            integrator.detector.splineFile)
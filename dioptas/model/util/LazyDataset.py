@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+# Dioptas - GUI program for fast processing of 2D X-ray diffraction data
+# Principal author: Clemens Prescher (clemens.prescher@gmail.com)
+# Copyright (C) 2014-2019 GSECARS, University of Chicago, USA
+# Copyright (C) 2015-2018 Institute for Geology and Mineralogy, University of Cologne, Germany
+# Copyright (C) 2019-2020 DESY, Hamburg, Germany
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from collections import OrderedDict
+
+import numpy as np
+
+
+class LazyDataset(object):
+    """
+    Read-only view of a 2d h5py dataset, which behaves like a numpy array for the common read operations (shape,
+    integer and slice indexing, iteration over rows). Only the rows needed for a request are read from the file, in
+    blocks of block_rows rows, and the most recently used blocks are kept in a small cache.
+
+    Operations which need all the data (e.g. arithmetic) convert the dataset to a numpy array via np.asarray, which
+    reads the complete dataset. Assigning values reads the complete dataset into memory once, all further operations
+    are then done on the in-memory copy, the file is never modified.
+    """
+
+    def __init__(self, dataset, block_rows=256, max_blocks=16):
+        """
+        :param dataset: 2d h5py dataset, the file has to be kept open as long as the LazyDataset is used
+        :param block_rows: number of rows which are read at once
+        :param max_blocks: maximum number of row blocks in the cache
+        """
+        self.dataset = dataset
+        self.block_rows = block_rows
+        self.max_blocks = max_blocks
+        self.shape = dataset.shape
+        self.dtype = dataset.dtype
+        self.ndim = len(self.shape)
+        self._blocks = OrderedDict()
+        self._data = None
+
+    @property
+    def size(self):
+        return int(np.prod(self.shape))
+
+    def __len__(self):
+        return self.shape[0]
+
+    @property
+    def in_memory(self):
+        return self._data is not None
+
+    def __array__(self, dtype=None, copy=None):
+        data = self._data if self._data is not None else self.dataset[()]
+        if dtype is not None:
+            data = data.astype(dtype)
+        return data
+
+    def __iter__(self):
+        for ind in range(self.shape[0]):
+            yield self[ind]
+
+    def __getitem__(self, key):
+        if self._data is not None:
+            return self._data[key]
+        if not isinstance(key, tuple):
+            key = (key,)
+        if len(key) > 2 or any(k is Ellipsis or k is None for k in key):
+            return np.asarray(self)[key]
+        row_key = key[0]
+        col_key = key[1] if len(key) == 2 else slice(None)
+
+        if isinstance(row_key, (int, np.integer)):
+            row = int(row_key)
+            if row < 0:
+                row += self.shape[0]
+            if not 0 <= row < self.shape[0]:
+                raise IndexError("index {} is out of bounds for axis 0 with size {}".format(row_key, self.shape[0]))
+            return np.array(self._get_block(row // self.block_rows)[row % self.block_rows][col_key])
+
+        if isinstance(row_key, slice):
+            return self._get_rows(*row_key.indices(self.shape[0]))[:, col_key]
+
+        return np.asarray(self)[key]
+
+    def __setitem__(self, key, value):
+        if self._data is None:
+            self._data = self.dataset[()]
+            self.clear_cache()
+        self._data[key] = value
+
+    def _get_rows(self, start, stop, step):
+        rows = range(start, stop, step)
+        if len(rows) == 0:
+            return np.zeros((0,) + tuple(self.shape[1:]), dtype=self.dtype)
+        if step < 0:
+            return self._get_rows(rows[-1], rows[0] + 1, -step)[::-1]
+        if step > self.block_rows:
+            # sparse rows, e.g. for a strided 3d view, are read directly instead of reading complete blocks
+            return self.dataset[list(rows)]
+
+        first_block = rows[0] // self.block_rows
+        last_block = rows[-1] // self.block_rows
+        data = np.concatenate([self._get_block(block) for block in range(first_block, last_block + 1)])
+        offset = first_block * self.block_rows
+        return data[rows[0] - offset:rows[-1] - offset + 1:step]
+
+    def _get_block(self, block):
+        data = self._blocks.get(block)
+        if data is None:
+            data = self.dataset[block * self.block_rows:(block + 1) * self.block_rows]
+            self._blocks[block] = data
+            while len(self._blocks) > self.max_blocks:
+                self._blocks.popitem(last=False)
+        else:
+            self._blocks.move_to_end(block)
+        return data
+
+    def clear_cache(self):
+        self._blocks = OrderedDict()
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+# Dioptas - GUI program for fast processing of 2D X-ray diffraction data
+# Principal author: Clemens Prescher (clemens.prescher@gmail.com)
+# Copyright (C) 2014-2019 GSECARS, University of Chicago, USA
+# Copyright (C) 2015-2018 Institute for Geology and Mineralogy, University of Cologne, Germany
+# Copyright (C) 2019-2020 DESY, Hamburg, Germany
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from pyFAI.azimuthalIntegrator import AzimuthalIntegrator
+
+from .IntegratorCache import geometry_key
+
+__all__ = ["PixelGeometryCache", "copy_geometry"]
+
+
+class PixelGeometryCache(object):
+    """
+    Keeps the per-pixel geometry arrays (two theta, azimuth and solid angle) of the recently used calibrations as
+    float32 arrays, so that the image widgets, the peak search and the image corrections do not recalculate them with
+    pyFAI independently.
+
+    The arrays are stored per geometry state, which consists of all geometry parameters of the pyFAI integrator
+    (including the pixel size, which changes with the supersampling) and the image shape. Therefore a changed
+    calibration never returns outdated arrays. The cache has to be cleared, when the detector definition changes
+    without changing its name (e.g. by rotating the detector). The returned arrays are read-only, since they are shared.
+    """
+
+    calculators = {
+        "tth": lambda geometry, shape: geometry.twoThetaArray(shape),
+        "chi": lambda geometry, shape: geometry.chiArray(shape),
+        "solid_angle": lambda geometry, shape: geometry.solidAngleArray(shape),
+    }
+
+    def __init__(self, max_size=3):
+        """
+        :param max_size: maximum number of geometry states for which the arrays are kept
+        """
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get(self, name, geometry, shape):
+        """
+        :param name: "tth", "chi" (both in radians) or "solid_angle"
+        :param geometry: pyFAI AzimuthalIntegrator
+        :param shape: image shape
+        :return: float32 array with the given shape
+        """
+        key = (geometry_key(geometry), tuple(shape))
+        with self._lock:
+            arrays = self._entries.get(key)
+            if arrays is None:
+                arrays = {}
+                self._entries[key] = arrays
+                while len(self._entries) > self.max_size:
+                    self._entries.popitem(last=False)
+            else:
+                self._entries.move_to_end(key)
+
+            array = arrays.get(name)
+            if array is not None:
+                self.hits += 1
+                return array
+
+            self.misses += 1
+            array = self.calculators[name](geometry, shape)
+            if array.shape != tuple(shape):
+                # pyFAI returns its cached array independent of the requested shape. The array is calculated with a
+                # new integrator, since the cached arrays and integration engines of the shared geometry are still in
+                # use.
+                array = self.calculators[name](copy_geometry(geometry), shape)
+            array = np.asarray(array, dtype=np.float32)
+            array.flags.writeable = False
+            arrays[name] = array
+            return array
+
+    def clear(self):
+        with self._lock:
+            self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def copy_geometry(geometry):
+    """
+    Creates an independent integrator with the same geometry and detector, but without the cached arrays and
+    integration engines of the given integrator.
+    :param geometry: pyFAI AzimuthalIntegrator
+    :return: new AzimuthalIntegrator
+    """
+    pyFAI_parameter = geometry.getPyFAI()
+    return AzimuthalIntegrator(
+        dist=pyFAI_parameter["dist"],
+        poni1=pyFAI_parameter["poni1"],
+        poni2=pyFAI_parameter["poni2"],
+        rot1=pyFAI_parameter["rot1"],
+        rot2=pyFAI_parameter["rot2"],
+        rot3=pyFAI_parameter["rot3"],
+        detector=geometry.detector,
+        wavelength=geometry.wavelength,
+    )
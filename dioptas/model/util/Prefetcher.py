@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+# Dioptas - GUI program for fast processing of 2D X-ray diffraction data
+# Principal author: Clemens Prescher (clemens.prescher@gmail.com)
+# Copyright (C) 2014-2019 GSECARS, University of Chicago, USA
+# Copyright (C) 2015-2018 Institute for Geology and Mineralogy, University of Cologne, Germany
+# Copyright (C) 2019-2020 DESY, Hamburg, Germany
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class Prefetcher(object):
+    """
+    Loads data, which will probably be requested soon (e.g. the next image files), in a thread pool and keeps the
+    results in a cache with limited memory.
+
+    Every request is identified by a hashable key. The results are handed out only once and removed from the cache,
+    so that the caller owns the returned data and may modify it. Results of requests which are still running when they
+    are requested are waited for. Failed requests are not cached, pop() returns None for them, so that the caller loads
+    the data again and gets the error itself.
+
+    Usage:
+        prefetcher = Prefetcher()
+        prefetcher.prefetch(("file", filename), load_file, filename)
+        ...
+        data = prefetcher.pop(("file", filename))
+        if data is None:
+            data = load_file(filename)
+    """
+
+    def __init__(self, num_workers=2, max_bytes=512 * 2 ** 20):
+        """
+        :param num_workers: number of threads loading the data
+        :param max_bytes: maximum memory of the cached results, the least recently used are removed first
+        """
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+        self._executor = ThreadPoolExecutor(max_workers=num_workers)
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()
+        self._nbytes = 0
+        self._pending = {}
+
+    def prefetch(self, key, load_fn, *args):
+        """
+        Starts loading the data for the key in the background, if it is not cached or already being loaded.
+        :param key: hashable key identifying the data
+        :param load_fn: function returning the data, it is called with args in a thread of the pool
+        """
+        with self._lock:
+            if key in self._cache or key in self._pending:
+                return
+            future = self._executor.submit(load_fn, *args)
+            self._pending[key] = future
+        future.add_done_callback(lambda f: self._finished(key, f))
+
+    def retain(self, keys):
+        """
+        Cancels all requests, which are not started yet and whose keys are not in the given keys. Should be called when
+        the prediction of the next requests changes, e.g. when the navigation direction is reversed.
+        """
+        keys = set(keys)
+        with self._lock:
+            futures = [future for key, future in self._pending.items() if key not in keys]
+        for future in futures:  # the callbacks of cancelled futures acquire the lock, see _finished
+            future.cancel()
+
+    def pop(self, key, wait=True):
+        """
+        Returns the prefetched data for the key and removes it from the prefetcher.
+        :param key: key of the requested data
+        :param wait: whether to wait for the request, if the data is still being loaded
+        :return: the loaded data or None if it was not prefetched or loading failed
+        """
+        with self._lock:
+            if key in self._cache:
+                value, nbytes = self._cache.pop(key)
+                self._nbytes -= nbytes
+                self.hits += 1
+                return value
+            future = self._pending.get(key)
+            if future is None or (not wait and not future.done()):
+                self.misses += 1
+                return None
+            del self._pending[key]
+
+        try:
+            value = future.result()
+        except Exception as e:
+            logger.debug("Prefetching {} failed: {}".format(key, e))
+            self.misses += 1
+            return None
+        self.hits += 1
+        return value
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._cache or key in self._pending
+
+    def clear(self):
+        """
+        Removes all cached data and cancels all requests, requests already running are discarded when they finish.
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._cache = OrderedDict()
+            self._nbytes = 0
+        for future in pending.values():
+            future.cancel()
+
+    @property
+    def nbytes(self):
+        return self._nbytes
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.
+
+    def shutdown(self, wait=False):
+        self.clear()
+        self._executor.shutdown(wait=wait)
+
+    def _finished(self, key, future):
+        with self._lock:
+            if self._pending.get(key) is not future:
+                return  # already handed out by pop or discarded by clear
+            del self._pending[key]
+            if future.cancelled() or future.exception() is not None:
+                return
+            value = future.result()
+            nbytes = _get_nbytes(value)
+            if nbytes > self.max_bytes:
+                return
+            self._cache[key] = (value, nbytes)
+            self._nbytes += nbytes
+            while self._nbytes > self.max_bytes:
+                self._nbytes -= self._cache.popitem(last=False)[1][1]
+
+
+def _get_nbytes(value):
+    """
+    Estimates the memory of a loaded value, only numpy arrays are taken into account.
+    """
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, dict):
+        return sum(_get_nbytes(item) for item in value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(_get_nbytes(item) for item in value)
+    return 0
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+# Dioptas - GUI program for fast processing of 2D X-ray diffraction data
+# Principal author: Clemens Prescher (clemens.prescher@gmail.com)
+# Copyright (C) 2014-2019 GSECARS, University of Chicago, USA
+# Copyright (C) 2015-2018 Institute for Geology and Mineralogy, University of Cologne, Germany
+# Copyright (C) 2019-2020 DESY, Hamburg, Germany
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import threading
+import time
+
+import numpy as np
+from qtpy import QtCore
+
+
+class CancellationToken(object):
+    """
+    Thread-safe flag, which is used to ask a running job to stop.
+    """
+
+    def __init__(self):
+        self._event = threading.Event()
+
+    def cancel(self):
+        self._event.set()
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+
+class WorkerThread(QtCore.QThread):
+    """
+    Runs a long job, e.g. a batch integration, outside of the GUI thread.
+
+    The job is a function job(callback_fn, result_fn), with the callback and result functions as used by
+    BatchModel.run_integration: callback_fn(num_processed) returns False when the job was cancelled and result_fn
+    (binning, intensities, pos_map) receives the results of each processed block. The progress and the results are
+    published with the progress and partial_result signals, which are rate limited, so that the GUI thread is not
+    flooded with events. Results arriving between two partial_result signals are concatenated.
+
+    The job must not change objects used by the GUI thread. Its return value (or the raised exception) is stored in
+    result (or exception), when the job_finished signal is emitted in the thread of the worker object, so that the
+    result can be applied there.
+
+    Usage:
+        worker = WorkerThread(lambda callback_fn, result_fn: batch_model.run_integration(job, callback_fn, result_fn))
+        worker.progress.connect(progress_dialog.setValue)
+        progress_dialog.canceled.connect(worker.cancel)
+        worker.job_finished.connect(lambda: batch_model.set_integration_result(worker.result))
+        worker.start()
+    """
+
+    progress = QtCore.Signal(int)
+    partial_result = QtCore.Signal(object, object, object)
+    job_finished = QtCore.Signal()
+
+    def __init__(self, job, progress_interval=0.1, result_interval=0.5, parent=None):
+        """
+        :param job: function job(callback_fn, result_fn) to be run in the thread
+        :param progress_interval: minimum time in seconds between two progress signals
+        :param result_interval: minimum time in seconds between two partial_result signals
+        """
+        super(WorkerThread, self).__init__(parent)
+        self.job = job
+        self.progress_interval = progress_interval
+        self.result_interval = result_interval
+        self.token = CancellationToken()
+        self.result = None
+        self.exception = None
+
+        self._last_progress = 0
+        self._last_result = 0
+        self._num_processed = None
+        self._results = []
+
+        # finished is emitted by the thread, the connection to the worker object queues it into the thread of the object
+        self.finished.connect(self._emit_job_finished)
+
+    def cancel(self):
+        self.token.cancel()
+
+    @property
+    def cancelled(self):
+        return self.token.cancelled
+
+    def run(self):
+        try:
+            self.result = self.job(self._callback, self._add_result)
+        except Exception as e:
+            self.exception = e
+        finally:
+            self._emit_results()
+            if self._num_processed is not None:
+                self.progress.emit(self._num_processed)
+
+    def _emit_job_finished(self):
+        self.wait()
+        self.job_finished.emit()
+
+    def _callback(self, num_processed):
+        self._num_processed = int(num_processed)
+        if time.time() - self._last_progress >= self.progress_interval:
+            self._last_progress = time.time()
+            self.progress.emit(self._num_processed)
+        return not self.token.cancelled
+
+    def _add_result(self, binning, intensities, pos_map):
+        self._results.append((np.array(binning), np.array(intensities), np.reshape(pos_map, (-1, 2))))
+        if time.time() - self._last_result >= self.result_interval:
+            self._emit_results()
+
+    def _emit_results(self):
+        if len(self._results) == 0:
+            return
+        results, self._results = self._results, []
+        binning = max((result[0] for result in results), key=len)
+        num_points = len(binning)
+        intensities = np.concatenate([np.pad(result[1], ((0, 0), (0, num_points - result[1].shape[1])))
+                                      for result in results])
+        pos_map = np.concatenate([result[2] for result in results])
+        self._last_result = time.time()
+        self.partial_result.emit(binning, intensities, pos_map)
@@ -72,6 +72,22 @@ def supersample_image(img_data, factor):
         return img_data
 
 
+def apply_background_and_corrections(img_data, background=None, corrections=None, factor=1):
+    """
+    Subtracts the background, divides by the corrections and multiplies with the factor.
+    :param img_data: 2d image or 3d array of images
+    :param background: background array with the shape of a single image or None
+    :param corrections: correction array with the shape of a single image or None
+    :param factor: scaling factor
+    :return: processed image data
+    """
+    if background is not None:
+        img_data = img_data - background
+    if corrections is not None:
+        img_data = img_data / corrections
+    return img_data * factor
+
+
 def trim_trailing_zeros(x, y):
     """
     Trims the trailing zeros of a x, y pattern
@@ -84,3 +100,18 @@ def trim_trailing_zeros(x, y):
     x_trim = x[:len(y_trim)]
 
     return x_trim, y_trim
+
+
+def trim_trailing_zeros_stack(x, intensities):
+    """
+    Trims the points after the last non-zero value of all patterns of a stack, so that the patterns keep a common
+    length
+    :param x: x-values
+    :param intensities: 2d array with one pattern per row
+    :return: trimmed x, intensities as tuple (x, intensities)
+    """
+    nonzero_points = np.flatnonzero(np.any(intensities, axis=0))
+    if len(nonzero_points) == 0:
+        return x, intensities
+    length = nonzero_points[-1] + 1
+    return x[:length], intensities[:, :length]
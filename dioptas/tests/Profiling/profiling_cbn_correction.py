@@ -18,26 +18,24 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-import numpy as np
 import time
-import matplotlib.pyplot as plt
+
+import numpy as np
 from pyFAI.azimuthalIntegrator import AzimuthalIntegrator
 
-from Data.ImgCorrection import CbnCorrection
+from dioptas.model.util.ImgCorrection import CbnCorrection
 
 # defining geometry
-image_shape = [2048, 2048] #pixel
-detector_distance = 200 #mm
-wavelength = 0.31 #angstrom
-center_x = 1024 #pixel
-center_y = 1024 #pixel
-tilt = 0 #degree
-rotation = 0 #degree
-pixel_size = 79 #um
+image_shape = [2048, 2048]  # pixel
+detector_distance = 200  # mm
+wavelength = 0.31  # angstrom
+center_x = 1024  # pixel
+center_y = 1024  # pixel
+tilt = 0  # degree
+rotation = 0  # degree
+pixel_size = 79  # um
 
-#some initialization
-dummy_tth = np.linspace(0, 35, 2000)
-dummy_int = np.ones(dummy_tth.shape)
+# some initialization
 geometry = AzimuthalIntegrator()
 geometry.setFit2D(directDist=detector_distance,
                   centerX=center_x,
@@ -46,23 +44,38 @@ geometry.setFit2D(directDist=detector_distance,
                   tiltPlanRotation=rotation,
                   pixelX=pixel_size,
                   pixelY=pixel_size)
-geometry.wavelength = wavelength/1e10
-dummy_img = geometry.calcfrom1d(dummy_tth, dummy_int, shape=image_shape, correctSolidAngle=True)
+geometry.wavelength = wavelength / 1e10
+
+# the cBN correction expects the angles in degree
+tth_array = np.rad2deg(geometry.twoThetaArray(image_shape))
+azi_array = np.rad2deg(geometry.chiArray(image_shape))
+
 
+def create_cbn_correction(**params):
+    return CbnCorrection(tth_array, azi_array,
+                         diamond_thickness=params.get('diamond_thickness', 2.2),
+                         seat_thickness=5.3,
+                         small_cbn_seat_radius=0.4,
+                         large_cbn_seat_radius=1.95,
+                         tilt=params.get('tilt', 0),
+                         tilt_rotation=0,
+                         center_offset=params.get('center_offset', 0))
 
-tth_array = geometry.twoThetaArray(image_shape)
-azi_array = geometry.chiArray(image_shape)
 
+def profile(description, cbn_correction, repetitions=1):
+    t1 = time.time()
+    for _ in range(repetitions):
+        cbn_correction.update()
+    print("{0}: {1:.4f}s".format(description, (time.time() - t1) / repetitions))
+    return cbn_correction.get_data()
 
-cbn_correction = CbnCorrection(tth_array, azi_array,
-                               diamond_thickness=2.2,
-                               seat_thickness=5.3,
-                               small_cbn_seat_radius=0.4,
-                               large_cbn_seat_radius=1.95,
-                               tilt=0,
-                               tilt_rotation=0)
 
-t1= time.time()
-cbn_correction.get_data()
-print("It took {0}s".format(time.time()-t1))
+# the first calculation also precomputes the shared geometry of the tth and azi arrays
+profile("First calculation, including the geometry", create_cbn_correction())
+for ind in range(1, 6):
+    profile("Changed diamond thickness", create_cbn_correction(diamond_thickness=round(2.2 + 0.1 * ind, 1)))
+profile("Changed tilt", create_cbn_correction(tilt=3))
+profile("Changed center offset", create_cbn_correction(center_offset=0.1))
+cbn_data = profile("Previous parameters (cached)", create_cbn_correction(diamond_thickness=2.5), 100)
 
+print("Data type: {0}, range: {1:.4f} - {2:.4f}".format(cbn_data.dtype, cbn_data.min(), cbn_data.max()))
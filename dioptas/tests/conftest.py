@@ -36,10 +36,19 @@ from dioptas.controller.integration import (
 from dioptas.controller.integration.ImageController import ImageController
 
 from dioptas.model.DioptasModel import DioptasModel
+from dioptas.model.BatchModel import BatchModel
 from dioptas.widgets.integration import IntegrationWidget
 from dioptas.widgets.CalibrationWidget import CalibrationWidget
 
 
+@pytest.fixture(autouse=True)
+def frame_count_file(tmp_path, monkeypatch):
+    """The batch models of the tests do not use the frame count index of the user"""
+    filename = str(tmp_path / "frame_counts.json")
+    monkeypatch.setattr(BatchModel, "default_frame_count_file", filename)
+    return filename
+
+
 @pytest.fixture(scope="session")
 def qapp():
     """Fixture ensuring QApplication is instanciated"""
@@ -22,7 +22,7 @@ import os
 import numpy as np
 import pytest
 
-from ..utility import MockMouseEvent
+from ..utility import MockMouseEvent, wait_for_batch_job
 
 unittest_data_path = os.path.join(os.path.dirname(__file__), "../data")
 jcpds_path = os.path.join(unittest_data_path, "jcpds")
@@ -162,6 +162,7 @@ def test_extract_background(batch_controller, batch_model, load_proc_data):
     batch_model.data[...] = 1.0
     assert batch_model.bkg is None
     batch_controller.extract_background()
+    wait_for_batch_job(batch_controller)
     assert np.allclose(batch_model.bkg, 1.0)
 
 
@@ -182,6 +183,37 @@ def test_change_scale(batch_controller, batch_widget, batch_model, load_proc_dat
     assert np.all(batch_widget.stack_plot_widget.img_view.img_data == 100.0)
 
 
+def test_plot_large_batch_with_level_of_detail(
+    batch_controller, batch_widget, batch_model, load_proc_data
+):
+    batch_widget.activate_stack_plot()
+    img_view = batch_widget.stack_plot_widget.img_view
+    img_view.lod_max_pixels = 1000
+    batch_model.data = np.arange(50 * 4038, dtype=float).reshape(50, 4038)
+    batch_model.data[10, 100] = 1e7
+    batch_controller.plot_batch(0, 49)
+
+    assert img_view.pyramid.shape == (50, 4038)
+    assert img_view._lod_level != (0, 0)
+    assert img_view.img_data.shape == batch_controller.pyramid.level_shape(
+        img_view._lod_level
+    )
+    assert np.max(img_view.img_data) == 1e7
+    assert img_view.get_data_shape() == (50, 4038)
+
+    # zooming in renders a finer level of the visible part only
+    img_view.img_view_box.setRange(xRange=(90, 110), yRange=(5, 15), padding=0)
+    assert img_view._lod_level == (0, 0)
+    window = img_view._lod_window
+    assert window[0] <= 5 and window[1] >= 15 and window[2] <= 90 and window[3] >= 110
+    assert window[3] - window[2] < 4038
+
+    # replotting with unchanged data reuses the pyramid levels
+    levels = dict(batch_controller.pyramid._levels)
+    batch_controller.plot_batch(0, 49)
+    assert all(batch_controller.pyramid._levels[level] is levels[level] for level in levels)
+
+
 def test_process_step(batch_controller, batch_widget, batch_model, load_proc_data):
     batch_widget.position_widget.step_series_widget.stop_txt.setValue(
         batch_model.n_img - 1
@@ -19,13 +19,18 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import os
+import sys
 import pytest
 from unittest.mock import MagicMock
 
+from qtpy import QtWidgets
+
 import numpy as np
 
-from ..utility import click_button
+from ..utility import click_button, wait_for_batch_job
 from ...model.util.HelperModule import get_partial_value
+from ...widgets.UtilityWidgets import get_progress_dialog
+from ...controller.integration import BatchController
 from .test_BatchController_part1 import *
 
 unittest_data_path = os.path.join(os.path.dirname(__file__), "../data")
@@ -216,9 +221,12 @@ def test_set_navigation_range(batch_controller, batch_widget, load_proc_data):
     # ToDo Test interaction with other controllers: Integration window vertical line. Patterns
 
 
-@pytest.mark.skip("needs to be fixed")
 def test_integrate(
-    batch_controller, batch_widget, integration_widget, dioptas_model, load_proc_data
+    batch_controller,
+    batch_widget,
+    dioptas_model,
+    load_proc_data,
+    monkeypatch,
 ):
     batch_widget.position_widget.step_series_widget.start_txt.blockSignals(True)
     batch_widget.position_widget.step_series_widget.stop_txt.blockSignals(True)
@@ -228,18 +236,61 @@ def test_integrate(
     batch_widget.position_widget.step_series_widget.start_txt.blockSignals(False)
     batch_widget.position_widget.step_series_widget.stop_txt.blockSignals(False)
 
-    batch_widget.mode_widget.view_f_btn.setChecked(False)
-    integration_widget.automatic_binning_cb.setChecked(False)
-    integration_widget.bin_count_txt.setText(str(4000))
+    # integrate the integrated images (series view), not the raw files
+    batch_widget.mode_widget.view_2d_btn.setChecked(True)
+    dioptas_model.current_configuration.integration_rad_points = 4000
 
     dioptas_model.calibration_model.load(
         os.path.join(unittest_data_path, "lambda", "L2.poni")
     )
 
-    batch_controller.integrate()
+    progress_dialogs = []
 
-    assert dioptas_model.batch_model.data.shape == (8, 3984)
-    assert dioptas_model.batch_model.binning.shape == (3984,)
+    def create_progress_dialog(*args):
+        progress_dialog = get_progress_dialog(*args)
+        progress_dialog.setValue = MagicMock(side_effect=progress_dialog.setValue)
+        progress_dialogs.append(progress_dialog)
+        return progress_dialog
+
+    monkeypatch.setattr(
+        sys.modules[BatchController.__module__], "get_progress_dialog", create_progress_dialog
+    )
+    show_partial_integration = batch_controller.show_partial_integration
+    batch_controller.show_partial_integration = MagicMock(
+        side_effect=show_partial_integration
+    )
+    batch_controller.integrate()
+    # the controls are disabled while the integration is running in the worker thread
+    assert batch_controller.job_running
+    assert not batch_widget.control_widget.integrate_btn.isEnabled()
+    wait_for_batch_job(batch_controller)
+    assert batch_widget.control_widget.integrate_btn.isEnabled()
+
+    # the progress and the patterns are shown while the integration is running
+    assert progress_dialogs[0].setValue.call_args[0][0] == 8
+    partial_results = batch_controller.show_partial_integration.call_args_list
+    assert len(partial_results) > 0
+    partial_pos_map = np.concatenate([call[0][2] for call in partial_results])
+    assert np.array_equal(partial_pos_map, dioptas_model.batch_model.pos_map)
+    assert batch_controller._live_data is None
+
+    assert dioptas_model.batch_model.data.shape[0] == 8
+    assert 0 < dioptas_model.batch_model.data.shape[1] <= 4000
+    assert dioptas_model.batch_model.binning.shape == (dioptas_model.batch_model.data.shape[1],)
     assert dioptas_model.batch_model.n_img == 8
     assert dioptas_model.batch_model.n_img_all == 50
     assert dioptas_model.batch_model.pos_map.shape == (8, 2)
+
+
+def test_show_partial_integration(batch_controller, batch_widget):
+    batch_widget.activate_stack_plot()
+    img_view = batch_widget.stack_plot_widget.img_view
+    pos_map = np.zeros((4, 2))
+    batch_controller.show_partial_integration(np.arange(100), np.ones((3, 100)), pos_map[:3])
+    batch_controller.show_partial_integration(np.arange(100), np.full((4, 100), 2.0), pos_map)
+
+    assert img_view.pyramid.shape == (7, 100)
+    assert np.array_equal(img_view.img_data[:, 0], [1, 1, 1, 2, 2, 2, 2])
+
+    batch_controller.reset_pyramid()
+    assert batch_controller.pyramid.shape == (0, 0)
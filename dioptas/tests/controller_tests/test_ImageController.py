@@ -233,6 +233,21 @@ def test_average_images(integration_widget, image_controller):
     assert np.array_equal((data1+data2)/2, integration_widget.img_widget.img_data)
 
 
+def test_dezinger_images(integration_widget, image_controller, dioptas_model):
+    filenames = [os.path.join(unittest_data_path, "image_001.tif"),
+                 os.path.join(unittest_data_path, "image_002.tif")]
+    dioptas_model.img_model.combine_files = MagicMock()
+    click_checkbox(integration_widget.img_batch_mode_dezinger_rb)
+
+    QtWidgets.QFileDialog.getOpenFileNames = MagicMock(return_value=filenames)
+    click_button(integration_widget.load_img_btn)
+    dioptas_model.img_model.combine_files.assert_called_once_with(filenames, 'mad_clip')
+
+    QtWidgets.QFileDialog.getOpenFileNames = MagicMock(return_value=filenames[:1])
+    click_button(integration_widget.load_img_btn)  # a single series file is dezingered as well
+    dioptas_model.img_model.combine_files.assert_called_with(filenames[:1], 'mad_clip')
+
+
 def test_load_image_with_manual_input_file_name(
     integration_widget, dioptas_model, image_controller
 ):
@@ -392,6 +407,9 @@ def test_sources_are_updated_in_sources_combobox(
     )
     filename = os.path.join(unittest_data_path, "hdf5_dataset", "ma4500_demoh5.h5")
     dioptas_model.img_model.load(filename)
+    # the remaining sources are searched, when the source selector is opened
+    file_widget.sources_cb.showPopup()
+    file_widget.sources_cb.hidePopup()
 
     assert file_widget.sources_cb.count() > 0
     assert file_widget.sources_cb.count() == len(dioptas_model.img_model.sources)
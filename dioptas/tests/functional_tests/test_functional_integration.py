@@ -20,21 +20,25 @@
 
 import gc
 import os
+import tempfile
 import unittest
 
 from ..utility import (
     QtTest,
     click_button,
     delete_folder_if_exists,
+    wait_for_batch_job,
 )
 
 import numpy as np
+import h5py
 
 from qtpy import QtWidgets
-from mock import MagicMock
+from mock import MagicMock, patch
 from xypattern import Pattern
 
 from ...model.DioptasModel import DioptasModel
+from ...model.CalibrationModel import CalibrationModel
 from ...widgets.integration import IntegrationWidget
 from ...controller.integration import IntegrationController
 
@@ -198,8 +202,19 @@ class BatchIntegrationFunctionalTest(QtTest):
         self.model.calibration_model.integrate_1d = MagicMock(
             return_value=(pattern.x, pattern.y)
         )
+        # the batch integration uses its own calibration model
+        integrate_stack_patcher = patch.object(CalibrationModel, "integrate_1d_stack", MagicMock(
+            side_effect=lambda frames, *_, **__: (
+                pattern.x,
+                np.tile(pattern.y, (len(frames), 1)),
+            )
+        ))
+        integrate_stack_patcher.start()
+        self.addCleanup(integrate_stack_patcher.stop)
 
         self.model.calibration_model.is_calibrated = True
+        # the mocked integration is only used in the current process
+        self.model.batch_model.num_processes = 1
 
         self.model.calibration_model.load(os.path.join(data_path, "lambda/L2.poni"))
 
@@ -208,16 +223,23 @@ class BatchIntegrationFunctionalTest(QtTest):
             os.path.join(data_path, "lambda/testasapo1_1009_00002_m1_part00001.nxs"),
         ]
 
+        # processed file for the integrations streamed by integrate_streamed
+        self.output_path = tempfile.mkdtemp()
+        self.output_file = os.path.join(self.output_path, "integrated.nxs")
+
         QtWidgets.QFileDialog.getOpenFileNames = MagicMock(return_value=files)
         click_button(self.integration_widget.batch_widget.file_control_widget.load_btn)
 
         self.integration_controller.batch_controller.integrate()
+        wait_for_batch_job(self.integration_controller.batch_controller)
 
     def tearDown(self):
+        self.model.batch_model.reset_data()
         del self.integration_widget
         del self.integration_controller
         del self.model
         gc.collect()
+        delete_folder_if_exists(self.output_path)
 
         # delete_folder_if_exists(os.path.join(data_path, 'lambda_temp'))
 
@@ -275,6 +297,7 @@ class BatchIntegrationFunctionalTest(QtTest):
             return_value=[os.path.join(data_path, "Test_spec.nxs")]
         )
         click_button(self.integration_widget.batch_widget.file_control_widget.load_btn)
+        wait_for_batch_job(self.integration_controller.batch_controller)
 
         self.assertEqual(self.model.batch_model.data.shape[0], 20)
         self.assertEqual(
@@ -302,6 +325,7 @@ class BatchIntegrationFunctionalTest(QtTest):
             2
         )
         self.integration_controller.batch_controller.integrate()
+        wait_for_batch_job(self.integration_controller.batch_controller)
         self.assertEqual(self.model.batch_model.data.shape[0], 10)
         start = int(
             str(
@@ -320,6 +344,83 @@ class BatchIntegrationFunctionalTest(QtTest):
         self.assertEqual(start, 0)
         self.assertEqual(frame, "Frame(10/20):")
 
+    def integrate_streamed(self, output_file=None):
+        self.integration_widget.batch_widget.control_widget.stream_cb.setChecked(True)
+        QtWidgets.QFileDialog.getSaveFileName = MagicMock(return_value=output_file or self.output_file)
+        self.integration_controller.batch_controller.integrate()
+        wait_for_batch_job(self.integration_controller.batch_controller)
+
+    def test_integration_is_kept_in_memory_by_default(self):
+        self.assertEqual(self.model.batch_model.data.shape[0], 20)
+        self.assertEqual(os.listdir(self.output_path), [])
+
+    def test_integration_is_streamed_into_processed_file(self):
+        self.integrate_streamed()
+        with h5py.File(self.output_file, "r") as f:
+            self.assertEqual(f["processed/result/data"].shape, self.model.batch_model.data.shape)
+            self.assertTrue(np.all(f["processed/process/manifest/done"][()]))
+
+    def test_resume_interrupted_integration(self):
+        self.integrate_streamed()
+        data = np.array(self.model.batch_model.data)
+        # mark the last images as not integrated, as after an interrupted integration
+        with h5py.File(self.output_file, "r+") as f:
+            f["processed/process/manifest/done"][15:] = False
+
+        self.model.calibration_model.integrate_1d_stack.reset_mock()
+        QtWidgets.QMessageBox.question = MagicMock(return_value=QtWidgets.QMessageBox.Yes)
+        self.integrate_streamed()
+
+        QtWidgets.QMessageBox.question.assert_called_once()
+        integrated = sum(len(call[0][0]) for call in self.model.calibration_model.integrate_1d_stack.call_args_list)
+        self.assertEqual(integrated, 5)
+        self.assertTrue(np.array_equal(self.model.batch_model.data, data))
+
+        QtWidgets.QMessageBox.question = MagicMock(return_value=QtWidgets.QMessageBox.No)
+        # the resumed patterns are read lazily from the file, which has to be closed before changing it
+        self.model.batch_model._close_proc_file()
+        with h5py.File(self.output_file, "r+") as f:
+            f["processed/process/manifest/done"][15:] = False
+        self.model.calibration_model.integrate_1d_stack.reset_mock()
+        self.integrate_streamed()
+        integrated = sum(len(call[0][0]) for call in self.model.calibration_model.integrate_1d_stack.call_args_list)
+        self.assertEqual(integrated, 20)
+
+    def test_overwriting_other_file_needs_confirmation(self):
+        other_file = os.path.join(self.output_path, "other.nxs")
+        with h5py.File(other_file, "w") as f:
+            f["data"] = np.arange(10)
+        self.model.calibration_model.integrate_1d_stack.reset_mock()
+
+        QtWidgets.QMessageBox.question = MagicMock(return_value=QtWidgets.QMessageBox.No)
+        self.integrate_streamed(other_file)
+        QtWidgets.QMessageBox.question.assert_called_once()
+        self.model.calibration_model.integrate_1d_stack.assert_not_called()
+        with h5py.File(other_file, "r") as f:
+            self.assertTrue(np.array_equal(f["data"][()], np.arange(10)))
+
+        QtWidgets.QMessageBox.question = MagicMock(return_value=QtWidgets.QMessageBox.Yes)
+        self.integrate_streamed(other_file)
+        with h5py.File(other_file, "r") as f:
+            self.assertNotIn("data", f)
+            self.assertEqual(f["processed/result/data"].shape[0], 20)
+
+    def test_loading_processed_file_does_not_overwrite_it(self):
+        self.integrate_streamed()
+        with open(self.output_file, "rb") as f:
+            content = f.read()
+        self.model.calibration_model.integrate_1d_stack.reset_mock()
+
+        QtWidgets.QFileDialog.getOpenFileNames = MagicMock(return_value=[self.output_file])
+        click_button(self.integration_widget.batch_widget.file_control_widget.load_btn)
+        wait_for_batch_job(self.integration_controller.batch_controller)
+
+        # the loaded patterns are integrated again, but only in memory
+        self.assertTrue(self.model.calibration_model.integrate_1d_stack.called)
+        self.model.batch_model.reset_data()
+        with open(self.output_file, "rb") as f:
+            self.assertEqual(f.read(), content)
+
     def test_integrate_with_parameters(self):
 
         self.integration_widget.batch_widget.position_widget.step_series_widget.step_txt.setValue(
@@ -332,6 +433,7 @@ class BatchIntegrationFunctionalTest(QtTest):
             15
         )
         self.integration_controller.batch_controller.integrate()
+        wait_for_batch_job(self.integration_controller.batch_controller)
         start = int(
             str(
                 self.integration_widget.batch_widget.position_widget.step_series_widget.start_txt.text()
@@ -360,6 +462,7 @@ class BatchIntegrationFunctionalTest(QtTest):
             11
         )
         self.integration_controller.batch_controller.integrate()
+        wait_for_batch_job(self.integration_controller.batch_controller)
         self.assertEqual(self.model.batch_model.data.shape[0], 6)
         start = int(
             str(
@@ -406,6 +509,7 @@ class BatchIntegrationFunctionalTest(QtTest):
         # click_button(self.integration_widget.batch_widget.file_control_widget.load_btn)
 
         self.integration_controller.batch_controller.integrate()
+        wait_for_batch_job(self.integration_controller.batch_controller)
         self.save_pattern(os.path.join(data_path, f"Test_missing_raw.nxs"))
 
         delete_folder_if_exists(os.path.join(data_path, "lambda_temp"))
@@ -414,6 +518,7 @@ class BatchIntegrationFunctionalTest(QtTest):
             return_value=[os.path.join(data_path, "Test_missing_raw.nxs")]
         )
         click_button(self.integration_widget.batch_widget.file_control_widget.load_btn)
+        wait_for_batch_job(self.integration_controller.batch_controller)
         self.assertTrue(self.model.batch_model.raw_available is False)
         start = int(
             str(
@@ -446,6 +551,7 @@ class BatchIntegrationFunctionalTest(QtTest):
             return_value=[os.path.join(data_path, "Test_missing_raw.nxs")]
         )
         click_button(self.integration_widget.batch_widget.load_btn)
+        wait_for_batch_job(self.integration_controller.batch_controller)
         self.assertEqual(self.model.batch_model.n_img_all, 20)
         self.assertTrue(self.model.batch_model.raw_available)
         self.assertEqual(
@@ -527,6 +633,7 @@ class BatchIntegrationFunctionalTest(QtTest):
             12
         )
         self.integration_controller.batch_controller.integrate()
+        wait_for_batch_job(self.integration_controller.batch_controller)
         start = int(
             str(
                 self.integration_widget.batch_widget.position_widget.step_series_widget.start_txt.text()
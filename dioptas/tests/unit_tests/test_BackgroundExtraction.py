@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+# Dioptas - GUI program for fast processing of 2D X-ray diffraction data
+# Principal author: Clemens Prescher (clemens.prescher@gmail.com)
+# Copyright (C) 2014-2019 GSECARS, University of Chicago, USA
+# Copyright (C) 2015-2018 Institute for Geology and Mineralogy, University of Cologne, Germany
+# Copyright (C) 2019-2020 DESY, Hamburg, Germany
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import numpy as np
+from xypattern import Pattern
+from xypattern.auto_background import SmoothBrucknerBackground
+
+from ...model.util.BackgroundExtraction import extract_background_stack, smooth_bruckner_stack
+
+
+def create_patterns(num_patterns=7):
+    x = np.linspace(2, 25, 1200)
+    random_state = np.random.RandomState(0)
+    y = np.array([30 * np.exp(-(x - 8 - 0.3 * i) ** 2 / 0.02) + 10 + 3 * np.sin(x / 4) +
+                  random_state.random_sample(x.size) for i in range(num_patterns)])
+    return x, y
+
+
+def test_extract_background_stack_is_equal_to_single_patterns():
+    x, y = create_patterns()
+    for parameters in [(0.1, 50, 50), (0.3, 20, 10)]:
+        auto_bkg = SmoothBrucknerBackground(*parameters)
+        expected = np.array([auto_bkg.extract_background(Pattern(x, pattern_y)) for pattern_y in y])
+        bkg = extract_background_stack(x, y, *parameters)
+        assert bkg.shape == y.shape
+        assert np.allclose(bkg, expected, rtol=1e-8, atol=1e-8)
+
+
+def test_smooth_bruckner_stack_of_single_pattern():
+    x, y = create_patterns(3)
+    smoothed = smooth_bruckner_stack(y, 20, 10)
+    assert np.allclose(smooth_bruckner_stack(y[1], 20, 10), smoothed[1])
+    assert np.all(smoothed <= y + 1e-12)
@@ -1,11 +1,18 @@
 import os
+import sys
 import pytest
 
+import h5py
 import numpy as np
 from xypattern import Pattern
 
 from ...model.Configuration import Configuration
-from ...model.BatchModel import BatchModel, iterate_folder
+from ...model.CalibrationModel import CalibrationModel
+from ...model.BatchModel import BatchModel, iterate_folder, get_image_blocks, get_default_num_processes, _compact_rows
+from ...model.util.BatchWriter import read_batch_manifest
+from ...model.util.FrameCountIndex import FrameCountIndex
+from ...model.util.IntegratorCache import geometry_key
+from ...model.util.LazyDataset import LazyDataset
 
 from mock import MagicMock
 
@@ -26,15 +33,23 @@ def configuration():
 
 
 @pytest.fixture()
-def batch_model(configuration):
+def batch_model(configuration, tmp_path, monkeypatch):
     configuration.calibration_model.load(cal_file)
-    batch_model = BatchModel(configuration)
+    batch_model = BatchModel(configuration, os.path.join(tmp_path, "frame_counts.json"))
+    batch_model.num_processes = 1  # the mocked integration is only used in the current process
     batch_model.set_image_files(files)
 
     pattern = Pattern.from_file(os.path.join(data_path, "CeO2_Pilatus1M.xy"))
     configuration.calibration_model.integrate_1d = MagicMock(
         return_value=(pattern.x, pattern.y)
     )
+    # the batch integration uses its own calibration model
+    monkeypatch.setattr(CalibrationModel, "integrate_1d_stack", MagicMock(
+        side_effect=lambda images, **kwargs: (
+            pattern.x,
+            np.tile(pattern.y, (len(images), 1)),
+        )
+    ))
     yield batch_model
 
 
@@ -45,6 +60,27 @@ def test_init_state(batch_model):
     assert batch_model.pos_map_all.shape == (20, 2)
 
 
+def test_set_image_files_uses_frame_count_index(configuration, tmp_path):
+    index_file = os.path.join(tmp_path, "index.json")
+    batch_model = BatchModel(configuration, index_file)
+    configuration.img_model.load = MagicMock()
+    configuration.img_model.get_frame_count = MagicMock(return_value=10)
+
+    batch_model.set_image_files(files)
+    assert configuration.img_model.get_frame_count.call_count == 2
+    configuration.img_model.load.assert_not_called()
+
+    batch_model.set_image_files(files)
+    assert configuration.img_model.get_frame_count.call_count == 2
+    assert np.all(batch_model.file_map == [0, 10, 20])
+    assert batch_model.n_img_all == 20
+    assert FrameCountIndex(index_file).get(files[0]) == 10
+
+
+def test_default_frame_count_file(configuration, frame_count_file):
+    assert BatchModel(configuration).frame_count_index.filename == frame_count_file
+
+
 def test_integrate_raw_data(batch_model):
     start = 2
     stop = 18
@@ -58,6 +94,158 @@ def test_integrate_raw_data(batch_model):
     assert batch_model.pos_map.shape == (8, 2)
 
 
+def test_integrate_raw_data_in_blocks(batch_model, configuration):
+    batch_model.block_size = 3
+    batch_model.integrate_raw_data(start=5, stop=15, step=1, use_all=True)
+
+    block_sizes = [
+        len(call.args[0])
+        for call in configuration.calibration_model.integrate_1d_stack.call_args_list
+    ]
+    assert block_sizes == [3, 2, 3, 2]
+    assert batch_model.n_img == 10
+    assert np.all(batch_model.pos_map[4] == [0, 9])
+    assert np.all(batch_model.pos_map[5] == [1, 0])
+
+
+def test_integrate_raw_data_aborted_by_callback(batch_model):
+    batch_model.block_size = 4
+    batch_model.integrate_raw_data(
+        start=0, stop=20, step=1, use_all=True, callback_fn=lambda n: n < 8
+    )
+    assert batch_model.n_img == 8
+
+
+def test_integration_job_does_not_depend_on_configuration(batch_model, configuration):
+    job = batch_model.prepare_integration(start=0, stop=20, step=1, use_all=True)
+    calibration_model = configuration.calibration_model
+    geometry = job["setup"]["pattern_geometry"]
+    assert geometry is not calibration_model.pattern_geometry
+    assert geometry_key(geometry) == geometry_key(calibration_model.pattern_geometry)
+
+    # a calibration loaded during the integration changes neither the job nor the model
+    dist = geometry.dist
+    calibration_model.load(os.path.join(data_path, "CeO2_Pilatus1M.poni"))
+    result = batch_model.run_integration(job)
+    assert geometry.dist == dist
+    assert batch_model.n_img is None
+    calls = calibration_model.integrate_1d_stack.call_args_list
+    assert sum(len(call.args[0]) for call in calls) == 20
+
+    batch_model.set_integration_result(result)
+    assert batch_model.n_img == 20
+    assert batch_model.used_calibration == cal_file
+
+
+def test_integrate_raw_data_does_not_use_image_model_of_configuration(batch_model, configuration):
+    configuration.img_model.load = MagicMock()
+    configuration.img_model.get_series_images = MagicMock()
+    configuration.img_model.blockSignals = MagicMock()
+    mask_dimension = configuration.mask_model.mask_dimension
+
+    batch_model.integrate_raw_data(start=0, stop=20, step=1, use_all=True)
+    assert batch_model.n_img == 20
+    configuration.img_model.load.assert_not_called()
+    configuration.img_model.get_series_images.assert_not_called()
+    configuration.img_model.blockSignals.assert_not_called()
+    assert configuration.mask_model.mask_dimension == mask_dimension
+
+
+def test_integrate_raw_data_parallel(configuration, tmp_path):
+    configuration.calibration_model.load(cal_file)
+    configuration.integration_rad_points = 500
+    configuration.img_model.load(files[0])
+    configuration.img_model.flip_img_horizontally()
+    configuration.img_model.factor = 2
+
+    serial_model = BatchModel(configuration, os.path.join(tmp_path, "frame_counts.json"))
+    serial_model.num_processes = 1
+    serial_model.set_image_files(files)
+    serial_model.block_size = 4
+    serial_model.integrate_raw_data(start=3, stop=17, step=1, use_all=True)
+
+    parallel_model = BatchModel(configuration, os.path.join(tmp_path, "frame_counts.json"))
+    parallel_model.set_image_files(files)
+    parallel_model.block_size = 4
+    parallel_model.num_processes = 2
+    callback_fn = MagicMock(return_value=True)
+    output_file = os.path.join(tmp_path, "parallel.nxs")
+    parallel_model.integrate_raw_data(
+        start=3,
+        stop=17,
+        step=1,
+        use_all=True,
+        callback_fn=callback_fn,
+        output_file=output_file,
+    )
+
+    assert callback_fn.call_count == 4
+    assert callback_fn.call_args.args[0] == 14
+    assert np.array_equal(parallel_model.pos_map, serial_model.pos_map)
+    assert np.allclose(parallel_model.binning, serial_model.binning)
+    assert np.allclose(parallel_model.data, serial_model.data)
+
+    parallel_model.reset_data()
+    parallel_model.load_proc_data(output_file)
+    assert np.array_equal(parallel_model.pos_map, serial_model.pos_map)
+    assert np.allclose(parallel_model.data, serial_model.data)
+
+
+def test_aborted_parallel_integration_writes_all_finished_patterns(configuration, tmp_path, monkeypatch):
+    configuration.calibration_model.load(cal_file)
+    configuration.integration_rad_points = 500
+
+    serial_model = BatchModel(configuration, os.path.join(tmp_path, "frame_counts.json"))
+    serial_model.num_processes = 1
+    serial_model.set_image_files(files)
+    serial_model.integrate_raw_data(start=3, stop=17, step=1, use_all=True)
+
+    # the blocks finish in reverse order and the integration is aborted after two blocks, so that none of the
+    # finished blocks follows the already written patterns
+    batch_module = sys.modules[BatchModel.__module__]
+    monkeypatch.setattr(batch_module, "as_completed", lambda futures: list(reversed(futures)))
+    parallel_model = BatchModel(configuration, os.path.join(tmp_path, "frame_counts.json"))
+    parallel_model.set_image_files(files)
+    parallel_model.block_size = 4
+    parallel_model.num_processes = 2
+    output_file = os.path.join(tmp_path, "parallel.nxs")
+    parallel_model.integrate_raw_data(
+        start=3, stop=17, step=1, use_all=True, callback_fn=lambda n: n < 7, output_file=output_file
+    )
+    assert np.array_equal(parallel_model.pos_map, serial_model.pos_map[7:])
+    data = np.array(parallel_model.data)
+
+    parallel_model.reset_data()
+    parallel_model.load_proc_data(output_file)
+    assert np.array_equal(parallel_model.pos_map, serial_model.pos_map[7:])
+    assert np.allclose(parallel_model.data, data)
+    num_points = data.shape[1]
+    assert np.allclose(data, serial_model.data[7:, :num_points])
+
+
+def test_default_num_processes(monkeypatch):
+    monkeypatch.setattr(os, "cpu_count", lambda: 4)
+    assert get_default_num_processes() == 3
+    monkeypatch.setattr(os, "cpu_count", lambda: 64)
+    assert get_default_num_processes() == 8
+    monkeypatch.setattr(os, "cpu_count", lambda: None)
+    assert get_default_num_processes() == 1
+
+
+def test_compact_rows():
+    data = np.arange(20, dtype=float).reshape(10, 2)
+    mask = np.array([False, True, True, False, False, True, False, True, True, True])
+    expected = data[mask]
+    assert _compact_rows(data, mask) == 6
+    assert np.array_equal(data[:6], expected)
+
+
+def test_get_image_blocks():
+    pos_map = [(0, 0), (0, 1), (0, 2), (1, 0), (1, 1), (2, 5)]
+    blocks = list(get_image_blocks(pos_map, 2))
+    assert blocks == [(0, [0, 1]), (0, [2]), (1, [0, 1]), (2, [5])]
+
+
 def test_get_image_info(batch_model):
     image = 10
     name, pos = batch_model.get_image_info(image, use_all=True)
@@ -88,6 +276,214 @@ def test_saving_loading(batch_model, tmp_path):
     assert batch_model.pos_map.shape == (8, 2)
 
 
+def test_integrate_raw_data_streaming(batch_model, tmp_path):
+    output_file = os.path.join(tmp_path, "streamed", "test_stream.nxs")
+    batch_model.block_size = 3
+    batch_model.integrate_raw_data(
+        start=2, stop=18, step=1, use_all=True, output_file=output_file
+    )
+    data = batch_model.data
+    binning = batch_model.binning
+
+    with h5py.File(output_file, "r") as f:
+        dataset = f["processed/result/data"]
+        assert dataset.chunks is not None
+        assert dataset.compression == "gzip"
+
+    batch_model.reset_data()
+    batch_model.load_proc_data(output_file)
+    assert batch_model.n_img == 16
+    assert np.array_equal(batch_model.data, data)
+    assert np.array_equal(batch_model.binning, binning)
+    assert np.all(batch_model.pos_map[0] == [0, 2])
+    assert np.all(batch_model.pos_map[-1] == [1, 7])
+    assert batch_model.files.shape == (2,)
+
+
+def test_get_integrated_images(batch_model, tmp_path):
+    output_file = os.path.join(tmp_path, "test_stream.nxs")
+    assert batch_model.get_integrated_images(output_file, 0, 20, 1, use_all=True) is None
+
+    batch_model.block_size = 4
+    batch_model.integrate_raw_data(
+        start=0,
+        stop=20,
+        step=1,
+        use_all=True,
+        callback_fn=lambda n: n < 8,
+        output_file=output_file,
+    )
+
+    done = batch_model.get_integrated_images(output_file, 0, 20, 1, use_all=True)
+    assert done.shape == (20,)
+    assert np.sum(done) == 8
+    assert np.all(batch_model.get_integrated_images(output_file, 0, 8, 2, use_all=True))
+
+    batch_model.configuration.calibration_model.pattern_geometry.dist += 0.01
+    assert batch_model.get_integrated_images(output_file, 0, 20, 1, use_all=True) is None
+
+
+def test_integrate_raw_data_streaming_keeps_aborted_result(batch_model, tmp_path):
+    output_file = os.path.join(tmp_path, "test_stream.nxs")
+    batch_model.block_size = 4
+    batch_model.integrate_raw_data(
+        start=0,
+        stop=20,
+        step=1,
+        use_all=True,
+        callback_fn=lambda n: n < 8,
+        output_file=output_file,
+    )
+
+    batch_model.reset_data()
+    batch_model.load_proc_data(output_file)
+    assert batch_model.n_img == 8
+    assert batch_model.pos_map.shape == (8, 2)
+
+
+def test_integrate_raw_data_streaming_keeps_width_after_error(batch_model, configuration, tmp_path):
+    output_file = os.path.join(tmp_path, "test_stream.nxs")
+    batch_model.block_size = 4
+    batch_model.binning = np.arange(10)  # binning of a previous integration
+    integrate_stack = configuration.calibration_model.integrate_1d_stack
+    integrate_images = integrate_stack.side_effect
+    calls = []
+
+    def integrate_until_error(images, **kwargs):
+        calls.append(len(images))
+        if len(calls) > 2:
+            raise ValueError("integration failed")
+        return integrate_images(images, **kwargs)
+
+    integrate_stack.side_effect = integrate_until_error
+    with pytest.raises(ValueError):
+        batch_model.integrate_raw_data(start=0, stop=20, step=1, use_all=True, output_file=output_file)
+
+    x, intensities = integrate_images(np.zeros((1, 10, 10)))
+    num_points = np.max(np.nonzero(intensities[0])) + 1
+    with h5py.File(output_file, "r") as f:
+        assert f["processed/result/data"].shape == (8, num_points)
+        assert np.array_equal(f["processed/result/binning"][()], x[:num_points])
+
+
+def test_resume_integration(batch_model, configuration, tmp_path):
+    output_file = os.path.join(tmp_path, "test_resume.nxs")
+    batch_model.block_size = 4
+    batch_model.integrate_raw_data(
+        start=0,
+        stop=20,
+        step=1,
+        use_all=True,
+        callback_fn=lambda n: n < 8,
+        output_file=output_file,
+    )
+    integrate_stack = configuration.calibration_model.integrate_1d_stack
+    integrate_stack.reset_mock()
+
+    progress = []
+    batch_model.integrate_raw_data(
+        start=0,
+        stop=20,
+        step=1,
+        use_all=True,
+        callback_fn=lambda n: progress.append(n) or True,
+        output_file=output_file,
+        resume=True,
+    )
+    assert sum(len(call.args[0]) for call in integrate_stack.call_args_list) == 12
+    assert progress[0] == 10
+    assert progress[-1] == 20
+    assert batch_model.n_img == 20
+    assert np.array_equal(batch_model.pos_map, batch_model.pos_map_all)
+    # the previous patterns are not read into memory
+    assert isinstance(batch_model.data, LazyDataset)
+    assert not batch_model.data.in_memory
+
+    batch_model.reset_data()
+    batch_model.set_image_files(files)
+    batch_model.load_proc_data(output_file)
+    assert batch_model.n_img == 20
+    assert np.array_equal(batch_model.pos_map, batch_model.pos_map_all)
+
+    # everything is done, nothing is integrated
+    integrate_stack.reset_mock()
+    batch_model.integrate_raw_data(
+        start=0, stop=20, step=1, use_all=True, output_file=output_file, resume=True
+    )
+    assert integrate_stack.call_count == 0
+    assert batch_model.n_img == 20
+
+
+def test_resume_integration_replaces_patterns_of_changed_files(batch_model, configuration, tmp_path):
+    output_file = os.path.join(tmp_path, "test_resume.nxs")
+    integrate_stack = configuration.calibration_model.integrate_1d_stack
+    x, intensities = integrate_stack.side_effect(np.zeros((1, 1, 1)))
+    batch_model.integrate_raw_data(start=0, stop=20, step=1, use_all=True, output_file=output_file)
+    integrate_stack.reset_mock()
+
+    # the patterns of the second file are integrated again and appended after the first file
+    stat = os.stat(files[1])
+    os.utime(files[1], (stat.st_atime, stat.st_mtime + 10))
+    integrate_stack.side_effect = lambda images, **kwargs: (x, np.tile(intensities[0] * 2, (len(images), 1)))
+    try:
+        batch_model.integrate_raw_data(start=0, stop=20, step=1, use_all=True, output_file=output_file, resume=True)
+    finally:
+        os.utime(files[1], (stat.st_atime, stat.st_mtime))
+    assert sum(len(call.args[0]) for call in integrate_stack.call_args_list) == 10
+
+    with h5py.File(output_file, "r") as f:
+        assert np.array_equal(f["processed/process/pos_map"][()], batch_model.pos_map_all)
+        data = f["processed/result/data"][()]
+    assert data.shape[0] == 20
+    assert np.allclose(data[:10], data[0])
+    assert np.allclose(data[10:], 2 * data[0])
+    assert np.array_equal(batch_model.data, data)
+
+
+def test_resume_integration_with_changed_inputs(batch_model, configuration, tmp_path):
+    output_file = os.path.join(tmp_path, "test_resume.nxs")
+    batch_model.integrate_raw_data(
+        start=0, stop=10, step=1, use_all=True, output_file=output_file
+    )
+    integrate_stack = configuration.calibration_model.integrate_1d_stack
+    integrate_stack.reset_mock()
+
+    configuration.img_model.factor = 2
+    batch_model.integrate_raw_data(
+        start=0, stop=10, step=1, use_all=True, output_file=output_file, resume=True
+    )
+    assert sum(len(call.args[0]) for call in integrate_stack.call_args_list) == 10
+
+
+def test_load_proc_data_lazy(batch_model, tmp_path):
+    filename = os.path.join(tmp_path, "test_lazy.nxs")
+    batch_model.integrate_raw_data(start=0, stop=20, step=1, use_all=True)
+    batch_model.data = batch_model.data * np.arange(20)[:, None]
+    batch_model.bkg = batch_model.data * 0.5
+    data = batch_model.data
+    batch_model.save_proc_data(filename)
+
+    batch_model.reset_data()
+    batch_model.load_proc_data(filename)
+    assert isinstance(batch_model.data, LazyDataset)
+    assert batch_model.data.shape == data.shape
+    assert np.array_equal(batch_model.data[3], data[3])
+
+    window = batch_model.get_data_window(2, 12, 3, 10, 50)
+    assert np.array_equal(window, data[2:12:3, 10:50])
+    window = batch_model.get_data_window(2, 12, 3, 10, 50, subtract_background=True)
+    assert np.allclose(window, data[2:12:3, 10:50] * 0.5)
+
+    # overwriting the opened file reads the data into memory first
+    batch_model.save_proc_data(filename)
+    assert isinstance(batch_model.data, np.ndarray)
+    assert np.array_equal(batch_model.data, data)
+
+    batch_model.load_proc_data(filename, lazy=False)
+    assert isinstance(batch_model.data, np.ndarray)
+    assert np.array_equal(batch_model.bkg, data * 0.5)
+
+
 def test_save_as_csv(batch_model, tmp_path):
     batch_model.integrate_raw_data(start=5, stop=10, step=2, use_all=True)
     batch_model.save_as_csv(os.path.join(tmp_path, "test_save.csv"))
@@ -100,6 +496,27 @@ def test_extract_background(batch_model):
     assert batch_model.bkg.shape[0] == 3
 
 
+def test_extract_background_in_blocks(batch_model, monkeypatch):
+    batch_model.integrate_raw_data(start=0, stop=10, step=1, use_all=True)
+    batch_model.extract_background(parameters=(0.1, 50, 50))
+    expected = batch_model.bkg
+
+    batch_model.bkg_block_size = 3
+    batch_model.extract_background(parameters=(0.1, 50, 50))
+    assert np.allclose(batch_model.bkg, expected)
+
+    monkeypatch.setattr(sys.modules[BatchModel.__module__], "PARALLEL_BACKGROUND_SIZE", 0)
+    batch_model.num_processes = 2
+    batch_model.extract_background(parameters=(0.1, 50, 50))
+    assert np.allclose(batch_model.bkg, expected)
+
+    batch_model.num_processes = 1
+    callback_fn = MagicMock(side_effect=[True, True, False])
+    batch_model.extract_background(parameters=(0.1, 50, 50), callback_fn=callback_fn)
+    assert np.allclose(batch_model.bkg[:6], expected[:6])
+    assert np.all(batch_model.bkg[6:] == 0)
+
+
 def test_normalize(batch_model):
     batch_model.reset_data()
     batch_model.data = np.ones((3, 80))
@@ -110,6 +527,19 @@ def test_normalize(batch_model):
     assert pytest.approx(0) == np.sum(np.diff(batch_model.data[:, 1]))
 
 
+def test_normalized_data_is_saved_without_manifest(batch_model, tmp_path):
+    output_file = os.path.join(tmp_path, "test_stream.nxs")
+    batch_model.integrate_raw_data(start=0, stop=10, step=1, use_all=True, output_file=output_file)
+    batch_model.normalize()
+    batch_model.save_proc_data(output_file)
+    assert read_batch_manifest(output_file) is None
+
+    integrate_stack = batch_model.configuration.calibration_model.integrate_1d_stack
+    integrate_stack.reset_mock()
+    batch_model.integrate_raw_data(start=0, stop=10, step=1, use_all=True, output_file=output_file, resume=True)
+    assert sum(len(call.args[0]) for call in integrate_stack.call_args_list) == 10
+
+
 def test_iterate_folder():
     assert iterate_folder("r001", 1) == "r002"
     assert iterate_folder("r009", 1) == "r010"
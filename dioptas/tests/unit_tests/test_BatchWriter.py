@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+# Dioptas - GUI program for fast processing of 2D X-ray diffraction data
+# Principal author: Clemens Prescher (clemens.prescher@gmail.com)
+# Copyright (C) 2014-2019 GSECARS, University of Chicago, USA
+# Copyright (C) 2015-2018 Institute for Geology and Mineralogy, University of Cologne, Germany
+# Copyright (C) 2019-2020 DESY, Hamburg, Germany
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+
+import h5py
+import numpy as np
+
+from ...model.util.BatchWriter import BatchResultWriter, read_batch_manifest
+
+
+def create_manifest(num_frames):
+    return {
+        "digest": "digest",
+        "pos_map": np.array([(0, pos) for pos in range(num_frames)]),
+        "file_stats": np.array([(1.0, 2.0)]),
+    }
+
+
+def test_patterns_are_sorted_into_a_new_file(tmp_path):
+    filename = os.path.join(tmp_path, "sorted.nxs")
+    manifest = create_manifest(1000)
+    intensities = np.random.RandomState(0).random_sample((1000, 1000))
+    binning = np.arange(1000)
+
+    with BatchResultWriter(filename, compression=None, manifest=manifest) as writer:
+        writer.open(["image.h5"], [0, 1000])
+        for start in reversed(range(0, 1000, 100)):
+            writer.append(binning, intensities[start:start + 100], manifest["pos_map"][start:start + 100])
+        # a changed frame is appended again and replaces the first pattern
+        writer.append(binning, 2 * intensities[:1], manifest["pos_map"][:1])
+
+    with h5py.File(filename, "r") as f:
+        assert np.array_equal(f["processed/process/pos_map"][()], manifest["pos_map"])
+        assert np.array_equal(f["processed/result/data"][1:], intensities[1:])
+        assert np.array_equal(f["processed/result/data"][0], 2 * intensities[0])
+        assert np.array_equal(f["processed/result/binning"][()], binning)
+    assert np.all(read_batch_manifest(filename)["done"])
+    # the unsorted patterns do not remain in the file
+    assert os.path.getsize(filename) < 1.2 * intensities.nbytes
+    assert not os.path.exists(filename + ".sorting")
+
+
+def test_patterns_in_order_are_not_copied(tmp_path):
+    filename = os.path.join(tmp_path, "in_order.nxs")
+    manifest = create_manifest(10)
+    with BatchResultWriter(filename, manifest=manifest) as writer:
+        writer.open(["image.h5"], [0, 10])
+        writer.append(np.arange(5), np.ones((4, 5)), manifest["pos_map"][:4])
+        writer._write_sorted_file = None  # fails if the patterns are copied
+
+    with h5py.File(filename, "r") as f:
+        assert f["processed/result/data"].shape == (4, 5)
+        assert np.array_equal(f["processed/process/pos_map"][()], manifest["pos_map"][:4])
@@ -112,6 +112,22 @@ def test_get_pixel_ind(calibration_model):
         assert ind2 == pytest.approx(result_ind2, abs=1e-3)
 
 
+def test_pixel_geometry_is_shared_and_updated_with_calibration(calibration_model):
+    load_small_image_with_calibration(calibration_model, shape=(30, 40))
+
+    tth_array = calibration_model.get_pixel_geometry("tth")
+    assert tth_array.dtype == np.float32
+    assert calibration_model.get_pixel_geometry("tth") is tth_array
+    assert np.allclose(tth_array, calibration_model.pattern_geometry.twoThetaArray((30, 40)))
+    assert np.shares_memory(calibration_model.get_two_theta_array(), tth_array)
+
+    calibration_model.pattern_geometry.dist *= 2
+    calibration_model.pattern_geometry.reset()
+    new_tth_array = calibration_model.get_pixel_geometry("tth")
+    assert new_tth_array is not tth_array
+    assert np.allclose(new_tth_array, calibration_model.pattern_geometry.twoThetaArray((30, 40)))
+
+
 def test_use_different_image_sizes_for_1d_integration(calibration_model, img_model):
     load_small_image_with_calibration(calibration_model, shape=(10, 10))
     calibration_model.integrate_1d()
@@ -126,6 +142,101 @@ def test_use_different_image_sizes_for_2d_integration(calibration_model):
     calibration_model.integrate_2d()
 
 
+def test_engine_cache_reuses_engines_for_previous_integration_setup(calibration_model):
+    load_small_image_with_calibration(calibration_model, shape=(30, 30))
+    mask = np.zeros((30, 30), dtype=bool)
+    mask[:5] = True
+
+    x1, y1 = calibration_model.integrate_1d(num_points=50)
+    calibration_model.integrate_1d(num_points=50, mask=mask)
+    calibration_model.integrate_1d(num_points=50, unit="q_A^-1")
+    assert calibration_model.engine_cache.misses == 3
+    assert calibration_model.engine_cache.hits == 0
+
+    x2, y2 = calibration_model.integrate_1d(num_points=50)
+    calibration_model.integrate_1d(num_points=50, mask=mask)
+    assert calibration_model.engine_cache.misses == 3
+    assert calibration_model.engine_cache.hits == 2
+
+    assert np.array_equal(x1, x2)
+    assert np.array_equal(y1, y2)
+    assert calibration_model.get_engine_cache_info()["size"] == 3
+
+
+def test_engine_cache_is_bounded_and_cleared_on_detector_change(calibration_model):
+    load_small_image_with_calibration(calibration_model, shape=(30, 30))
+    calibration_model.engine_cache.max_size = 2
+    for num_points in [20, 30, 40]:
+        calibration_model.integrate_1d(num_points=num_points)
+    assert len(calibration_model.engine_cache) == 2
+
+    calibration_model.integrate_1d(num_points=20)
+    assert calibration_model.engine_cache.misses == 4
+
+    calibration_model.load_detector("Pilatus 1M")
+    assert len(calibration_model.engine_cache) == 0
+
+
+def test_engine_cache_distinguishes_geometries(calibration_model):
+    load_small_image_with_calibration(calibration_model, shape=(30, 30))
+    _, y1 = calibration_model.integrate_1d(num_points=50)
+
+    pyFAI_parameter, _ = calibration_model.get_calibration_parameter()
+    pyFAI_parameter["dist"] *= 1.1
+    calibration_model.set_pyFAI(pyFAI_parameter)
+    _, y2 = calibration_model.integrate_1d(num_points=50)
+    assert calibration_model.engine_cache.misses == 2
+
+    calibration_model.integrate_2d(rad_points=50)
+    calibration_model.integrate_2d(rad_points=50)
+    assert calibration_model.engine_cache.misses == 3
+    assert calibration_model.engine_cache.hits == 1
+
+
+def test_integrate_1d_stack(calibration_model, img_model):
+    load_pilatus_1M_with_calibration(calibration_model)
+    mask = np.zeros(img_model.img_data.shape, dtype=bool)
+    mask[:100] = True
+    images = np.array([img_model.img_data, img_model.img_data * 2, img_model.img_data + 10])
+
+    x, intensities = calibration_model.integrate_1d_stack(images, num_points=1000, mask=mask)
+    assert intensities.shape == (3, 1000)
+
+    for image, y_stack in zip(images, intensities):
+        img_model._img_data = image
+        x_single, y_single = calibration_model.integrate_1d(num_points=1000, mask=mask, trim_zeros=False)
+        assert np.allclose(x, x_single)
+        assert np.allclose(y_stack, y_single, rtol=1e-4, atol=1e-3)
+
+
+@pytest.mark.parametrize("method", ["csr", "bbox", "lut"])
+def test_integrate_read_only_float32_image(calibration_model, img_model, method):
+    load_small_image_with_calibration(calibration_model, shape=(30, 30))
+    img_model._img_data = np.ones((30, 30), dtype=np.float32)
+    assert img_model.img_data.dtype == np.float32
+    assert not img_model.img_data.flags.writeable
+
+    _, y = calibration_model.integrate_1d(num_points=20, method=method)
+    assert np.all(np.isfinite(y))
+    calibration_model.integrate_2d(rad_points=20, azimuth_points=36)
+
+    frames = np.ones((2, 30, 30), dtype=np.float32)
+    frames.flags.writeable = False
+    _, intensities = calibration_model.integrate_1d_stack(frames, num_points=20, method=method)
+    assert intensities.shape == (2, 20)
+
+
+def test_integrate_1d_stack_with_supersampling_and_d_spacing(calibration_model, img_model):
+    load_small_image_with_calibration(calibration_model, shape=(30, 30))
+    calibration_model.set_supersampling(2)
+    x, intensities = calibration_model.integrate_1d_stack(
+        np.array([img_model.img_data] * 2), num_points=50, unit="d_A"
+    )
+    x_single, y_single = calibration_model.integrate_1d(num_points=50, unit="d_A", trim_zeros=False)
+    assert np.allclose(x, x_single)
+    assert np.allclose(intensities[1], y_single, rtol=1e-4)
+
+
 def test_correct_solid_angle(calibration_model, img_model):
     load_small_image_with_calibration(calibration_model, shape=(10, 10))
     _, y1 = calibration_model.integrate_1d()
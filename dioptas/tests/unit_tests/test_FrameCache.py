@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+# Dioptas - GUI program for fast processing of 2D X-ray diffraction data
+# Principal author: Clemens Prescher (clemens.prescher@gmail.com)
+# Copyright (C) 2014-2019 GSECARS, University of Chicago, USA
+# Copyright (C) 2015-2018 Institute for Geology and Mineralogy, University of Cologne, Germany
+# Copyright (C) 2019-2020 DESY, Hamburg, Germany
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import numpy as np
+import pytest
+from mock import MagicMock
+
+from ...model.util.FrameCache import FrameCache
+
+
+def test_frames_are_cached_read_only():
+    cache = FrameCache()
+    load = MagicMock(side_effect=lambda ind: np.full((10, 10), ind))
+
+    frame = cache.get_or_load(("file", None, 1), load, 1)
+    assert np.all(frame == 1)
+    assert cache.get_or_load(("file", None, 1), load, 1) is frame
+    assert load.call_count == 1
+    with pytest.raises(ValueError):
+        frame[0, 0] = 5
+
+    statistics = cache.get_statistics()
+    assert statistics["frames"] == 1
+    assert statistics["nbytes"] == frame.nbytes
+    assert statistics["hits"] == 1
+    assert statistics["misses"] == 1
+    assert cache.hit_rate == 0.5
+
+
+def test_least_recently_used_frames_are_removed():
+    cache = FrameCache(max_bytes=250)  # 3 frames of 80 bytes
+    for ind in range(3):
+        cache.put(("file", None, ind), np.zeros(10))
+    cache.get(("file", None, 0))
+    cache.put(("file", None, 3), np.zeros(10))
+
+    assert ("file", None, 0) in cache
+    assert ("file", None, 1) not in cache
+    assert len(cache) == 3
+    assert cache.nbytes == 240
+
+    cache.put(("file", None, 4), np.zeros(100))  # larger than the budget, not cached
+    assert ("file", None, 4) not in cache
+
+    cache.clear()
+    assert len(cache) == 0
+    assert cache.nbytes == 0
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+# Dioptas - GUI program for fast processing of 2D X-ray diffraction data
+# Principal author: Clemens Prescher (clemens.prescher@gmail.com)
+# Copyright (C) 2014-2019 GSECARS, University of Chicago, USA
+# Copyright (C) 2015-2018 Institute for Geology and Mineralogy, University of Cologne, Germany
+# Copyright (C) 2019-2020 DESY, Hamburg, Germany
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+
+from mock import MagicMock
+
+from ...model.util.FrameCountIndex import FrameCountIndex
+
+
+def create_files(tmp_path, num_files):
+    files = []
+    for ind in range(num_files):
+        filename = os.path.join(tmp_path, "file_{}.dat".format(ind))
+        with open(filename, "w") as f:
+            f.write("x" * ind)
+        files.append(filename)
+    return files
+
+
+def test_counts_only_unknown_files(tmp_path):
+    files = create_files(tmp_path, 5)
+    count_fn = MagicMock(side_effect=lambda filename: int(filename[-5]) + 1)
+    index = FrameCountIndex(os.path.join(tmp_path, "index.json"))
+
+    assert index.get_frame_counts(files[:3], count_fn) == [1, 2, 3]
+    assert count_fn.call_count == 3
+    assert index.get_frame_counts(files, count_fn) == [1, 2, 3, 4, 5]
+    assert count_fn.call_count == 5
+
+
+def test_index_is_stored_on_disk(tmp_path):
+    files = create_files(tmp_path, 3)
+    index_file = os.path.join(tmp_path, "index", "index.json")
+    FrameCountIndex(index_file).get_frame_counts(files, lambda filename: 7)
+
+    count_fn = MagicMock(return_value=3)
+    index = FrameCountIndex(index_file)
+    assert len(index) == 3
+    assert index.get_frame_counts(files, count_fn) == [7, 7, 7]
+    count_fn.assert_not_called()
+
+
+def test_changed_files_are_counted_again(tmp_path):
+    files = create_files(tmp_path, 2)
+    index = FrameCountIndex()
+    index.get_frame_counts(files, lambda filename: 1)
+
+    with open(files[1], "a") as f:
+        f.write("more data")
+    assert index.get(files[0]) == 1
+    assert index.get(files[1]) is None
+    assert index.get_frame_counts(files, lambda filename: 2) == [1, 2]
+
+
+def test_index_is_bounded(tmp_path):
+    files = create_files(tmp_path, 5)
+    index = FrameCountIndex(max_entries=3)
+    index.get_frame_counts(files, lambda filename: 1)
+    assert len(index) == 3
+    assert index.get(files[0]) is None
+    assert index.get(files[4]) == 1
+
+
+def test_corrupt_index_file_is_ignored(tmp_path):
+    index_file = os.path.join(tmp_path, "index.json")
+    with open(index_file, "w") as f:
+        f.write("{not json")
+    index = FrameCountIndex(index_file)
+    assert len(index) == 0
@@ -21,7 +21,8 @@
 import os
 import numpy as np
 
-from ...model.util.HelperModule import get_partial_index, FileNameIterator, get_partial_value
+from ...model.util.HelperModule import get_partial_index, FileNameIterator, get_partial_value, read_series_images, \
+    compose_transformations, rotate_matrix_p90, rotate_matrix_m90
 
 unittest_path = os.path.dirname(__file__)
 data_path = os.path.join(unittest_path, '../data', 'FileIterator')
@@ -102,3 +103,40 @@ def test_get_previous_folder_mec():
     file_iterator = FileNameIterator()
     new_filename = file_iterator.get_previous_folder(filename, mec_mode=True)
     assert new_filename == os.path.join(data_path, 'run1', "run_1_evt_2.0.txt")
+
+
+def test_read_series_images_reads_consecutive_positions_as_blocks():
+    series = np.arange(10)[:, np.newaxis, np.newaxis] * np.ones((10, 2, 3))
+    blocks = []
+
+    def get_images(start, stop):
+        blocks.append((start, stop))
+        return series[start:stop]
+
+    images = read_series_images([2, 3, 4, 7, 8, 1], lambda pos: series[pos], get_images)
+    assert blocks == [(2, 5), (7, 9), (1, 2)]
+    assert np.array_equal(np.array(images), series[[2, 3, 4, 7, 8, 1]])
+    assert np.array_equal(np.array(read_series_images([5, 6], lambda pos: series[pos])), series[5:7])
+
+
+def test_compose_transformations():
+    img_data = np.arange(20).reshape(4, 5)
+    transformations = [rotate_matrix_p90, np.fliplr, rotate_matrix_p90, np.flipud, rotate_matrix_m90]
+    expected = img_data
+    for transformation in transformations:
+        expected = transformation(expected)
+
+    transformed = compose_transformations(transformations)(img_data)
+    assert np.array_equal(transformed, expected)
+    assert np.shares_memory(transformed, img_data)
+    assert np.array_equal(compose_transformations(transformations, inverse=True)(transformed), img_data)
+
+    # stacks of images are transformed image by image
+    stack = np.array([img_data, 2 * img_data])
+    assert np.array_equal(compose_transformations(transformations)(stack), np.array([expected, 2 * expected]))
+
+
+def test_compose_transformations_with_other_functions():
+    img_data = np.arange(20).reshape(4, 5)
+    transformations = [np.fliplr, lambda data: data + 1]
+    assert np.array_equal(compose_transformations(transformations)(img_data), np.fliplr(img_data) + 1)
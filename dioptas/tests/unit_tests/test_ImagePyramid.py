@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+# Dioptas - GUI program for fast processing of 2D X-ray diffraction data
+# Principal author: Clemens Prescher (clemens.prescher@gmail.com)
+# Copyright (C) 2014-2019 GSECARS, University of Chicago, USA
+# Copyright (C) 2015-2018 Institute for Geology and Mineralogy, University of Cologne, Germany
+# Copyright (C) 2019-2020 DESY, Hamburg, Germany
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import numpy as np
+import pytest
+
+from ...model.util.ImagePyramid import ImagePyramid
+
+
+def create_pyramid(data, **kwargs):
+    source = lambda start, stop: data[start:stop]
+    return ImagePyramid(source, data.shape, **kwargs)
+
+
+def reduce(data, row_factor, column_factor, fn):
+    rows = range(0, data.shape[0], row_factor)
+    columns = range(0, data.shape[1], column_factor)
+    return np.array([[fn(data[r:r + row_factor, c:c + column_factor]) for c in columns] for r in rows])
+
+
+@pytest.fixture
+def data():
+    return np.random.RandomState(0).random_sample((101, 37)).astype(np.float32)
+
+
+def test_levels_are_equal_to_block_statistics(data):
+    pyramid = create_pyramid(data, block_rows=16)
+    assert pyramid.num_levels == (8, 7)
+
+    for level in [(1, 0), (0, 2), (3, 1), (2, 3), (6, 5), (7, 6)]:
+        row_factor, column_factor = 2 ** level[0], 2 ** level[1]
+        for mode, fn in [("min", np.min), ("max", np.max), ("mean", np.mean)]:
+            level_data, window = pyramid.get_window(level, mode=mode)
+            assert level_data.shape == pyramid.level_shape(level)
+            assert window == (0, 101, 0, 37)
+            assert np.allclose(level_data, reduce(data, row_factor, column_factor, fn), rtol=1e-5)
+
+
+def test_levels_are_computed_from_finer_levels(data):
+    calls = []
+
+    def source(start, stop):
+        calls.append((start, stop))
+        return data[start:stop]
+
+    pyramid = ImagePyramid(source, data.shape)
+    pyramid.get_window((1, 1))
+    assert calls == [(0, 101)]
+
+    mean, _ = pyramid.get_window((4, 3), mode="mean")
+    assert calls == [(0, 101)]
+    assert np.allclose(mean, reduce(data, 16, 8, np.mean), rtol=1e-5)
+    assert (4, 3) in pyramid._levels
+
+
+def test_level_cache_is_limited(data):
+    pyramid = create_pyramid(data, max_bytes=3 * 4 * 51 * 37)
+    pyramid.get_window((1, 0))
+    pyramid.get_window((2, 0))
+    assert list(pyramid._levels.keys()) == [(2, 0)]
+    assert pyramid.nbytes <= pyramid.max_bytes
+
+
+def test_get_window_and_level(data):
+    pyramid = create_pyramid(data)
+    level_data, window = pyramid.get_window((2, 1), (10, 30), (5, 20))
+    assert window == (8, 32, 4, 20)
+    assert np.allclose(level_data, reduce(data, 4, 2, np.max)[2:8, 2:10])
+
+    level_data, window = pyramid.get_window((0, 0), (10, 30), (5, 20))
+    assert window == (10, 30, 5, 20)
+    assert np.array_equal(level_data, data[10:30, 5:20])
+
+    assert pyramid.get_level(1, 1) == (0, 0)
+    assert pyramid.get_level(5.3, 2) == (2, 1)
+    assert pyramid.get_level(1000, 0.5) == (7, 0)
+
+    with pytest.raises(ValueError):
+        pyramid.get_window((1, 1), mode="median")
+
+
+def test_update_appended_and_changed_rows(data):
+    rows = {"n": 60}
+    pyramid = ImagePyramid(lambda start, stop: data[:rows["n"]][start:stop], (60, 37))
+    pyramid.get_window((1, 1))
+    pyramid.get_window((3, 2))
+
+    rows["n"] = 101
+    pyramid.update(60, shape=(101, 37))
+    for level in [(1, 1), (3, 2)]:
+        level_data, _ = pyramid.get_window(level, mode="mean")
+        assert np.allclose(level_data, reduce(data, 2 ** level[0], 2 ** level[1], np.mean), rtol=1e-5)
+
+    data[20:22] = 10
+    pyramid.update(20, 22)
+    level_data, _ = pyramid.get_window((3, 2))
+    assert np.allclose(level_data, reduce(data, 8, 4, np.max))
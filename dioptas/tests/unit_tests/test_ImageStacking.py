@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+# Dioptas - GUI program for fast processing of 2D X-ray diffraction data
+# Principal author: Clemens Prescher (clemens.prescher@gmail.com)
+# Copyright (C) 2014-2019 GSECARS, University of Chicago, USA
+# Copyright (C) 2015-2018 Institute for Geology and Mineralogy, University of Cologne, Germany
+# Copyright (C) 2019-2020 DESY, Hamburg, Germany
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import numpy as np
+import pytest
+
+from ...model.util import ImageStacking
+from ...model.util.ImageStacking import StackReducer, reduce_image_files
+
+
+@pytest.fixture
+def images():
+    images = np.random.RandomState(0).poisson(100, (20, 30, 40)).astype(np.uint16)
+    images[5, 10, 10] = 60000  # zinger
+    return images
+
+
+def reduce(images, mode, **kwargs):
+    reducer = StackReducer(mode, **kwargs)
+    for img_data in images:
+        assert reducer.add(img_data)
+    return reducer.get_result()
+
+
+def test_sum_and_mean(images):
+    result = reduce(images, 'sum')
+    assert result.dtype == np.int64
+    assert np.array_equal(result, np.sum(images, axis=0, dtype=np.int64))
+    assert np.allclose(reduce(images, 'mean'), np.mean(images, axis=0))
+
+
+def test_median(images):
+    result = reduce(images, 'median')
+    assert np.allclose(result, np.median(images, axis=0))
+    assert result[10, 10] < 200
+
+
+def test_sigma_clip_rejects_zingers(images):
+    result = reduce(images, 'sigma_clip', sigma=3)
+    assert abs(result[10, 10] - np.mean(np.delete(images[:, 10, 10], 5))) < 1e-6
+    result[10, 10] = np.mean(images[:, 10, 10])
+    assert np.allclose(result, np.mean(images, axis=0), atol=10)
+
+
+def test_mad_clip_rejects_zingers(images):
+    reducer = StackReducer('mad_clip', sigma=5)
+    reducer.add_images(images)
+    result = reducer.get_result()
+    assert abs(result[10, 10] - np.mean(np.delete(images[:, 10, 10], 5))) < 20
+    assert reducer.num_rejected >= 1
+    assert reducer.num_rejected < 0.02 * images.size
+
+
+@pytest.mark.parametrize('mode', ['sigma_clip', 'mad_clip'])
+def test_zingers_are_rejected_in_any_frame(mode):
+    images = np.random.RandomState(0).poisson(100, (17, 30, 40)).astype(np.uint16)
+    for frame in [0, 16]:
+        zinger_images = images.copy()
+        zinger_images[frame, 10, 10] = 60000
+        result = reduce(zinger_images, mode)
+        assert abs(result[10, 10] - np.mean(np.delete(images[:, 10, 10], frame))) < 20
+
+
+@pytest.mark.parametrize('mode', ['median', 'sigma_clip', 'mad_clip'])
+def test_large_stacks_are_reduced_in_tiles_from_a_temporary_file(images, mode, monkeypatch):
+    expected = reduce(images, mode)
+    monkeypatch.setattr(ImageStacking, 'TILE_SIZE', 7 * len(images) * images.shape[2])
+    monkeypatch.setattr(ImageStacking, 'SPOOL_SIZE', 5 * images[0].nbytes)
+    reducer = StackReducer(mode)
+    reducer.add_images(images)
+    assert reducer._spool is not None
+    assert np.array_equal(reducer.get_result(), expected)
+
+
+@pytest.mark.parametrize('dtype, poisson_noise', [(np.uint16, None), (np.float32, True), (np.float64, True)])
+def test_mad_clip_keeps_low_counts(dtype, poisson_noise):
+    images = np.zeros((10, 4, 5), dtype=dtype)
+    images[:3] = 1
+    images[4, 2, 2] = 1000
+    reducer = StackReducer('mad_clip', poisson_noise=poisson_noise)
+    reducer.add_images(images)
+    result = reducer.get_result()
+    assert reducer.num_rejected == 1
+    assert result[2, 2] == pytest.approx(1 / 3)
+    result[2, 2] = 0.3
+    assert np.allclose(result, 0.3)
+
+
+@pytest.mark.parametrize('dtype, poisson_noise', [(np.int32, None), (np.float32, True)])
+def test_mad_clip_keeps_poisson_noise(dtype, poisson_noise):
+    images = np.random.RandomState(0).poisson(0.5, (16, 100, 100)).astype(dtype)
+    reducer = StackReducer('mad_clip', poisson_noise=poisson_noise)
+    reducer.add_images(images)
+    assert np.mean(reducer.get_result()) == pytest.approx(np.mean(images), rel=0.02)
+    assert reducer.num_rejected < 0.005 * images.size
+
+
+def test_mad_clip_rejects_zingers_of_normalized_images():
+    images = np.random.RandomState(0).normal(0.05, 0.002, (16, 30, 40)).astype(np.float32)
+    images[5, 10, 10] = 0.5  # zinger
+    reducer = StackReducer('mad_clip')
+    reducer.add_images(images)
+    result = reducer.get_result()
+    assert result[10, 10] == pytest.approx(np.mean(np.delete(images[:, 10, 10], 5)), abs=0.002)
+    assert reducer.num_rejected >= 1
+    assert reducer.num_rejected < 0.03 * images.size
+
+
+@pytest.mark.parametrize('mode', ['median', 'sigma_clip', 'mad_clip'])
+def test_large_integers_keep_their_precision(mode):
+    images = np.full((5, 3, 4), 2 ** 25 + 1, dtype=np.int64)
+    assert np.all(reduce(images, mode) == 2 ** 25 + 1)
+
+
+def test_images_with_different_shape_are_skipped(images):
+    reducer = StackReducer('mean')
+    assert reducer.get_result() is None
+    reducer.add(images[0])
+    assert not reducer.add(np.ones((3, 4)))
+    assert reducer.num_skipped == 1
+    assert np.array_equal(reducer.get_result(), images[0])
+
+
+def test_reduce_image_files(images):
+    reducer = reduce_image_files(range(len(images)), lambda ind: images[ind], StackReducer('sum'), num_workers=2)
+    assert reducer.num_images == 20
+    assert np.array_equal(reducer.get_result(), np.sum(images, axis=0))
+
+    with pytest.raises(ValueError):
+        StackReducer('max')
@@ -105,6 +105,34 @@ def test_delete_corrections_with_names(corrections):
     assert np.mean(corrections.get_data()) == 5
 
 
+def test_combined_corrections_are_cached(corrections):
+    cor1 = DummyCorrection((20, 30), 2)
+    cor2 = DummyCorrection((20, 30), 3)
+    corrections.add(cor1)
+    corrections.add(cor2, "cor2")
+
+    data = corrections.get_data()
+    assert data.dtype == np.float32
+    assert not data.flags.writeable
+    assert np.all(data == 6)
+    assert corrections.get_data() is data
+
+    # replacing the data of a correction, e.g. by updating its parameters, invalidates the cache
+    cor1._data = np.ones((20, 30)) * 5
+    assert np.all(corrections.get_data() == 15)
+
+    data = corrections.get_data()
+    corrections.delete("cor2")
+    assert corrections.get_data() is not data
+    assert np.all(corrections.get_data() == 5)
+
+    data = corrections.get_data()
+    cor1._data *= 2
+    assert corrections.get_data() is data
+    corrections.update()
+    assert np.all(corrections.get_data() == 10)
+
+
 class CbnCorrectionTest(unittest.TestCase):
     def setUp(self):
         # defining geometry
@@ -152,6 +180,43 @@ class CbnCorrectionTest(unittest.TestCase):
         self.assertGreater(np.sum(cbn_correction_data), 0)
         self.assertEqual(cbn_correction_data.shape, self.dummy_img.shape)
 
+    def test_diamond_and_seat_absorption_without_tilt(self):
+        tth_array = np.rad2deg(self.tth_array)
+        cbn_correction = CbnCorrection(tth_array, np.rad2deg(self.azi_array),
+                                       diamond_thickness=2.2, seat_thickness=5.3,
+                                       small_cbn_seat_radius=0.4, large_cbn_seat_radius=1.95,
+                                       diamond_abs_length=13.7, cbn_abs_length=14.05)
+        cbn_correction.update()
+        cbn_correction_data = cbn_correction.get_data()
+        self.assertEqual(cbn_correction_data.dtype, np.float32)
+
+        cos_tth = np.cos(self.tth_array)
+        abs_diamond = np.exp(-2.2 / cos_tth / 13.7)
+        inside_seat = self.tth_array < np.arctan(0.4 / 2.2)
+        outside_seat = self.tth_array >= np.arctan(1.95 / (2.2 + 5.3))
+        self.assertTrue(np.any(inside_seat) and np.any(outside_seat))
+        np.testing.assert_allclose(cbn_correction_data[inside_seat], abs_diamond[inside_seat], rtol=1e-5)
+        np.testing.assert_allclose(cbn_correction_data[outside_seat],
+                                   abs_diamond[outside_seat] * np.exp(-5.3 / cos_tth[outside_seat] / 14.05),
+                                   rtol=1e-5)
+
+        # the seat absorption is continuous at the edges of the cone
+        self.assertLess(np.max(cbn_correction_data[~inside_seat]), np.max(cbn_correction_data[inside_seat]) + 1e-5)
+
+    def test_results_are_cached_per_parameters(self):
+        tth_array = np.rad2deg(self.tth_array)
+        azi_array = np.rad2deg(self.azi_array)
+        cbn_correction1 = CbnCorrection(tth_array, azi_array, diamond_thickness=2.2, tilt=3)
+        cbn_correction1.update()
+        cbn_correction2 = CbnCorrection(tth_array, azi_array, diamond_thickness=2.5, tilt=3)
+        cbn_correction2.update()
+        cbn_correction3 = CbnCorrection(tth_array, azi_array, diamond_thickness=2.2, tilt=3)
+        cbn_correction3.update()
+
+        self.assertIs(cbn_correction1.get_data(), cbn_correction3.get_data())
+        self.assertFalse(np.array_equal(cbn_correction1.get_data(), cbn_correction2.get_data()))
+        self.assertFalse(cbn_correction1.get_data().flags.writeable)
+
 
 from ...model.CalibrationModel import CalibrationModel
 from ...model.ImgModel import ImgModel
@@ -22,7 +22,9 @@ import pytest
 from mock import MagicMock
 import os
 
+import h5py
 import numpy as np
+from PIL import Image
 
 from ...model.ImgModel import ImgModel, BackgroundDimensionWrongException
 from ...model.util.ImgCorrection import DummyCorrection
@@ -43,6 +45,26 @@ def test_load_karabo_nexus_file(img_model):
     img_model.load(os.path.join(data_path, 'karabo_epix.h5'))
 
 
+def test_loading_karabo_images_in_blocks(tmp_path):
+    pytest.importorskip('extra_data')
+    mkfile = pytest.importorskip('extra_data.tests.mockdata.mkfile')
+    from extra_data.tests.mockdata.basler_camera import BaslerCamera
+
+    filename = os.path.join(str(tmp_path), 'karabo.h5')
+    mkfile.write_file(filename, [BaslerCamera('SPB_TEST/CAM/1', sensor_size=(8, 10))], ntrains=20, chunksize=5)
+    with h5py.File(filename, 'a') as f:
+        dataset = f['INSTRUMENT/SPB_TEST/CAM/1:daqOutput/data/image/pixels']
+        dataset[...] = np.arange(dataset.size).reshape(dataset.shape)
+        images = dataset[...]
+
+    img_model = ImgModel()
+    img_model.load(filename)
+    assert img_model.series_max == 20
+    assert np.array_equal(img_model.series_get_image(7), images[7])
+    assert np.array_equal(img_model.series_get_images(3, 12), images[3:12])
+    assert np.array_equal(img_model.get_series_images([1, 2, 3, 15]), images[[1, 2, 3, 15]])
+
+
 def perform_transformations_tests(img_model):
     assert np.sum(np.absolute(img_model.img_data)) == 0
     img_model.rotate_img_m90()
@@ -156,6 +178,34 @@ def test_absorption_correction_with_different_image_sizes(img_model):
     assert not img_model.has_corrections()
 
 
+def test_img_data_is_cached_until_inputs_change():
+    img_model = ImgModel()
+    img_model._img_data = np.arange(12.).reshape(3, 4)
+    img_data = img_model.img_data
+    version = img_model.img_data_version
+    assert img_model.img_data is img_data
+    assert not img_data.flags.writeable
+    assert np.array_equal(img_data, img_model.raw_img_data)
+
+    img_model.factor = 2
+    assert img_model.img_data_version > version
+    assert np.array_equal(img_model.img_data, 2 * img_model.raw_img_data)
+
+    img_model.background_data = np.ones((3, 4))
+    img_model.background_offset = 1
+    assert np.array_equal(img_model.img_data, 2 * (img_model.raw_img_data - 2))
+
+    version = img_model.img_data_version
+    img_model.add_img_correction(DummyCorrection((3, 4), 0.5))
+    assert img_model.img_data_version > version
+    assert np.array_equal(img_model.img_data, 4 * (img_model.raw_img_data - 2))
+    assert img_model.img_data.dtype == np.float64
+
+    img_model.img_data_dtype = np.float32
+    assert img_model.img_data.dtype == np.float32
+    assert np.allclose(img_model.img_data, 4 * (img_model.raw_img_data - 2))
+
+
 def test_adding_several_absorption_corrections(img_model):
     original_image = np.copy(img_model.img_data)
     img_shape = original_image.shape
@@ -270,6 +320,9 @@ def test_loading_ESRF_hdf5_file(img_model):
     img_model.load(os.path.join(data_path, 'hdf5_dataset', 'ma4500_demoh5.h5'))
     assert img_model.img_data.shape == (2048, 2048)
 
+    assert img_model.find_all_sources() == img_model.sources
+    assert len(img_model.sources) == 4
+
     img1 = img_model.img_data
     img_model.select_source(img_model.sources[2])
     img2 = img_model.img_data
@@ -289,3 +342,317 @@ def test_summing_rotated(img_model):
     data1 = np.copy(img_model._img_data).astype(np.uint32)
     img_model.add(os.path.join(data_path, 'image_001.tif'))
     assert np.array_equal(2 * data1, img_model._img_data)
+
+
+def test_get_series_images_applies_transformations_and_corrections():
+    img_model = ImgModel()
+    img_model.load(os.path.join(data_path, 'lambda', 'testasapo1_1009_00002_m1_part00000.nxs'))
+    img_model.rotate_img_m90()
+    img_model.add_img_correction(DummyCorrection(img_model.img_data.shape, 2))
+    img_model.factor = 3
+
+    images = img_model.get_series_images([1, 2])
+    assert images.shape == (2,) + img_model.img_data.shape
+    assert img_model.series_pos == 1
+
+    img_model.load_series_img(3)
+    assert np.array_equal(images[1], img_model.img_data)
+
+
+def test_get_frame_count():
+    img_model = ImgModel()
+    assert img_model.get_frame_count(os.path.join(data_path, 'CeO2_Pilatus1M.tif')) == 1
+    assert img_model.get_frame_count(
+        os.path.join(data_path, 'lambda', 'testasapo1_1009_00002_m1_part00000.nxs')) == 10
+    assert img_model.get_frame_count(os.path.join(data_path, 'hdf5_dataset', 'ma4500_demoh5.h5')) == 2
+    assert img_model.filename == ''
+
+
+def test_get_image_data_uses_remembered_loader():
+    from ...model.ImgModel import image_loader_registry
+    image_loader_registry.clear()
+    img_model = ImgModel()
+    filename = os.path.join(data_path, 'CeO2_Pilatus1M.tif')
+    img_model.load(filename)
+    assert image_loader_registry.get_remembered(filename) == 'load_PIL'
+
+    img_model.load_PIL = MagicMock(return_value=None)
+    img_model.load_spe = MagicMock(return_value=None)
+    img_model.load(filename)  # falls back to the other loaders
+    assert img_model.load_PIL.call_count == 1
+    assert img_model.load_spe.call_count == 1
+    assert image_loader_registry.get_remembered(filename) == 'load_fabio'
+    assert img_model.img_data.shape == (1043, 981)
+
+    img_model.load(filename)
+    assert img_model.load_PIL.call_count == 2  # PIL keeps its precedence over the fallback loader fabio
+    assert img_model.load_spe.call_count == 1
+    image_loader_registry.clear()
+
+
+def test_get_image_data_keeps_loader_precedence_for_hdf5(tmp_path):
+    from ...model.ImgModel import image_loader_registry
+    image_loader_registry.clear()
+    data = np.arange(2 * 20 * 30, dtype=np.uint16).reshape(2, 20, 30)
+    filenames = [str(tmp_path / 'image_{}.h5'.format(ind)) for ind in range(2)]
+    for filename in filenames:
+        with h5py.File(filename, 'w') as f:
+            f.create_dataset('entry/data/data', data=data)
+
+    # Eiger style files are read by fabio as before, also when the generic hdf5 loader was remembered
+    image_loader_registry.remember(filenames[0], 'load_hdf5')
+    img_model = ImgModel()
+    img_model.load(filenames[1])
+    assert image_loader_registry.get_remembered(filenames[1]) == 'load_fabio'
+    assert np.array_equal(img_model.untransformed_raw_img_data, data[0][::-1])
+
+    for loader_name in ['load_lambda', 'load_karabo', 'load_hdf5']:
+        setattr(img_model, loader_name, MagicMock(return_value=None))
+    img_model.load(filenames[0])
+    for loader_name in ['load_lambda', 'load_karabo', 'load_hdf5']:
+        assert getattr(img_model, loader_name).call_count == 0
+    image_loader_registry.clear()
+
+
+def test_get_image_data_reads_generic_hdf5_files_with_hdf5_loader(tmp_path):
+    data = np.arange(2 * 20 * 30, dtype=np.uint16).reshape(2, 20, 30)
+    filename = str(tmp_path / 'image.h5')
+    with h5py.File(filename, 'w') as f:
+        f.create_dataset('measurement/image', data=data)
+
+    img_model = ImgModel()
+    for loader_name in ['load_fabio', 'load_lambda', 'load_karabo']:
+        setattr(img_model, loader_name, MagicMock(return_value=None))
+    img_model.load(filename)
+    for loader_name in ['load_fabio', 'load_lambda', 'load_karabo']:
+        assert getattr(img_model, loader_name).call_count == 0
+    assert np.array_equal(img_model.untransformed_raw_img_data, data[0])
+
+
+def test_get_image_data_raises_loader_errors(tmp_path):
+    img_model = ImgModel()
+    img_model.load_PIL = MagicMock(side_effect=ValueError("corrupt image"))
+    with pytest.raises(ValueError):
+        img_model.load(os.path.join(data_path, 'CeO2_Pilatus1M.tif'))
+
+
+def test_get_image_data_raises_file_errors(tmp_path):
+    img_model = ImgModel()
+    with pytest.raises(FileNotFoundError):
+        img_model.load(str(tmp_path / 'missing.tif'))
+
+    img_model.load_PIL = MagicMock(side_effect=PermissionError("no access"))
+    with pytest.raises(PermissionError):
+        img_model.load(os.path.join(data_path, 'CeO2_Pilatus1M.tif'))
+
+
+def test_next_files_are_prefetched(tmp_path):
+    from PIL import Image
+    for ind in range(1, 5):
+        Image.fromarray(np.full((10, 20), ind, dtype=np.uint16)).save(
+            os.path.join(str(tmp_path), 'image_{:03d}.tif'.format(ind)))
+    img_model = ImgModel()
+    img_model.load(os.path.join(str(tmp_path), 'image_001.tif'))
+    img_model.load_next_file()
+
+    next_keys = [img_model._get_file_key(os.path.join(str(tmp_path), 'image_{:03d}.tif'.format(ind))) + (0,)
+                 for ind in (3, 4)]
+    assert all(key in img_model.file_prefetcher for key in next_keys)
+
+    img_model.get_image_data = MagicMock(side_effect=img_model.get_image_data)
+    img_model.load_next_file()
+    assert np.all(img_model.img_data == 3)
+    img_model.load_next_file()
+    assert np.all(img_model.img_data == 4)
+    img_model.get_image_data.assert_not_called()
+    assert img_model.file_prefetcher.hits == 2
+
+    img_model.load_previous_file()  # reversing the direction is not predicted
+    assert np.all(img_model.img_data == 3)
+    assert img_model.file_prefetcher.hits == 2
+
+
+def test_next_frames_are_prefetched():
+    img_model = ImgModel()
+    img_model.frame_cache.clear()
+    img_model.load(os.path.join(data_path, 'lambda', 'testasapo1_1009_00002_m1_part00000.nxs'))
+    expected = img_model.series_get_image(2)
+    img_model.load_series_img(2)
+    assert img_model._get_frame_key(2) in img_model.frame_prefetcher
+
+    img_model.load_series_img(3)
+    assert np.array_equal(img_model.untransformed_raw_img_data, expected)
+    assert img_model._get_frame_key(2) in img_model.frame_cache
+    img_model.frame_prefetcher.shutdown(wait=True)
+
+
+def test_series_reads_do_not_use_the_loader_concurrently(tmp_path, monkeypatch):
+    import threading
+    import time
+    from ...model.loader.hdf5Loader import Hdf5Image
+
+    filename = os.path.join(str(tmp_path), 'series.h5')
+    with h5py.File(filename, 'w') as f:
+        f.create_dataset('series/images', data=np.arange(8 * 20 * 30, dtype=np.uint16).reshape(8, 20, 30))
+
+    lock = threading.Lock()
+    active = []
+    max_active = []
+
+    def track(func):
+        def wrapper(*args):
+            with lock:
+                active.append(1)
+                max_active.append(len(active))
+            time.sleep(0.02)
+            try:
+                return func(*args)
+            finally:
+                with lock:
+                    active.pop()
+        return wrapper
+
+    monkeypatch.setattr(Hdf5Image, 'get_image', track(Hdf5Image.get_image))
+    monkeypatch.setattr(Hdf5Image, 'get_images', track(Hdf5Image.get_images))
+
+    img_model = ImgModel()
+    img_model.frame_cache.clear()
+    img_model.load(filename)
+    for pos in range(2, 6):
+        img_model.load_series_img(pos)  # starts prefetching the next frames
+        img_model.get_series_images([0, 1, 7])
+    img_model.combine_series_images('mean', block_size=3)
+    img_model.frame_prefetcher.shutdown(wait=True)
+
+    assert max(max_active) == 1
+
+
+def test_frames_of_the_current_file_are_cached():
+    filename = os.path.join(data_path, 'lambda', 'testasapo1_1009_00002_m1_part00000.nxs')
+    img_model = ImgModel()
+    img_model.num_prefetch = 0
+    img_model.frame_cache.clear()
+    img_model.load(filename, 3)
+    expected = np.copy(img_model.untransformed_raw_img_data)
+
+    img_model.get_image_data = MagicMock()
+    img_model.series_get_image = MagicMock(side_effect=img_model.series_get_image)
+    img_model._file_data["series_get_image"] = img_model.series_get_image
+    img_model.load(filename, 4)  # e.g. from the batch or map view, the open file is reused
+    img_model.load(filename, 3)
+    img_model.load_series_img(5)
+    img_model.load_series_img(4)
+    img_model.get_image_data.assert_not_called()
+    assert img_model.series_get_image.call_count == 1
+    assert img_model.series_pos == 4
+    assert np.array_equal(img_model.untransformed_raw_img_data, expected)
+    assert img_model.frame_cache.get_statistics()["hits"] >= 2
+
+    img_model.add(filename)  # cached frames are not changed
+    assert np.array_equal(img_model.frame_cache.get(img_model._get_frame_key(3)), expected)
+    img_model.frame_cache.clear()
+
+
+def test_combine_files(tmp_path):
+    images = np.random.RandomState(0).randint(0, 60000, (5, 8, 10)).astype(np.uint16)
+    filenames = []
+    for ind, img_data in enumerate(images):
+        filenames.append(os.path.join(str(tmp_path), 'image_{:03d}.tif'.format(ind)))
+        Image.fromarray(img_data).save(filenames[-1])
+
+    img_model = ImgModel()
+    img_model.rotate_img_p90()
+    loaded_images = []
+    for filename in filenames:
+        img_model.load(filename)
+        loaded_images.append(img_model.raw_img_data)
+    listener = MagicMock()
+    img_model.img_changed.connect(listener)
+
+    img_model.combine_files(filenames, 'sum')
+    assert np.array_equal(img_model.raw_img_data, np.sum(loaded_images, axis=0, dtype=np.int64))
+    assert img_model.filename == filenames[0]
+    listener.assert_called_once_with()
+
+    img_model.combine_files(filenames, 'mean')
+    assert np.allclose(img_model.raw_img_data, np.mean(loaded_images, axis=0))
+
+
+def test_combine_series_images_rejects_zingers(tmp_path):
+    images = np.random.RandomState(0).poisson(100, (40, 12, 16)).astype(np.uint16)
+    images[7, 3, 4] = 60000
+    images[30, 5, 9] = 50000
+    filename = os.path.join(str(tmp_path), 'series.h5')
+    with h5py.File(filename, 'w') as f:
+        f.create_dataset('entry/data', data=images)
+
+    img_model = ImgModel()
+    img_model.load(filename)
+    img_model.flip_img_vertically()
+    expected_mean = np.mean(img_model.get_series_images(range(5)), axis=0)
+    listener = MagicMock()
+    img_model.img_changed.connect(listener)
+
+    img_model.combine_series_images('mad_clip', block_size=16)
+    listener.assert_called_once_with()
+    assert img_model.raw_img_data.shape == (12, 16)
+    assert np.all(np.abs(img_model.raw_img_data - 100) < 15)
+
+    img_model.combine_series_images('mean', positions=range(5))
+    assert np.allclose(img_model.raw_img_data, expected_mean)
+
+    listener.reset_mock()
+    img_model.combine_files([filename], 'mad_clip')  # a single series file combines its images
+    listener.assert_called_once_with()
+    assert np.all(np.abs(img_model.raw_img_data - 100) < 15)
+
+
+def test_loading_lambda_images_in_blocks():
+    img_model = ImgModel()
+    img_model.load(os.path.join(data_path, 'lambda', 'testasapo1_1009_00002_m1_part00000.nxs'))
+    assert img_model.series_max == 10
+    assert img_model.series_get_images is not None
+
+    single_images = np.array([img_model.series_get_image(pos) for pos in range(10)])
+    assert single_images.dtype == np.int16
+    assert np.array_equal(img_model.series_get_images(2, 7), single_images[2:7])
+    assert np.array_equal(img_model.get_series_images([3, 4, 5, 8]), single_images[[3, 4, 5, 8]])
+
+    out = img_model.series_get_image(1)
+    assert img_model.series_get_image(6, out=out) is out
+    assert np.array_equal(out, single_images[6])
+
+
+def test_loading_multi_frame_spe_file(tmp_path):
+    with open(os.path.join(spe_path, 'CeO2_PI_CCD_Mo.SPE'), 'rb') as f:
+        header = bytearray(f.read(4100))
+        frame = np.frombuffer(f.read(), dtype=np.uint16)
+    header[1446:1450] = np.int32(3).tobytes()
+    filename = os.path.join(str(tmp_path), 'multi_frame.spe')
+    with open(filename, 'wb') as f:
+        f.write(bytes(header))
+        for ind in range(3):
+            f.write((frame + ind).astype(np.uint16).tobytes())
+
+    img_model = ImgModel()
+    assert img_model.get_frame_count(filename) == 3
+    img_model.load(filename)
+    assert img_model.series_max == 3
+    first_frame = np.copy(img_model.untransformed_raw_img_data)
+    img_model.load_series_img(3)
+    assert np.array_equal(img_model.untransformed_raw_img_data, first_frame + 2)
+    img_model.frame_prefetcher.shutdown(wait=True)
+
+
+def test_loading_multi_frame_edf_file_memory_mapped(tmp_path):
+    from fabio.edfimage import EdfImage
+    edf_image = EdfImage(data=np.arange(12, dtype=np.uint16).reshape(3, 4))
+    edf_image.append_frame(data=np.arange(12, dtype=np.uint16).reshape(3, 4) * 2)
+    filename = os.path.join(str(tmp_path), 'multi_frame.edf')
+    edf_image.write(filename)
+
+    img_model = ImgModel()
+    img_model.load(filename, 1)
+    assert img_model.series_max == 2
+    assert img_model.loader._frame_layout is not None
+    assert np.array_equal(img_model.untransformed_raw_img_data, np.arange(12).reshape(3, 4)[::-1] * 2)
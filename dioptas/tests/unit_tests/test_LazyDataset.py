@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+# Dioptas - GUI program for fast processing of 2D X-ray diffraction data
+# Principal author: Clemens Prescher (clemens.prescher@gmail.com)
+# Copyright (C) 2014-2019 GSECARS, University of Chicago, USA
+# Copyright (C) 2015-2018 Institute for Geology and Mineralogy, University of Cologne, Germany
+# Copyright (C) 2019-2020 DESY, Hamburg, Germany
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+
+import h5py
+import numpy as np
+import pytest
+
+from ...model.util.LazyDataset import LazyDataset
+
+
+@pytest.fixture
+def h5_data(tmp_path):
+    data = np.arange(100 * 30, dtype=np.float64).reshape(100, 30)
+    with h5py.File(os.path.join(tmp_path, "data.h5"), "w") as f:
+        f.create_dataset("data", data=data)
+    f = h5py.File(os.path.join(tmp_path, "data.h5"), "r")
+    yield data, f["data"]
+    f.close()
+
+
+def test_indexing_is_equal_to_numpy(h5_data):
+    data, dataset = h5_data
+    lazy_data = LazyDataset(dataset, block_rows=8, max_blocks=4)
+
+    assert lazy_data.shape == data.shape
+    assert len(lazy_data) == 100
+    assert lazy_data.size == data.size
+
+    for key in [5, -1, (7, 3), (slice(3, 40), slice(2, 9)), slice(None), slice(90, 200),
+                (slice(5, 80, 3), 4), slice(0, 100, 20), slice(50, 10, -4), slice(30, 30)]:
+        assert np.array_equal(lazy_data[key], data[key])
+    assert np.array_equal(np.asarray(lazy_data), data)
+    assert np.array_equal(np.array([row for row in lazy_data]), data)
+
+    with pytest.raises(IndexError):
+        lazy_data[100]
+
+
+def test_only_needed_blocks_are_read_and_cached(h5_data):
+    data, dataset = h5_data
+    lazy_data = LazyDataset(dataset, block_rows=10, max_blocks=3)
+
+    lazy_data[12:28]
+    assert list(lazy_data._blocks.keys()) == [1, 2]
+    lazy_data[25]
+    assert list(lazy_data._blocks.keys()) == [1, 2]
+    lazy_data[55:75]
+    assert list(lazy_data._blocks.keys()) == [5, 6, 7]
+
+    row = lazy_data[55]
+    row[:] = -1
+    assert np.array_equal(lazy_data[55], data[55])
+
+
+def test_assignment_reads_data_into_memory(h5_data):
+    data, dataset = h5_data
+    lazy_data = LazyDataset(dataset, block_rows=10)
+    assert not lazy_data.in_memory
+
+    lazy_data[5:10] = 1.0
+    assert lazy_data.in_memory
+    assert np.all(lazy_data[5:10] == 1.0)
+    assert np.array_equal(lazy_data[20:], data[20:])
+    assert np.array_equal(dataset[5:10], data[5:10])
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+# Dioptas - GUI program for fast processing of 2D X-ray diffraction data
+# Principal author: Clemens Prescher (clemens.prescher@gmail.com)
+# Copyright (C) 2014-2019 GSECARS, University of Chicago, USA
+# Copyright (C) 2015-2018 Institute for Geology and Mineralogy, University of Cologne, Germany
+# Copyright (C) 2019-2020 DESY, Hamburg, Germany
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+
+import h5py
+import numpy as np
+import pytest
+
+from ...model.loader.LoaderRegistry import LoaderRegistry, HDF5_SIGNATURE, is_pil_image, is_spe, is_fabio_image, \
+    is_hdf5, get_hdf5_layout
+
+
+@pytest.fixture
+def registry():
+    registry = LoaderRegistry()
+    registry.register("PIL", is_pil_image)
+    registry.register("spe", is_spe)
+    registry.register("fabio", is_fabio_image, fallback=True, layouts=("eiger", "lima"))
+    registry.register("lambda", is_hdf5, layouts=("lambda",))
+    registry.register("karabo", is_hdf5, layouts=("karabo",))
+    registry.register("hdf5", is_hdf5, fallback=True, layouts=("hdf5",))
+    registry.register_sniffer(is_hdf5, get_hdf5_layout)
+    return registry
+
+
+def write_file(tmp_path, name, content):
+    filename = os.path.join(str(tmp_path), name)
+    with open(filename, "wb") as f:
+        f.write(content)
+    return filename
+
+
+def test_candidates_from_extension_and_header(registry, tmp_path):
+    tif_file = write_file(tmp_path, "image.tif", b"II*\x00" + bytes(100))
+    edf_file = write_file(tmp_path, "image.edf", b"{\nHeaderID = EH:000001:000000:000000 ;")
+    spe_file = write_file(tmp_path, "image.spe", bytes(100))
+    h5_file = write_file(tmp_path, "image.h5", HDF5_SIGNATURE + bytes(100))
+
+    assert registry.get_candidates(tif_file) == ["PIL", "spe", "fabio", "lambda", "karabo", "hdf5"]
+    assert registry.get_candidates(edf_file) == ["fabio", "PIL", "spe", "lambda", "karabo", "hdf5"]
+    assert registry.get_candidates(spe_file)[:2] == ["spe", "fabio"]
+    # HDF5 files which can not be inspected are tried in the registration order
+    assert registry.get_candidates(h5_file) == ["fabio", "lambda", "karabo", "hdf5", "PIL", "spe"]
+    assert registry.get_candidates(os.path.join(str(tmp_path), "missing.tif"))[0] == "PIL"
+
+
+def write_hdf5_file(tmp_path, name, datasets, attrs=None):
+    filename = os.path.join(str(tmp_path), name)
+    with h5py.File(filename, "w") as f:
+        for path, data in datasets.items():
+            f[path] = data
+        f.attrs.update(attrs or {})
+    return filename
+
+
+def test_hdf5_candidates_from_file_layout(registry, tmp_path):
+    image = np.zeros((1, 4, 5), dtype=np.uint16)
+    eiger_file = write_hdf5_file(tmp_path, "eiger.h5", {"entry/data/data_000001": image})
+    lima_file = write_hdf5_file(tmp_path, "lima.h5", {"scan/measurement/data": image}, {"default": "scan"})
+    lambda_file = write_hdf5_file(tmp_path, "lambda.nxs", {"entry/instrument/detector/description": "Lambda",
+                                                           "entry/instrument/detector/data": image})
+    karabo_file = write_hdf5_file(tmp_path, "karabo.h5", {"INDEX/trainId": np.arange(3)})
+    other_file = write_hdf5_file(tmp_path, "other.h5", {"measurement/image": image})
+
+    assert get_hdf5_layout(eiger_file) == "eiger"
+    assert get_hdf5_layout(lima_file) == "lima"
+    assert get_hdf5_layout(lambda_file) == "lambda"
+    assert get_hdf5_layout(karabo_file) == "karabo"
+    assert get_hdf5_layout(other_file) == "hdf5"
+
+    # fabio is tried first for the files it can read, as in the registration order
+    assert registry.get_candidates(eiger_file) == ["fabio", "lambda", "karabo", "hdf5", "PIL", "spe"]
+    assert registry.get_candidates(lima_file) == ["fabio", "lambda", "karabo", "hdf5", "PIL", "spe"]
+    # the loader matching the layout is tried first, the other ones follow as fallback
+    assert registry.get_candidates(lambda_file) == ["lambda", "fabio", "karabo", "hdf5", "PIL", "spe"]
+    assert registry.get_candidates(karabo_file) == ["karabo", "fabio", "lambda", "hdf5", "PIL", "spe"]
+    assert registry.get_candidates(other_file) == ["hdf5", "fabio", "lambda", "karabo", "PIL", "spe"]
+
+    # the layout has precedence over a remembered loader
+    registry.remember(other_file, "karabo")
+    assert registry.get_candidates(other_file)[0] == "hdf5"
+
+
+def test_hdf5_layout_is_sniffed_once_per_file_version(tmp_path):
+    sniffed = []
+    registry = LoaderRegistry()
+    registry.register("lambda", is_hdf5, layouts=("lambda",))
+    registry.register("hdf5", is_hdf5, fallback=True, layouts=("hdf5",))
+    registry.register_sniffer(is_hdf5, lambda filename: sniffed.append(filename) or get_hdf5_layout(filename))
+
+    image = np.zeros((1, 4, 5), dtype=np.uint16)
+    filename = write_hdf5_file(tmp_path, "image.nxs", {"measurement/image": image})
+    assert registry.get_candidates(filename) == ["hdf5", "lambda"]
+    assert registry.get_candidates(filename) == ["hdf5", "lambda"]
+    assert len(sniffed) == 1
+
+    # a rewritten file is sniffed again
+    write_hdf5_file(tmp_path, "image.nxs", {"entry/instrument/detector/description": "Lambda",
+                                            "entry/instrument/detector/data": image})
+    stat = os.stat(filename)
+    os.utime(filename, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    assert registry.get_candidates(filename) == ["lambda", "hdf5"]
+    assert len(sniffed) == 2
+
+
+def test_remembered_loader_is_tried_first_within_its_precedence(registry, tmp_path):
+    h5_file = write_file(tmp_path, "image_001.h5", HDF5_SIGNATURE + bytes(100))
+    other_h5_file = write_file(tmp_path, "image_002.h5", HDF5_SIGNATURE + bytes(100))
+    tif_file = write_file(tmp_path, "image_001.tif", b"II*\x00" + bytes(100))
+    edf_file = write_file(tmp_path, "image_001.edf", b"{\nHeaderID = EH:000001:000000:000000 ;")
+
+    registry.remember(h5_file, "karabo")
+    assert registry.get_remembered(other_h5_file) == "karabo"
+    assert registry.get_candidates(other_h5_file) == ["fabio", "karabo", "lambda", "hdf5", "PIL", "spe"]
+    # only the same extension in the same directory is affected
+    assert registry.get_candidates(tif_file)[0] == "PIL"
+
+    # a generic loader is never tried before the specific loaders preceding it
+    registry.remember(h5_file, "hdf5")
+    assert registry.get_candidates(other_h5_file) == ["fabio", "lambda", "karabo", "hdf5", "PIL", "spe"]
+
+    # undetected loaders are tried first among the undetected loaders
+    registry.remember(edf_file, "karabo")
+    assert registry.get_candidates(edf_file) == ["fabio", "karabo", "PIL", "spe", "lambda", "hdf5"]
+
+    registry.clear()
+    assert registry.get_remembered(other_h5_file) is None
+
+
+def test_remembered_entries_are_limited(registry, tmp_path):
+    registry.max_entries = 2
+    for ind in range(3):
+        registry.remember(os.path.join(str(tmp_path), "image.ext{}".format(ind)), "fabio")
+    assert registry.get_remembered(os.path.join(str(tmp_path), "image.ext0")) is None
+    assert registry.get_remembered(os.path.join(str(tmp_path), "image.ext2")) == "fabio"
@@ -43,6 +43,21 @@ def test_create_map(map_model: MapModel2, configuration: Configuration):
     assert map_model.map.shape == (3, 3)
 
 
+def test_map_patterns_are_not_trimmed(map_model: MapModel2, configuration: Configuration):
+    configuration.calibration_model.load(
+        os.path.join(unittest_data_path, "CeO2_Pilatus1M.poni")
+    )
+    configuration.trim_trailing_zeros = True
+    map_model.load(map_img_file_paths)
+    assert configuration.trim_trailing_zeros
+
+    configuration.trim_trailing_zeros = False
+    configuration.img_model.load(map_img_file_paths[0])
+    x, y = configuration.integrate_image_1d()
+    assert np.allclose(map_model.pattern_x, x)
+    assert np.allclose(map_model.pattern_intensities[0], y)
+
+
 def test_load_empty_filelist(map_model: MapModel2, configuration: Configuration):
     with pytest.raises(ValueError):
         map_model.load([])
@@ -148,12 +163,16 @@ def test_integrates_each_image_only_once(
     )
     x = np.linspace(0, 10, 100)
     y = np.sin(x)
-    configuration.calibration_model.integrate_1d = MagicMock(return_value=(x, y))
+    configuration.calibration_model.integrate_1d_stack = MagicMock(
+        side_effect=lambda images, **kwargs: (x, np.tile(y, (len(images), 1)))
+    )
     map_model.load(map_img_file_paths)
 
-    assert configuration.calibration_model.integrate_1d.call_count == len(
-        map_img_file_paths
-    )
+    integrated_images = [
+        len(call.args[0])
+        for call in configuration.calibration_model.integrate_1d_stack.call_args_list
+    ]
+    assert integrated_images == [1] * len(map_img_file_paths)
 
 
 def test_emits_point_integrated_signal(
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+# Dioptas - GUI program for fast processing of 2D X-ray diffraction data
+# Principal author: Clemens Prescher (clemens.prescher@gmail.com)
+# Copyright (C) 2014-2019 GSECARS, University of Chicago, USA
+# Copyright (C) 2015-2018 Institute for Geology and Mineralogy, University of Cologne, Germany
+# Copyright (C) 2019-2020 DESY, Hamburg, Germany
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import numpy as np
+import pytest
+from pyFAI.azimuthalIntegrator import AzimuthalIntegrator
+
+from ...model.util.PixelGeometry import PixelGeometryCache, copy_geometry
+
+
+@pytest.fixture
+def geometry():
+    geometry = AzimuthalIntegrator(dist=0.1, poni1=0.001, poni2=0.002, pixel1=1e-4, pixel2=1e-4, wavelength=0.3e-10)
+    return geometry
+
+
+def test_arrays_are_cached_per_geometry_and_shape(geometry):
+    cache = PixelGeometryCache()
+    tth = cache.get("tth", geometry, (30, 40))
+    assert tth.dtype == np.float32
+    assert not tth.flags.writeable
+    assert np.allclose(tth, geometry.twoThetaArray((30, 40)))
+    assert np.allclose(cache.get("chi", geometry, (30, 40)), geometry.chiArray((30, 40)))
+    assert cache.get("tth", geometry, (30, 40)) is tth
+    assert cache.hits == 1 and cache.misses == 2
+
+    # arrays with another shape are calculated without resetting the shared geometry
+    geometry_tth = geometry.twoThetaArray((30, 40))
+    engine = object()
+    geometry.engines["engine"] = engine
+    other_tth = cache.get("tth", geometry, (20, 20))
+    assert other_tth.shape == (20, 20)
+    assert np.allclose(other_tth, copy_geometry(geometry).twoThetaArray((20, 20)))
+    assert geometry.twoThetaArray((30, 40)) is geometry_tth
+    assert geometry.engines["engine"] is engine
+    del geometry.engines["engine"]
+
+    geometry.dist = 0.2
+    geometry.reset()
+    new_tth = cache.get("tth", geometry, (30, 40))
+    assert new_tth is not tth
+    assert np.allclose(new_tth, geometry.twoThetaArray((30, 40)))
+
+    cache.clear()
+    assert len(cache) == 0
+
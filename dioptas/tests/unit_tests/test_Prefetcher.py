@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+# Dioptas - GUI program for fast processing of 2D X-ray diffraction data
+# Principal author: Clemens Prescher (clemens.prescher@gmail.com)
+# Copyright (C) 2014-2019 GSECARS, University of Chicago, USA
+# Copyright (C) 2015-2018 Institute for Geology and Mineralogy, University of Cologne, Germany
+# Copyright (C) 2019-2020 DESY, Hamburg, Germany
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import threading
+
+import numpy as np
+
+from ...model.util.Prefetcher import Prefetcher
+
+
+def test_prefetched_data_is_handed_out_once():
+    prefetcher = Prefetcher()
+    loaded = []
+
+    def load(value):
+        loaded.append(threading.current_thread())
+        return np.full(10, value)
+
+    for value in range(3):
+        prefetcher.prefetch(value, load, value)
+    prefetcher.prefetch(0, load, 0)  # already requested
+
+    assert np.array_equal(prefetcher.pop(1), np.full(10, 1))
+    assert prefetcher.pop(1) is None
+    assert np.array_equal(prefetcher.pop(2), np.full(10, 2))
+    assert prefetcher.pop(5) is None
+    assert prefetcher.hits == 2
+    assert prefetcher.misses == 2
+    assert len(loaded) == 3
+    assert threading.current_thread() not in loaded
+    prefetcher.shutdown(wait=True)
+
+
+def test_failed_requests_return_none():
+    prefetcher = Prefetcher()
+
+    def load():
+        raise IOError("file not found")
+
+    prefetcher.prefetch("file", load)
+    assert prefetcher.pop("file") is None
+    assert "file" not in prefetcher
+    prefetcher.shutdown(wait=True)
+
+
+def test_memory_is_limited():
+    prefetcher = Prefetcher(num_workers=1, max_bytes=250)
+    for value in range(4):
+        prefetcher.prefetch(value, np.zeros, 10)  # 80 bytes each
+    prefetcher.shutdown(wait=True)
+    assert prefetcher.nbytes == 0  # shutdown clears the cache
+
+
+def test_retain_and_clear_cancel_requests():
+    prefetcher = Prefetcher(num_workers=1, max_bytes=250)
+    event = threading.Event()
+    prefetcher.prefetch("blocking", event.wait, 5)
+    prefetcher.prefetch("first", np.zeros, 10)
+    prefetcher.prefetch("second", np.zeros, 10)
+
+    prefetcher.retain(["blocking", "second"])
+    assert "first" not in prefetcher
+    assert "second" in prefetcher
+
+    prefetcher.clear()
+    event.set()
+    assert "blocking" not in prefetcher
+    assert prefetcher.pop("second") is None
+
+    for value in range(4):
+        prefetcher.prefetch(value, np.zeros, 10)  # 80 bytes each
+    prefetcher._executor.submit(lambda: None).result()  # waits for the queued requests of the single worker
+    assert prefetcher.nbytes <= 250
+    assert prefetcher.pop(0) is None  # least recently loaded is removed
+    assert np.array_equal(prefetcher.pop(3), np.zeros(10))
+    prefetcher.shutdown(wait=True)
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+# Dioptas - GUI program for fast processing of 2D X-ray diffraction data
+# Principal author: Clemens Prescher (clemens.prescher@gmail.com)
+# Copyright (C) 2014-2019 GSECARS, University of Chicago, USA
+# Copyright (C) 2015-2018 Institute for Geology and Mineralogy, University of Cologne, Germany
+# Copyright (C) 2019-2020 DESY, Hamburg, Germany
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import threading
+
+import numpy as np
+
+from ...model.util.WorkerThread import WorkerThread
+
+
+def run(worker, qtbot):
+    with qtbot.waitSignal(worker.job_finished, timeout=10000):
+        worker.start()
+    assert worker.isFinished()
+
+
+def test_job_runs_in_thread_and_publishes_results(qtbot):
+    threads = []
+
+    def job(callback_fn, result_fn):
+        threads.append(threading.current_thread())
+        for i in range(10):
+            result_fn(np.arange(5), np.full((2, 5), i), [(0, 2 * i), (0, 2 * i + 1)])
+            if not callback_fn(2 * (i + 1)):
+                break
+        return "result"
+
+    worker = WorkerThread(job, progress_interval=1000, result_interval=1000)
+    progress = []
+    results = []
+    worker.progress.connect(progress.append)
+    worker.partial_result.connect(lambda *result: results.append(result))
+    finished_threads = []
+    worker.job_finished.connect(lambda: finished_threads.append(threading.current_thread()))
+    run(worker, qtbot)
+
+    assert threads[0] is not threading.main_thread()
+    assert finished_threads == [threading.main_thread()]
+    assert worker.result == "result"
+    # rate limited: the first call and the final state are published
+    assert progress == [2, 20]
+    assert len(results) == 2
+    intensities = np.concatenate([result[1] for result in results])
+    pos_map = np.concatenate([result[2] for result in results])
+    assert np.array_equal(intensities[:, 0], np.repeat(np.arange(10), 2))
+    assert np.array_equal(pos_map[:, 1], np.arange(20))
+
+
+def test_job_is_cancelled(qtbot):
+    processed = []
+
+    def job(callback_fn, _):
+        for i in range(1000):
+            processed.append(i)
+            if not callback_fn(i):
+                break
+
+    worker = WorkerThread(job)
+    worker.cancel()
+    run(worker, qtbot)
+    assert worker.cancelled
+    assert processed == [0]
+
+
+def test_job_exception_is_stored(qtbot):
+    def job(callback_fn, result_fn):
+        raise ValueError("job failed")
+
+    worker = WorkerThread(job)
+    run(worker, qtbot)
+    assert isinstance(worker.exception, ValueError)
+    assert worker.result is None
@@ -1,4 +1,5 @@
 import os
+import numpy as np
 from dioptas.model.Configuration import Configuration
 from ..utility import unittest_data_path
 
@@ -26,3 +27,25 @@ def test_auto_save_background_subtracted_pattern(tmp_path):
     assert os.path.exists(os.path.join(tmp_path, "image_001.xy"))
     assert os.path.exists(os.path.join(tmp_path, "bkg_subtracted", "image_001.xy"))
 
+
+def test_integrate_image_stack_1d_trims_trailing_zeros():
+    config = Configuration()
+    config.calibration_model.load(os.path.join(unittest_data_path, "CeO2_Pilatus1M.poni"))
+    config.img_model.load(os.path.join(unittest_data_path, "CeO2_Pilatus1M.tif"))
+    img_data = config.img_model.img_data
+    tth = config.calibration_model.get_two_theta_array()
+    images = np.array([img_data * (tth < 0.5 * tth.max()), img_data * (tth < 0.7 * tth.max())])
+
+    config.trim_trailing_zeros = False
+    x, y = config.integrate_image_1d()
+    x_full, intensities_full = config.integrate_image_stack_1d(images)
+    assert np.allclose(x_full, x)
+    assert intensities_full.shape == (2, len(x))
+
+    # the patterns are trimmed to a common length
+    config.trim_trailing_zeros = True
+    x_trimmed, intensities = config.integrate_image_stack_1d(images)
+    assert len(x_trimmed) < len(x_full)
+    assert intensities.shape == (2, len(x_trimmed))
+    assert intensities[1, -1] != 0
+    assert np.allclose(intensities, intensities_full[:, :len(x_trimmed)])
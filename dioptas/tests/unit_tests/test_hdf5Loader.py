@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+# Dioptas - GUI program for fast processing of 2D X-ray diffraction data
+# Principal author: Clemens Prescher (clemens.prescher@gmail.com)
+# Copyright (C) 2014-2019 GSECARS, University of Chicago, USA
+# Copyright (C) 2015-2018 Institute for Geology and Mineralogy, University of Cologne, Germany
+# Copyright (C) 2019-2020 DESY, Hamburg, Germany
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import sys
+
+import h5py
+import numpy as np
+import pytest
+
+from ...model.loader.hdf5Loader import Hdf5Image, read_frames, FILTER_DEFLATE, FILTER_SHUFFLE, FILTER_BITSHUFFLE, \
+    _get_decodable_pipeline, find_image_sources, get_image_sources
+
+
+@pytest.fixture
+def images():
+    return np.random.RandomState(0).poisson(5, (11, 16, 12)).astype(np.uint32)
+
+
+@pytest.fixture
+def parallel_decoding(monkeypatch):
+    monkeypatch.setattr(sys.modules[read_frames.__module__], "PARALLEL_DECODE_MIN_CPUS", 1)
+
+
+@pytest.mark.parametrize("options, pipeline", [
+    (dict(chunks=(1, 16, 12), compression='gzip', shuffle=True), [FILTER_SHUFFLE, FILTER_DEFLATE]),
+    (dict(chunks=(4, 16, 12), compression='gzip'), [FILTER_DEFLATE]),
+    (dict(chunks=(3, 16, 12), shuffle=True, dtype='>u4'), [FILTER_SHUFFLE]),
+    (dict(chunks=(1, 16, 12), compression='lzf'), None),
+    (dict(chunks=(1, 8, 12), compression='gzip'), None),
+    (dict(), None),
+])
+def test_get_images(tmp_path, images, parallel_decoding, options, pipeline):
+    filename = os.path.join(str(tmp_path), 'images.h5')
+    with h5py.File(filename, 'w') as f:
+        f.create_dataset('entry/data', data=images, **options)
+
+    hdf5_image = Hdf5Image(filename)
+    assert _get_decodable_pipeline(hdf5_image.dataset) == pipeline
+    assert np.array_equal(hdf5_image.get_images(2, 9), images[2:9])
+    assert np.array_equal(hdf5_image.get_images(9, 20), images[9:])
+    assert hdf5_image.get_images(5, 5).shape == (0, 16, 12)
+
+    out = np.zeros((3, 16, 12), dtype=hdf5_image.dataset.dtype)
+    assert hdf5_image.get_images(0, 3, out) is out
+    assert np.array_equal(out, images[:3])
+    hdf5_image.f.close()
+
+
+def test_get_images_bitshuffle_lz4(tmp_path, images, parallel_decoding):
+    pytest.importorskip("bitshuffle")
+    import hdf5plugin
+
+    filename = os.path.join(str(tmp_path), 'images.h5')
+    with h5py.File(filename, 'w') as f:
+        f.create_dataset('entry/data', data=images, chunks=(1, 16, 12), **hdf5plugin.Bitshuffle(cname='lz4'))
+
+    hdf5_image = Hdf5Image(filename)
+    assert _get_decodable_pipeline(hdf5_image.dataset) == [FILTER_BITSHUFFLE]
+    assert np.array_equal(hdf5_image.get_images(2, 9), images[2:9])
+    hdf5_image.f.close()
+
+
+def test_get_images_with_missing_chunks(tmp_path, parallel_decoding):
+    filename = os.path.join(str(tmp_path), 'images.h5')
+    with h5py.File(filename, 'w') as f:
+        dataset = f.create_dataset('data', shape=(4, 5, 6), dtype=np.uint16, chunks=(1, 5, 6), compression='gzip')
+        dataset[1] = 7
+
+    with h5py.File(filename, 'r') as f:
+        images = read_frames(f['data'], 0, 4)
+    assert np.all(images[1] == 7)
+    assert np.all(images[[0, 2, 3]] == 0)
+
+
+def test_find_image_sources(tmp_path):
+    filename = os.path.join(str(tmp_path), 'sources.h5')
+    scan_filename = os.path.join(str(tmp_path), 'scan.h5')
+    with h5py.File(scan_filename, 'w') as f:
+        f.create_dataset('detector/data', data=np.zeros((2, 3, 4)))
+    with h5py.File(filename, 'w') as f:
+        f.create_dataset('a/images', data=np.zeros((2, 3, 4)))
+        f.create_dataset('a/spectrum', data=np.zeros((2, 3)))
+        f['b'] = h5py.ExternalLink(scan_filename, '/')
+        f['c'] = h5py.SoftLink('/a/images')
+
+    with h5py.File(filename, 'r') as f:
+        assert find_image_sources(f) == ['/a/images', '/b/detector/data', '/c']
+        assert find_image_sources(f, first_only=True) == ['/a/images']
+
+
+def test_find_image_sources_skips_dangling_and_cyclic_links(tmp_path):
+    filename = os.path.join(str(tmp_path), 'links.h5')
+    with h5py.File(filename, 'w') as f:
+        f.create_dataset('a/images', data=np.zeros((2, 3, 4)))
+        f['a/loop'] = h5py.SoftLink('/a')
+        f['b'] = h5py.ExternalLink(os.path.join(str(tmp_path), 'missing.h5'), '/')
+        f['c'] = h5py.SoftLink('/missing')
+
+    with h5py.File(filename, 'r') as f:
+        assert find_image_sources(f) == ['/a/images']
+
+
+def test_find_image_sources_uses_nexus_signal(tmp_path):
+    filename = os.path.join(str(tmp_path), 'nexus.h5')
+    with h5py.File(filename, 'w') as f:
+        f.create_dataset('entry/a_mask', data=np.zeros((2, 3, 4)))
+        f.create_dataset('entry/instrument/detector/data', data=np.ones((2, 3, 4)))
+        f.create_dataset('entry/data/background', data=np.zeros((2, 3, 4)))
+        f['entry/data/data'] = h5py.SoftLink('/entry/instrument/detector/data')
+        f['entry/data'].attrs['NX_class'] = 'NXdata'
+        f['entry/data'].attrs['signal'] = 'data'
+
+    with h5py.File(filename, 'r') as f:
+        # without default attributes, the first image dataset is the default source
+        assert find_image_sources(f, first_only=True) == ['/entry/a_mask']
+
+    with h5py.File(filename, 'a') as f:
+        f.attrs['default'] = 'entry'
+        f['entry'].attrs['default'] = 'data'
+
+    with h5py.File(filename, 'r') as f:
+        sources = find_image_sources(f)
+        assert sources[0] == '/entry/data/data'
+        assert sorted(sources[1:]) == ['/entry/a_mask', '/entry/data/background', '/entry/instrument/detector/data']
+
+
+def test_get_image_sources_is_cached(tmp_path):
+    filename = os.path.join(str(tmp_path), 'sources.h5')
+    with h5py.File(filename, 'w') as f:
+        f.create_dataset('a', data=np.zeros((2, 3, 4)))
+        f.create_dataset('b', data=np.zeros((2, 3, 4)))
+
+    assert get_image_sources(filename, complete=False) == ['/a']
+    hdf5_image = Hdf5Image(filename)
+    assert hdf5_image.image_sources == ['/a']
+    assert hdf5_image.find_all_image_sources() == ['/a', '/b']
+    hdf5_image.f.close()
+
+    # a changed file is searched again
+    os.remove(filename)
+    with h5py.File(filename, 'w') as f:
+        f.create_dataset('c', data=np.zeros((2, 3, 4)))
+    os.utime(filename, ns=(0, 0))
+    assert get_image_sources(filename) == ['/c']
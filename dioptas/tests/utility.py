@@ -23,6 +23,7 @@ from qtpy import QtWidgets, QtCore
 from qtpy.QtTest import QTest
 import os
 import shutil
+import time
 
 unittest_data_path = os.path.join(os.path.dirname(__file__), 'data')
 
@@ -61,6 +62,16 @@ def enter_value_into_text_field(text_field, value):
     QtWidgets.QApplication.processEvents()
 
 
+def wait_for_batch_job(batch_controller, timeout=60000):
+    """
+    Processes the events until the integration or background extraction of the batch controller is finished.
+    """
+    start = time.time()
+    while batch_controller.job_running and time.time() - start < timeout / 1000:
+        QTest.qWait(10)
+    assert not batch_controller.job_running
+
+
 class MockMouseEvent:
     def __init__(self, key=None, diff=None):
         self.key_value = key
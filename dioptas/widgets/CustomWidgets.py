@@ -66,6 +66,7 @@ class LabelExpandable(QtWidgets.QLineEdit):
 
 class CleanLooksComboBox(QtWidgets.QComboBox):
     cleanlooks = QtWidgets.QStyleFactory.create("motif")
+    popup_about_to_show = QtCore.Signal()
 
     def __init__(self, *args, **kwargs):
         super(CleanLooksComboBox, self).__init__(*args, **kwargs)
@@ -77,6 +78,7 @@ class CleanLooksComboBox(QtWidgets.QComboBox):
     def showPopup(self):
         if time.time() - self.popup_closed_time > 0.01:
             # prevents showing popup immediately after closing by clicking onto lineEdit.
+            self.popup_about_to_show.emit()
             super(CleanLooksComboBox, self).showPopup()
 
     def hidePopup(self):
@@ -208,9 +208,11 @@ def open_files_dialog(parent_widget, caption, directory, filter=None):
     return filenames
 
 
-def save_file_dialog(parent_widget, caption, directory, filter=None):
+def save_file_dialog(parent_widget, caption, directory, filter=None, confirm_overwrite=True):
+    # without confirmation the caller has to check existing files itself
+    options = {} if confirm_overwrite else {"options": QtWidgets.QFileDialog.DontConfirmOverwrite}
     filename = QtWidgets.QFileDialog.getSaveFileName(
-        parent_widget, caption, directory=directory, filter=filter
+        parent_widget, caption, directory=directory, filter=filter, **options
     )
     if isinstance(filename, tuple):  # PyQt5 returns a tuple...
         return set_extension(str(filename[0]), str(filename[1]))
@@ -136,6 +136,7 @@ class BatchWidget(QtWidgets.QWidget):
         self.control_widget.autoscale_btn.hide()
         self.control_widget.normalize_btn.hide()
         self.control_widget.integrate_btn.show()
+        self.control_widget.stream_cb.show()
 
     def activate_stack_plot(self):
         self.position_widget.step_raw_widget.hide()
@@ -152,6 +153,7 @@ class BatchWidget(QtWidgets.QWidget):
         self.control_widget.autoscale_btn.show()
         self.control_widget.normalize_btn.show()
         self.control_widget.integrate_btn.hide()
+        self.control_widget.stream_cb.hide()
 
     def activate_surface_view(self):
         self.position_widget.step_raw_widget.hide()
@@ -172,6 +174,7 @@ class BatchWidget(QtWidgets.QWidget):
         self.control_widget.autoscale_btn.hide()
         self.control_widget.normalize_btn.hide()
         self.control_widget.integrate_btn.hide()
+        self.control_widget.stream_cb.hide()
 
     def raise_widget(self):
         self.show()
@@ -540,6 +543,7 @@ class BatchControlWidget(QtWidgets.QWidget):
     def __init__(self):
         super(BatchControlWidget, self).__init__()
         self.integrate_btn = FlatButton("Integrate")
+        self.stream_cb = QtWidgets.QCheckBox("Stream to file")
         self.load_proc_btn = FlatButton("Load proc data")
 
         self.waterfall_btn = CheckableFlatButton("Waterfall")
@@ -558,6 +562,7 @@ class BatchControlWidget(QtWidgets.QWidget):
 
     def create_layout(self):
         self._layout.addWidget(self.integrate_btn)
+        self._layout.addWidget(self.stream_cb)
         self._layout.addWidget(self.calc_bkg_btn)
         self._layout.addWidget(self.waterfall_btn)
         self._layout.addWidget(self.phases_btn)
@@ -571,6 +576,10 @@ class BatchControlWidget(QtWidgets.QWidget):
     def set_tooltips(self):
         self.waterfall_btn.setToolTip("Create waterfall plot")
         self.calc_bkg_btn.setToolTip("Extract background")
+        self.stream_cb.setToolTip(
+            "Write the integrated patterns into a processed file while integrating.\n"
+            "An interrupted integration can be resumed from this file."
+        )
 
     def style_widgets(self):
         self._layout.setContentsMargins(6, 6, 6, 6)
@@ -112,6 +112,7 @@ class IntegrationWidget(QtWidgets.QWidget):
         self.img_batch_mode_integrate_rb = self.integration_control_widget.img_control_widget.batch_mode_integrate_rb
         self.img_batch_mode_add_rb = self.integration_control_widget.img_control_widget.batch_mode_add_rb
         self.img_batch_mode_average_rb = self.integration_control_widget.img_control_widget.batch_mode_average_rb
+        self.img_batch_mode_dezinger_rb = self.integration_control_widget.img_control_widget.batch_mode_dezinger_rb
         self.img_batch_mode_image_save_rb = self.integration_control_widget.img_control_widget.batch_mode_image_save_rb
 
         pattern_file_widget = self.integration_control_widget.pattern_control_widget.file_widget
@@ -45,6 +45,7 @@ class ImageWidget(QtWidgets.QWidget):
         self.batch_mode_integrate_rb = QtWidgets.QRadioButton("integrate")
         self.batch_mode_add_rb = QtWidgets.QRadioButton("add")
         self.batch_mode_average_rb = QtWidgets.QRadioButton("average")
+        self.batch_mode_dezinger_rb = QtWidgets.QRadioButton("dezinger")
         self.batch_mode_image_save_rb = QtWidgets.QRadioButton("save")
 
     def _create_layout(self):
@@ -59,6 +60,7 @@ class ImageWidget(QtWidgets.QWidget):
         self._batch_layout.addWidget(self.batch_mode_integrate_rb)
         self._batch_layout.addWidget(self.batch_mode_add_rb)
         self._batch_layout.addWidget(self.batch_mode_average_rb)
+        self._batch_layout.addWidget(self.batch_mode_dezinger_rb)
         self._batch_layout.addWidget(self.batch_mode_image_save_rb)
         self._batch_layout.addItem(HorizontalSpacerItem())
         self._batch_layout.addWidget(self.batch_btn)
@@ -83,5 +85,7 @@ class ImageWidget(QtWidgets.QWidget):
     def _set_tooltips(self):
         self.batch_mode_add_rb.setToolTip("Adds all images together")
         self.batch_mode_average_rb.setToolTip("Averages all images")
+        self.batch_mode_dezinger_rb.setToolTip("Averages all images (or all images of a single series file) and\n"
+                                               "rejects zingers and cosmic rays")
         self.batch_mode_integrate_rb.setToolTip("Integrates all images")
         self.batch_mode_image_save_rb.setToolTip("Saves all images")
\ No newline at end of file
@@ -143,12 +143,16 @@ class ImgWidget(QtCore.QObject):
             return
 
         view_x_range, view_y_range = self.img_view_box.viewRange()
-        if (
-            view_x_range[1] > self.img_data.shape[0]
-            and view_y_range[1] > self.img_data.shape[1]
-        ):
+        data_shape = self.get_data_shape()
+        if view_x_range[1] > data_shape[0] and view_y_range[1] > data_shape[1]:
             self.auto_range()
 
+    def get_data_shape(self):
+        """
+        :return: shape of the shown data in view coordinates
+        """
+        return self.img_data.shape
+
     def auto_level(self):
         colormap_range = utils.auto_level.get_range(
             self.img_histogram_LUT_horizontal.getImageData(copy=False)
@@ -198,9 +202,10 @@ class ImgWidget(QtCore.QObject):
         ):
             view_range = np.array(self.img_view_box.viewRange()) * 2
             if self.img_data is not None:
-                if (view_range[0][1] - view_range[0][0]) > self.img_data.shape[1] and (
+                data_shape = self.get_data_shape()
+                if (view_range[0][1] - view_range[0][0]) > data_shape[1] and (
                     view_range[1][1] - view_range[1][0]
-                ) > self.img_data.shape[0]:
+                ) > data_shape[0]:
                     self.auto_range()
                 else:
                     self.img_view_box.scaleBy((2, 2))
@@ -275,9 +280,10 @@ class ImgWidget(QtCore.QObject):
         else:
             view_range = np.array(self.img_view_box.viewRange())
             if self.img_data is not None:
-                if (view_range[0][1] - view_range[0][0]) > self.img_data.shape[1] and (
+                data_shape = self.get_data_shape()
+                if (view_range[0][1] - view_range[0][0]) > data_shape[1] and (
                     view_range[1][1] - view_range[1][0]
-                ) > self.img_data.shape[0]:
+                ) > data_shape[0]:
                     self.auto_range()
                 else:
                     pg.ViewBox.wheelEvent(self.img_view_box, ev)
@@ -621,10 +627,109 @@ class IntegrationBatchWidget(IntegrationCakeWidget):
         self.x_bin_range = [0, None]  # Range of shown bins
         self.pg_layout.removeItem(self.pg_layout.getItem(1, 2))  # remove the right LUT
 
+        # level of detail rendering of large batches from an image pyramid (see ImagePyramid)
+        self.pyramid = None
+        self.lod_mode = "max"  # pyramid mode (min, max or mean) used for reduced levels
+        self.lod_max_pixels = 2 ** 22  # larger images are shown with the level matching the zoom
+        self.lod_margin = 0.5  # part of the view range rendered additionally on each side
+        self._lod_window = None
+        self._lod_level = None
+        self._updating_lod = False
+        self.img_view_box.sigRangeChanged.connect(self.update_level_of_detail)
+
     def plot_image(self, img_data, auto_level=False, x_bin_range=[0, None]):
         self.x_bin_range = x_bin_range
+        self.pyramid = None
+        self.data_img_item.setTransform(QtGui.QTransform())
         super().plot_image(img_data, auto_level)
 
+    def plot_pyramid(self, pyramid, auto_level=False, x_bin_range=[0, None]):
+        """
+        Shows the image of an ImagePyramid. Images with more than lod_max_pixels pixels are rendered with the pyramid
+        level matching the current zoom, only the visible part (plus a margin) of fine levels is rendered.
+        :param pyramid: ImagePyramid with image rows as image number and columns as bins
+        :param auto_level: whether the colormap levels are set automatically
+        :param x_bin_range: range of shown bins
+        """
+        self.x_bin_range = x_bin_range
+        self.pyramid = pyramid
+        self._lod_window = None
+        self._lod_level = None
+        self.update_level_of_detail(full=self._max_range)
+        if auto_level:
+            self.auto_level()
+        self.auto_range_rescale()
+
+    def update_level_of_detail(self, *_, full=False):
+        """
+        Renders the pyramid level matching the current view range, if the rendered level or window has to change.
+        :param full: render the level matching the whole image instead of the current view range
+        """
+        if self.pyramid is None or self._updating_lod:
+            return
+        num_rows, num_cols = self.pyramid.shape
+        if num_rows == 0 or num_cols == 0:
+            return
+
+        if full:
+            view_window = (0, num_rows, 0, num_cols)
+        else:
+            (x_min, x_max), (y_min, y_max) = self.img_view_box.viewRange()
+            view_window = (max(y_min, 0), min(y_max, num_rows), max(x_min, 0), min(x_max, num_cols))
+            if view_window[0] >= view_window[1] or view_window[2] >= view_window[3]:
+                return
+
+        if num_rows * num_cols <= self.lod_max_pixels:
+            level = (0, 0)
+        else:
+            view_rect = self.img_view_box.sceneBoundingRect()
+            height = view_rect.height() if view_rect.height() > 1 else 1024
+            width = view_rect.width() if view_rect.width() > 1 else 1024
+            level = self.pyramid.get_level((view_window[1] - view_window[0]) / height,
+                                           (view_window[3] - view_window[2]) / width)
+
+        if level == self._lod_level and self._lod_window is not None and \
+                self._lod_window[0] <= view_window[0] and view_window[1] <= self._lod_window[1] and \
+                self._lod_window[2] <= view_window[2] and view_window[3] <= self._lod_window[3]:
+            return
+
+        level_shape = self.pyramid.level_shape(level)
+        if level_shape[0] * level_shape[1] <= self.lod_max_pixels:
+            render_window = (0, num_rows, 0, num_cols)
+        else:
+            row_margin = (view_window[1] - view_window[0]) * self.lod_margin
+            col_margin = (view_window[3] - view_window[2]) * self.lod_margin
+            render_window = (view_window[0] - row_margin, view_window[1] + row_margin,
+                             view_window[2] - col_margin, view_window[3] + col_margin)
+
+        img_data, window = self.pyramid.get_window(level, render_window[:2], render_window[2:], self.lod_mode)
+        self._updating_lod = True
+        try:
+            self.img_data = img_data
+            self.data_img_item.setImage(img_data.T, False)
+            self.data_img_item.setRect(QtCore.QRectF(window[2], window[0], window[3] - window[2],
+                                                     window[1] - window[0]))
+        finally:
+            self._updating_lod = False
+        self._lod_level = level
+        self._lod_window = window
+
+    def get_data_shape(self):
+        if self.pyramid is not None:
+            return self.pyramid.shape
+        return self.img_data.shape
+
+    def auto_range(self):
+        if self.pyramid is not None:
+            # the whole image has to be rendered to get its full bounds
+            self.update_level_of_detail(full=True)
+        super().auto_range()
+
+    def mouseMoved(self, pos):
+        # view coordinates, the image item can be scaled when showing a reduced pyramid level
+        pos = self.img_view_box.mapSceneToView(pos)
+        self.mouse_moved.emit(pos.x(), pos.y())
+
     def show_linear_region(self):
         self.img_view_box.addItem(self.linear_region_item)
 
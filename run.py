@@ -1,3 +1,5 @@
 from dioptas import main
 
-main()
+# the batch integration starts worker processes, which import this module again
+if __name__ == "__main__":
+    main()
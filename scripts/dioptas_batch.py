@@ -46,6 +46,7 @@ def integrate(args):
         pattern_geometry = None
 
         lambda_img = None
+        image = None
         while not data_to_process.empty():
 
             try:
@@ -56,10 +57,12 @@ def integrate(args):
 
             if lambda_img is None or lambda_img.file_list != file_list:
                 lambda_img = LambdaImage(file_list=file_list)
+                image = None
                 if lambda_img is None:
                     return
 
-            image = lambda_img.get_image(int(img_pos))
+            # the stitched image is only used for the integration, so the same buffer is reused for every image
+            image = lambda_img.get_image(int(img_pos), out=image)
 
             if mask is None and config['mask_file'] is not None:
                 mask_model.set_dimension(image.shape)